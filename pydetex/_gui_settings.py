@@ -22,12 +22,14 @@ from pydetex import __author__
 
 _SETTINGS_FILE = [os.path.join(ut.get_local_path(), '.pydetex.cfg')]
 _SETTINGS_TEST = os.path.join(ut.RESOURCES_PATH, '.pydetex.cfg')
+_STEM_CACHE_FILE = os.path.join(ut.get_local_path(), '.pydetex.stem')
 
 # Store the pipelines
 _PIPELINES = {
     'pipeline_simple': pip.simple,
     'pipeline_strict': pip.strict,
-    'pipeline_strict_eqn': pip.strict_eqn
+    'pipeline_strict_eqn': pip.strict_eqn,
+    'pipeline_fast': pip.fast
 }
 
 # Store the window sizes (w, h, height_richtext, margin_between_richtext, button_margin)
@@ -54,6 +56,7 @@ class _LangManager(object):
                 'about_author': 'Author',
                 'about_opened': 'Total app openings',
                 'about_processed': 'Total processed words',
+                'about_stem_cache': 'Stem cache: {0} words, {1}% hits',
                 'about_ver_dev': 'Development version',
                 'about_ver_err_conn': 'Cannot check for new versions (Connection Error)',
                 'about_ver_err_unkn': 'Cannot check for new versions (Unknown Error)',
@@ -117,6 +120,8 @@ class _LangManager(object):
                 'open_file': 'Open file',
                 'open_file_latex_file': 'LaTeX file',
                 'open_file_select': 'Select a LaTeX file',
+                'pipeline_fast': 'Fast',
+                'pipeline_fast_description': 'An approximate but much faster pipeline, which drops the equations, cites and references',
                 'pipeline_simple': 'Simple',
                 'pipeline_simple_description': 'Removes common Tex commands, replaces cites and references',
                 'pipeline_strict': 'Strict',
@@ -164,6 +169,7 @@ class _LangManager(object):
                 'about_author': 'Autor',
                 'about_opened': 'Nº ejecuciones app',
                 'about_processed': 'Nº palabras procesadas',
+                'about_stem_cache': 'Caché de raíces: {0} palabras, {1}% aciertos',
                 'about_ver_dev': 'Versión de desarrollo',
                 'about_ver_err_conn': 'No se pudo verificar nuevas versiones (Error de Conexión)',
                 'about_ver_err_unkn': 'No se pudo verificar nuevas versiones (Error desconocido)',
@@ -227,6 +233,8 @@ class _LangManager(object):
                 'open_file': 'Abrir archivo',
                 'open_file_latex_file': 'Archivo LaTeX',
                 'open_file_select': 'Selecciona un archivo LaTeX',
+                'pipeline_fast': 'Rápido',
+                'pipeline_fast_description': 'Pipeline aproximado pero mucho más rápido, que descarta las ecuaciones, citas y referencias',
                 'pipeline_simple': 'Simple',
                 'pipeline_simple_description': 'Elimina comandos Tex comunes, remplaza citas y referencias',
                 'pipeline_strict': 'Estricto',
@@ -306,6 +314,7 @@ class Settings(object):
     """
 
     _available_pipelines: List[str]
+    _ignore_file: bool
     _default_settings: Dict[str, Tuple[Any, Type, Union[List[Any], Callable[[Any], bool]]]]
     _lang: '_LangManager'
     _last_opened_day_diff: int
@@ -343,6 +352,7 @@ class Settings(object):
                 warn(error)
         else:
             _SETTINGS_FILE[0] = _SETTINGS_TEST
+        self._ignore_file = ignore_file
 
         # Creates the lang manager
         self._lang = _LangManager()
@@ -359,6 +369,7 @@ class Settings(object):
         self.CFG_PIPELINE_REPLACE_DEFS = 'PIPELINE_REPLACE_DEFS'
         self.CFG_PROCESS_AUTO_COPY = 'PROCESS_AUTO_COPY'
         self.CFG_SHOW_LINE_NUMBERS = 'SHOW_LINE_NUMBERS'
+        self.CFG_STEM_CACHE_PERSIST = 'STEM_CACHE_PERSIST'
         self.CFG_WINDOW_SIZE = 'WINDOW_SIZE'
 
         # Words repetition
@@ -394,6 +405,7 @@ class Settings(object):
             self.CFG_REPETITION_USE_STEMMING: (True, bool, [True, False]),
             self.CFG_REPETITION_USE_STOPWORDS: (True, bool, [True, False]),
             self.CFG_SHOW_LINE_NUMBERS: (True, bool, [True, False]),
+            self.CFG_STEM_CACHE_PERSIST: (True, bool, [True, False]),
             self.CFG_TOTAL_OPENED_APP: (0, int, lambda x: x >= 0),
             self.CFG_TOTAL_PROCESSED_WORDS: (0, int, lambda x: x >= 0),
             self.CFG_WINDOW_SIZE: (self._valid_window_sizes[1], str, self._valid_window_sizes)
@@ -426,6 +438,10 @@ class Settings(object):
         # Save the settings
         self.save()
 
+        # Warm-start the stemmed words
+        if not ignore_file and self.get(self.CFG_STEM_CACHE_PERSIST):
+            ut.load_stem_cache(_STEM_CACHE_FILE)
+
     @staticmethod
     def _parse_str(value: Any) -> Any:
         """
@@ -558,3 +574,10 @@ class Settings(object):
         except PermissionError:
             error = f'Settings file {_SETTINGS_FILE[0]} could not saved (PermissionError)'
             warn(error)
+
+    def save_stem_cache(self) -> None:
+        """
+        Save the stem cache next to the settings file, if enabled.
+        """
+        if not self._ignore_file and self.get(self.CFG_STEM_CACHE_PERSIST):
+            ut.save_stem_cache(_STEM_CACHE_FILE)
@@ -18,7 +18,9 @@ __all__ = [
     'SettingsWindow'
 ]
 
+import bisect
 import concurrent.futures
+import re
 import textwrap
 import tkinter as tk
 from tkinter import ttk
@@ -35,6 +37,12 @@ import pydetex._fonts as fonts
 import pydetex.utils as ut
 from pydetex._gui_settings import Settings as _Settings
 
+# Max number of tagged segments written by a single Tk insert call
+_INSERT_BATCH_SEGMENTS = 512
+
+# Chars outside the basic multilingual plane, which cannot be displayed by Tk
+_NON_BMP_CHARS = re.compile('[^\u0000-\uffff]')
+
 
 # noinspection PyTypeChecker
 class SettingsWindow(object):
@@ -736,7 +744,9 @@ class RichText(tk.Text):
     _default_font: 'tkfont.Font'
     _default_size: int
     _em: int
+    _length: int
     _lnums: Optional['TextLineNumbers']
+    _styled_lines: Optional[List[Tuple[str, Tuple[Tuple[int, int, str], ...]]]]
     tab_spaces: int
 
     def __init__(self, cfg: '_Settings', root: 'tk.Tk', *args, **kwargs):
@@ -757,6 +767,9 @@ class RichText(tk.Text):
 
         self._em = self._default_font.measure('m')
         self._default_size = self._default_font.cget('size')
+        self._length = -1  # Cached text length, -1 if modified
+        self.bind('<<Modified>>', self._on_modified, add='+')
+        self._styled_lines = None  # Last lines written by update_styled_text
         self.tab_spaces = 4
 
         # Editable gui
@@ -807,11 +820,18 @@ class RichText(tk.Text):
                 # noinspection PyTypeChecker
                 self.after(2, self._lnums.redraw)
 
+            # noinspection PyUnusedLocal
+            def on_yscroll(*args):
+                sy.set(*args)
+                self._lnums.redraw()
+
             self.bind('<MouseWheel>', on_press_delay)
             self.bind('<Key>', on_press_delay)
             self.bind('<Button-1>', self._lnums.redraw)
+            self.bind('<Configure>', self._lnums.redraw)
             if sy:
                 sy.bind('<Button-1>', on_scroll_press)
+                self['yscrollcommand'] = on_yscroll
             self._lnums.pack(side=tk.LEFT, fill='y', pady=(scroll_hthick, scroll_hthick), padx=0)
             self._lnums.redraw()
 
@@ -908,7 +928,8 @@ class RichText(tk.Text):
 
     def insert_highlighted_text(self, s: str, clear: bool = False, font_format: bool = True) -> None:
         """
-        Insert a highlighted text.
+        Insert a highlighted text. The tagged segments are inserted in batches,
+        each one through a single Tk ``insert`` call.
 
         :param s: Text
         :param clear: Clear before insert
@@ -917,29 +938,237 @@ class RichText(tk.Text):
         # Write results and split tags
         if clear:
             self.clear()
+        args: List[str] = []  # text1, tag1, text2, tag2, ...
         for t in ut.split_tags(s, list(fonts.FONT_TAGS.values())):
             tag, text = t
+            if text == '':
+                continue
+            args.append(text)
+            args.append(fonts.TAGS_FONT[tag] if font_format else 'normal')
+        batch_size = 2 * _INSERT_BATCH_SEGMENTS
+        for j in range(0, len(args), batch_size):
+            batch = args[j:j + batch_size]
             try:
-                self.insert('end', text, fonts.TAGS_FONT[tag] if font_format else 'normal')
-            except tk.TclError:
-                chars = [text[j] for j in range(len(text)) if ord(text[j]) in range(65536)]
-                self.insert('end', ''.join(chars), fonts.TAGS_FONT[tag] if font_format else 'normal')
+                self.insert('end', *batch)
+            except tk.TclError:  # Tk cannot display non-BMP chars, remove them
+                for k in range(0, len(batch), 2):
+                    batch[k] = _NON_BMP_CHARS.sub('', batch[k])
+                self.insert('end', *batch)
         self.redraw()
 
+    def insert_styled_text(
+        self,
+        text: str,
+        spans: List[Tuple[int, int, str]],
+        clear: bool = False,
+        font_format: bool = True
+    ) -> None:
+        """
+        Insert a plain text and apply its style spans ``(start, end, style)``, as
+        returned by ``utils.tags_to_spans``. The text is written with a single
+        ``insert`` call, and each style is applied with a single ``tag_add`` call.
+
+        :param text: Text
+        :param spans: Style spans
+        :param clear: Clear before insert
+        :param font_format: If False, use normal font instead
+        """
+        if clear:
+            self.clear()
+        self._styled_lines = None
+        text, spans = _remove_non_bmp_chars(text, spans)
+        if not font_format or len(spans) == 0:
+            self.insert('end', text, 'normal')
+            return self.redraw()
+        start = self.index('end-1c')
+        self.insert('end', text, ())
+        ranges: Dict[str, List[str]] = {'normal': _normal_ranges(start, len(text), spans)}
+        for a, b, style in spans:
+            if style not in ranges.keys():
+                ranges[style] = []
+            ranges[style].append(f'{start}+{a}c')
+            ranges[style].append(f'{start}+{b}c')
+        for style in ranges.keys():
+            if len(ranges[style]) > 0:
+                self.tag_add(style, *ranges[style])
+        return self.redraw()
+
+    def update_styled_text(
+        self,
+        text: str,
+        spans: List[Tuple[int, int, str]],
+        font_format: bool = True
+    ) -> int:
+        """
+        Replace the content by a new styled text (see ``insert_styled_text``). Only
+        the lines that changed since the last update are rewritten, and the scroll
+        position is preserved.
+
+        :param text: Text
+        :param spans: Style spans
+        :param font_format: If False, use normal font instead
+        :return: Number of written lines
+        """
+        text, spans = _remove_non_bmp_chars(text, spans)
+        new_lines = ut.split_spans_lines(text, spans if font_format else [])
+        old_lines = self._styled_lines
+
+        # If the content was modified by other methods, rewrite everything
+        total = int(self.index('end-1c').split('.')[0])
+        if old_lines is None or len(old_lines) != total:
+            old_lines = [('⇱INVALID_LINE⇲', ())] * total
+
+        scroll = self.yview()[0]
+        written = 0
+        for i1, i2, j1, j2 in reversed(ut.diff_lines(old_lines, new_lines)):
+            self._replace_lines(i1, i2, total, new_lines[j1:j2])
+            written += j2 - j1
+        self._styled_lines = new_lines
+        self.yview_moveto(scroll)
+        self.redraw()
+        return written
+
+    def _replace_lines(
+        self,
+        i1: int,
+        i2: int,
+        total: int,
+        lines: List[Tuple[str, Tuple[Tuple[int, int, str], ...]]]
+    ) -> None:
+        """
+        Replace the lines ``[i1, i2)`` (0-indexed) by the new styled lines.
+
+        :param i1: First line to replace
+        :param i2: Last line to replace (not included)
+        :param total: Total lines of the text
+        :param lines: New lines, see ``utils.split_spans_lines``
+        """
+        text = [line for line, _ in lines]
+        if i2 < total:
+            self.delete(f'{i1 + 1}.0', f'{i2 + 1}.0')
+            self.insert(f'{i1 + 1}.0', ''.join(line + '\n' for line in text), ())
+        elif i1 > 0:  # Replace the last lines, thus, remove the previous newline
+            self.delete(f'{i1}.end', 'end-1c')
+            self.insert(f'{i1}.end', ''.join('\n' + line for line in text), ())
+        else:
+            self.delete('1.0', 'end-1c')
+            self.insert('1.0', '\n'.join(text), ())
+
+        # Apply the styles
+        ranges: Dict[str, List[str]] = {'normal': []}
+        for k in range(len(lines)):
+            row = i1 + 1 + k
+            line, line_spans = lines[k]
+            pos = 0
+            for a, b, style in line_spans:
+                if a > pos:
+                    ranges['normal'] += [f'{row}.{pos}', f'{row}.{a}']
+                if style not in ranges.keys():
+                    ranges[style] = []
+                ranges[style] += [f'{row}.{a}', f'{row}.{b}']
+                pos = max(pos, b)
+            if pos < len(line):
+                ranges['normal'] += [f'{row}.{pos}', f'{row}.{len(line)}']
+        for style in ranges.keys():
+            if len(ranges[style]) > 0:
+                self.tag_add(style, *ranges[style])
+
     def clear(self) -> None:
         """
         Clears the text.
         """
         self.delete(0.0, tk.END)
+        self._styled_lines = None
+
+    # noinspection PyUnusedLocal
+    def _on_modified(self, *args) -> None:
+        """
+        Invalidates the cached length after the text is modified.
+        """
+        self._length = -1
+        self.edit_modified(False)
+
+    def length(self, strip: bool = False) -> int:
+        """
+        Return the number of chars of the text. These are counted by Tk, thus, the
+        text is not copied, and the value is cached until the text is modified.
+
+        :param strip: If True, ignore the leading and trailing whitespace
+        :return: Text length
+        """
+        if self._length == -1:
+            n = self.count('1.0', 'end-1c', 'chars')
+            self._length = 0 if n is None else n[0]
+        if not strip or self._length == 0:
+            return self._length
+        first = self.search(r'\S', '1.0', 'end', regexp=True)
+        if first == '':
+            return 0
+        last = self.search(r'\S', 'end', '1.0', backwards=True, regexp=True)
+        n = self.count(first, f'{last}+1c', 'chars')
+        return 0 if n is None else n[0]
+
+
+def _remove_non_bmp_chars(
+    text: str,
+    spans: List[Tuple[int, int, str]]
+) -> Tuple[str, List[Tuple[int, int, str]]]:
+    """
+    Remove the chars that cannot be displayed by Tk, updating the style spans.
+
+    :param text: Text
+    :param spans: Style spans
+    :return: New text, new spans
+    """
+    removed = [m.start() for m in _NON_BMP_CHARS.finditer(text)]
+    if len(removed) == 0:
+        return text, spans
+
+    def _shift(pos: int) -> int:
+        """
+        Shift a position by the number of removed chars before it.
+
+        :param pos: Position
+        :return: New position
+        """
+        return pos - bisect.bisect_left(removed, pos)
+
+    return _NON_BMP_CHARS.sub('', text), [(_shift(a), _shift(b), style) for a, b, style in spans]
+
+
+def _normal_ranges(start: str, length: int, spans: List[Tuple[int, int, str]]) -> List[str]:
+    """
+    Return the Tk index ranges not covered by the style spans.
+
+    :param start: Start index of the text
+    :param length: Text length
+    :param spans: Style spans
+    :return: Index list ``[a1, b1, a2, b2, ...]``
+    """
+    ranges: List[str] = []
+    pos = 0
+    for a, b, _ in spans:
+        if a > pos:
+            ranges.append(f'{start}+{pos}c')
+            ranges.append(f'{start}+{a}c')
+        pos = max(pos, b)
+    if pos < length:
+        ranges.append(f'{start}+{pos}c')
+        ranges.append(f'{start}+{length}c')
+    return ranges
 
 
 class TextLineNumbers(tk.Canvas):
     """
-    Line numbers.
+    Line numbers. The canvas keeps a pool of text items, which are moved and
+    updated on each redraw instead of being created again.
     """
     _dx: int  # Number margin on x-axis
     _dy: int  # Number margin on y-axis
     _font_color: str
+    _items: List[int]  # Pool of canvas text items
+    _last_view: Optional[Tuple[Any, ...]]  # Last drawn view
+    _redraw_event_id: str
     _textwidget: Optional['tk.Text']
 
     def __init__(self, *args, **kwargs) -> None:
@@ -950,6 +1179,9 @@ class TextLineNumbers(tk.Canvas):
         self._dy = -5 if ut.IS_OSX else 0
         self._font_color = kwargs.pop('font_color', '#606366')
         self._font_color_disabled = kwargs.pop('font_color_disabled', '#86898d')
+        self._items = []
+        self._last_view = None
+        self._redraw_event_id = ''
         self._textwidget = None
         tk.Canvas.__init__(self, *args, **kwargs, highlightthickness=0)
 
@@ -960,22 +1192,51 @@ class TextLineNumbers(tk.Canvas):
         :param text_widget: Text widget
         """
         self._textwidget = text_widget
+        self._last_view = None
 
     # noinspection PyUnusedLocal
     def redraw(self, *args):
         """
-        Redraw line numbers.
+        Redraw line numbers. The redraw is executed when the application is idle,
+        thus, a burst of events (for example, scrolling) triggers a single redraw.
 
         :param args: Drawing arguments
         """
-        if not self._textwidget:
+        if not self._textwidget or self._redraw_event_id != '':
             return
-        self.delete('all')
+        try:
+            # noinspection PyTypeChecker
+            self._redraw_event_id = self.after_idle(self._redraw)
+        except tk.TclError:  # Widget destroyed
+            pass
+
+    def _redraw(self) -> None:
+        """
+        Redraw the line numbers now.
+        """
+        self._redraw_event_id = ''
+        try:
+            first = self._textwidget.index('@0,0')
+            first_dline = self._textwidget.dlineinfo(first)
+            view = (
+                first,
+                None if first_dline is None else first_dline[1],
+                self._textwidget.index('@0,%d' % self._textwidget.winfo_height()),
+                self._textwidget.index('end-1c').split('.')[0],
+                self._textwidget['state']
+            )
+        except tk.TclError:  # Widget destroyed
+            return
+        if view == self._last_view:  # Nothing has changed since the last redraw
+            return
+        self._last_view = view
+
         if self._textwidget['state'] == tk.DISABLED:
             fill = self._font_color_disabled
         else:
             fill = self._font_color
-        i = self._textwidget.index('@0,0')
+        n = 0  # Number of drawn items
+        i = first
         while True:
             dline = self._textwidget.dlineinfo(i)
             if dline is None:
@@ -986,9 +1247,19 @@ class TextLineNumbers(tk.Canvas):
                 dx = self._dx
             y = dline[1]
             linenum = str(i).split('.')[0]
-            self.create_text(dx, y + self._dy, anchor='nw', text=linenum, fill=fill)
+            if n < len(self._items):
+                item = self._items[n]
+                self.coords(item, dx, y + self._dy)
+                self.itemconfigure(item, text=linenum, fill=fill, state=tk.NORMAL)
+            else:
+                self._items.append(self.create_text(dx, y + self._dy, anchor='nw', text=linenum, fill=fill))
+            n += 1
             i = self._textwidget.index('%s+1line' % i)
 
+        # Hide the unused items
+        for item in self._items[n:]:
+            self.itemconfigure(item, state=tk.HIDDEN)
+
 
 # noinspection PyUnresolvedReferences,PyUnusedLocal
 class EditableTextGUI(object):
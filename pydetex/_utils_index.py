@@ -0,0 +1,271 @@
+"""
+PyDetex
+https://github.com/ppizarror/PyDetex
+
+UTILS INDEX
+Corpus index of the words of several documents.
+"""
+
+__all__ = ['CorpusIndex']
+
+from array import array
+from typing import Callable, List, Tuple, Optional, Dict
+
+# noinspection PyProtectedMember
+from pydetex._utils_lang import _make_word_filter, _split_words
+
+
+class CorpusIndex(object):
+    """
+    Positional inverted index of the terms of several documents, for example,
+    the detexed chapters of a book. Words are transformed to terms using the
+    same filters of the repeated words check (tokenize, stopwords and stemming),
+    and positions count all the words of the document; thus, repetition
+    distances are equal to the ones marked by ``check_repeated_words``.
+
+    Each document stores its terms as an array of ids, and each term stores the
+    positions within each document as sorted arrays. Documents can be updated
+    without rebuilding the others. The terms left without documents are removed,
+    and their ids reused; the memo of the word filter only keeps the words of the
+    indexed documents. Thus, the index size follows the indexed documents.
+    """
+
+    _doc_words: Dict[str, List[str]]  # Document: distinct words
+    _docs: Dict[str, 'array']  # Document: term id of each word (0 if ignored)
+    _filtered: Dict[str, str]  # Word: term, memo of the word filter
+    _free_ids: List[int]  # Ids of the removed terms
+    _postings: List[Dict[str, 'array']]  # Term id: {document: positions}
+    _term_id: Dict[str, int]
+    _terms: List[str]
+    _word_count: Dict[str, int]  # Word: number of documents with the word
+    _word_filter: Callable[[str], str]
+
+    def __init__(
+        self,
+        lang: str,
+        min_chars: int = 4,
+        stopwords: bool = True,
+        stemming: bool = True,
+        ignore: Optional[List[str]] = None
+    ) -> None:
+        """
+        Constructor.
+
+        :param lang: Language code
+        :param min_chars: Min chars to accept
+        :param stopwords: Use stopwords
+        :param stemming: Use stemming
+        :param ignore: Ignore a list of words
+        """
+        assert isinstance(min_chars, int) and min_chars >= 1
+        self._filtered = {}
+        word_filter = _make_word_filter(lang, min_chars, stopwords, stemming, ignore, memo=self._filtered)
+        if word_filter is None:
+            raise ValueError(f'Language {lang} is not available')
+        self._doc_words = {}
+        self._docs = {}
+        self._free_ids = []
+        self._word_count = {}
+        self._postings = [{}]  # Id 0 stores the ignored words
+        self._term_id = {'': 0}
+        self._terms = ['']
+        self._word_filter = word_filter
+
+    def __len__(self) -> int:
+        """
+        Return the number of indexed documents.
+
+        :return: Number of documents
+        """
+        return len(self._docs)
+
+    def __contains__(self, doc: str) -> bool:
+        """
+        Check if a document is indexed.
+
+        :param doc: Document name
+        :return: True if indexed
+        """
+        return doc in self._docs
+
+    def documents(self) -> List[str]:
+        """
+        Return the indexed documents.
+
+        :return: Document names
+        """
+        return list(self._docs.keys())
+
+    def add(self, doc: str, s: str) -> None:
+        """
+        Index a document. If the document exists, its index is replaced.
+
+        :param doc: Document name
+        :param s: Document text
+        """
+        old_words = self._remove(doc)
+        terms = array('I')
+        positions: Dict[int, 'array'] = {}
+        words = set()
+        for i, w in enumerate(_split_words(s)):
+            words.add(w)
+            w = self._word_filter(w)
+            t = self._term_id.get(w)
+            if t is None:
+                if len(self._free_ids) > 0:
+                    t = self._free_ids.pop()
+                    self._terms[t] = w
+                else:
+                    t = len(self._terms)
+                    self._terms.append(w)
+                    self._postings.append({})
+                self._term_id[w] = t
+            terms.append(t)
+            if t != 0:
+                if t not in positions:
+                    positions[t] = array('I')
+                positions[t].append(i)
+        self._docs[doc] = terms
+        for t in positions.keys():
+            self._postings[t][doc] = positions[t]
+        self._doc_words[doc] = list(words)
+        for w in words:
+            self._word_count[w] = self._word_count.get(w, 0) + 1
+        if old_words is not None:  # Released after indexing, thus, the words kept are not filtered again
+            self._release(old_words)
+
+    def _remove(self, doc: str) -> Optional[List[str]]:
+        """
+        Remove a document from the index, and the terms left without documents.
+        Its words are not released from the memo of the word filter.
+
+        :param doc: Document name
+        :return: Distinct words of the document, None if the document is not indexed
+        """
+        terms = self._docs.pop(doc, None)
+        if terms is None:
+            return None
+        for t in set(terms):
+            if t == 0:
+                continue
+            postings = self._postings[t]
+            postings.pop(doc, None)
+            if len(postings) == 0:
+                del self._term_id[self._terms[t]]
+                self._terms[t] = ''
+                self._free_ids.append(t)
+        return self._doc_words.pop(doc)
+
+    def _release(self, words: List[str]) -> None:
+        """
+        Release the words of a removed document. The words without documents are
+        removed from the memo of the word filter.
+
+        :param words: Distinct words of the document
+        """
+        for w in words:
+            count = self._word_count[w] - 1
+            if count == 0:
+                del self._word_count[w]
+                self._filtered.pop(w, None)
+            else:
+                self._word_count[w] = count
+
+    def remove(self, doc: str) -> bool:
+        """
+        Remove a document from the index.
+
+        :param doc: Document name
+        :return: True if removed
+        """
+        words = self._remove(doc)
+        if words is None:
+            return False
+        self._release(words)
+        return True
+
+    def term(self, word: str) -> str:
+        """
+        Return the indexed term of a word.
+
+        :param word: Word
+        :return: Term, empty if the word is ignored
+        """
+        term = self._word_filter(word)
+        if word not in self._word_count:  # Not within the documents, thus, not kept by the memo
+            self._filtered.pop(word, None)
+        return term
+
+    def positions(self, word: str, doc: str) -> List[int]:
+        """
+        Return the positions of a word within a document.
+
+        :param word: Word
+        :param doc: Document name
+        :return: Word positions
+        """
+        t = self._term_id.get(self.term(word), 0)
+        if t == 0 or doc not in self._postings[t]:
+            return []
+        return self._postings[t][doc].tolist()
+
+    def frequency(self, word: str, doc: Optional[str] = None) -> int:
+        """
+        Return the number of times a word appears.
+
+        :param word: Word
+        :param doc: Document name. If None, counts in all documents
+        :return: Frequency
+        """
+        t = self._term_id.get(self.term(word), 0)
+        if t == 0:
+            return 0
+        if doc is not None:
+            return len(self._postings[t].get(doc, ()))
+        return sum(len(p) for p in self._postings[t].values())
+
+    def repeated(self, doc: str, distance: int) -> List[Tuple[str, int, int]]:
+        """
+        Return the terms repeated within a distance in a document.
+
+        :param doc: Document name
+        :param distance: Max words between the repetitions
+        :return: List of (term, previous position, position), sorted by position
+        """
+        assert isinstance(distance, int) and distance >= 1
+        terms = self._docs[doc]
+        rep = []
+        for t in set(terms):
+            if t == 0:
+                continue
+            pos = self._postings[t][doc]
+            for j in range(1, len(pos)):
+                if pos[j] - pos[j - 1] <= distance:
+                    rep.append((self._terms[t], pos[j - 1], pos[j]))
+        rep.sort(key=lambda x: x[2])
+        return rep
+
+    def overused(self, doc: str, top: int = 10, min_count: int = 2) -> List[Tuple[str, int, float]]:
+        """
+        Return the most used terms of a document. The ratio compares the term's
+        relative frequency within the document against the whole corpus.
+
+        :param doc: Document name
+        :param top: Number of terms to return
+        :param min_count: Min times the term is used within the document
+        :return: List of (term, count, ratio), sorted by count and ratio
+        """
+        doc_words = len(self._docs[doc])
+        corpus_words = sum(len(d) for d in self._docs.values())
+        used = []
+        for t in set(self._docs[doc]):
+            if t == 0:
+                continue
+            count = len(self._postings[t][doc])
+            if count < min_count:
+                continue
+            total = sum(len(p) for p in self._postings[t].values())
+            ratio = (count / doc_words) / (total / corpus_words)
+            used.append((self._terms[t], count, ratio))
+        used.sort(key=lambda x: (-x[1], -x[2], x[0]))
+        return used[0:top]
@@ -13,9 +13,13 @@ __all__ = [
     'get_diff_startend_word',
     'get_language_name',
     'get_phrase_from_cursor',
+    'get_stem_cache_stats',
     'get_word_from_cursor',
     'LangTexTextTags',
+    'load_stem_cache',
     'make_stemmer',
+    'save_stem_cache',
+    'stem_word',
     'tokenize'
 ]
 
@@ -25,13 +29,17 @@ __all__ = [
 # pt, ro, ru, sk, sl, so, sq, sv, sw, ta, te, th, tl, tr, uk, ur, vi, zh-cn, zh-tw
 import langdetect
 
+import gzip
 import json
 import os
+import threading
+
+from collections import deque, OrderedDict
 
 # noinspection PyProtectedMember
 from PyMultiDictionary._utils import tokenize, get_language_name
 from nltk.stem import SnowballStemmer
-from typing import List, Tuple, Optional, Dict
+from typing import List, Tuple, Optional, Dict, Deque, FrozenSet, Callable
 from warnings import warn
 
 # Resources path
@@ -40,6 +48,7 @@ __actualpath = str(os.path.abspath(os.path.dirname(__file__))).replace('\\', '/'
 # Load all stopwords
 with open(__actualpath + 'res/' + 'stopwords.json', encoding='UTF-8') as json_data:
     _STOPWORDS = json.load(json_data)
+_STOPWORDS_SET: Dict[str, FrozenSet[str]] = {k: frozenset(v) for k, v in _STOPWORDS.items()}
 
 _AVAILABLE_STEMMER_LANGS: Dict[str, str] = {
     'ar': 'arabic',
@@ -62,6 +71,16 @@ _AVAILABLE_STEMMER_LANGS: Dict[str, str] = {
     'sv': 'swedish'
 }
 
+# Stemmers and stemmed words are shared by all the calls
+_STEM_CACHE: Dict[str, 'OrderedDict[str, str]'] = {}  # Lang: LRU word: stem
+_STEM_CACHE_SIZE: int = 20000  # Max words stored per language
+_STEM_CACHE_STATS: Dict[str, int] = {'hits': 0, 'misses': 0}
+_STEMMERS: Dict[str, 'SnowballStemmer'] = {}
+_STEM_LOCK = threading.Lock()  # Guards the stem cache, shared by the threads
+
+# Newline replacement used to split words
+_NEWLINE_FORMAT = '      \n'
+
 
 class LangTexTextTags(object):
     """
@@ -167,50 +186,141 @@ def get_diff_startend_word(original: str, new: str) -> Tuple[str, str]:
 
 def make_stemmer(lang: str) -> Optional['SnowballStemmer']:
     """
-    Returns a stemmer.
+    Returns a stemmer. Stemmers are created once per language.
 
     :param lang: Lang code
     :return: Stemmer or None if not available
     """
     if lang in _AVAILABLE_STEMMER_LANGS.keys():
-        return SnowballStemmer(_AVAILABLE_STEMMER_LANGS[lang])
+        stemmer_lang = _AVAILABLE_STEMMER_LANGS[lang]
+        if stemmer_lang not in _STEMMERS:
+            _STEMMERS[stemmer_lang] = SnowballStemmer(stemmer_lang)
+        return _STEMMERS[stemmer_lang]
     return None
 
 
-def check_repeated_words(
-    s: str,
+def stem_word(word: str, lang: str) -> str:
+    """
+    Stems a word. The stems are stored on a bounded LRU cache per language.
+
+    :param word: Word
+    :param lang: Lang code
+    :return: Stemmed word, or the same word if the language has no stemmer
+    """
+    stemmer = make_stemmer(lang)
+    if stemmer is None:
+        return word
+    with _STEM_LOCK:
+        cache = _STEM_CACHE.setdefault(lang, OrderedDict())
+        stem = cache.get(word)
+        if stem is not None:
+            _STEM_CACHE_STATS['hits'] += 1
+            cache.move_to_end(word)
+            return stem
+        _STEM_CACHE_STATS['misses'] += 1
+    stem = stemmer.stem(word)
+    with _STEM_LOCK:
+        cache[word] = stem
+        if len(cache) > _STEM_CACHE_SIZE:
+            cache.popitem(last=False)
+    return stem
+
+
+def get_stem_cache_stats() -> Dict[str, int]:
+    """
+    Return the stem cache stats.
+
+    :return: Stats dict, with the number of hits, misses, and stored words
+    """
+    with _STEM_LOCK:
+        stats = dict(_STEM_CACHE_STATS)
+        stats['words'] = sum(len(c) for c in _STEM_CACHE.values())
+    return stats
+
+
+def load_stem_cache(path: str) -> bool:
+    """
+    Loads the stem cache from a file. The stored stems extend the current ones.
+
+    :param path: File path
+    :return: True if loaded
+    """
+    try:
+        with gzip.open(path, 'rt', encoding='UTF-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):  # Not exists, or not valid
+        return False
+    if not isinstance(data, dict):
+        return False
+    for lang in data.keys():
+        if make_stemmer(lang) is None or not isinstance(data[lang], dict):
+            continue
+        with _STEM_LOCK:
+            cache = _STEM_CACHE.setdefault(lang, OrderedDict())
+            for word, stem in data[lang].items():
+                if word not in cache:
+                    cache[word] = stem
+                    cache.move_to_end(word, last=False)  # Less recent than the current
+            while len(cache) > _STEM_CACHE_SIZE:
+                cache.popitem(last=False)
+    return True
+
+
+def save_stem_cache(path: str) -> bool:
+    """
+    Saves the stem cache to a file. Only the words whose stem differs from the
+    word are stored, as the other ones are restored by the stemmer on a miss.
+
+    :param path: File path
+    :return: True if saved
+    """
+    data = {}
+    with _STEM_LOCK:
+        for lang, cache in _STEM_CACHE.items():
+            data[lang] = {w: st for w, st in cache.items() if w != st}
+    try:
+        with gzip.open(path, 'wt', encoding='UTF-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+    except OSError:
+        warn(f'Stem cache {path} could not be saved')
+        return False
+    return True
+
+
+def _split_words(s: str) -> List[str]:
+    """
+    Split the words of a text as used by the repetition checks. Newlines are
+    kept within the words, thus, joining the words restores the text.
+
+    :param s: Text
+    :return: Words
+    """
+    return s.replace('\n', _NEWLINE_FORMAT).split(' ')
+
+
+def _make_word_filter(
     lang: str,
     min_chars: int,
-    window: int,
     stopwords: bool,
     stemming: bool,
     ignore: Optional[List[str]] = None,
     remove_tokens: Optional[List[str]] = None,
-    font_tag_format: str = '',
-    font_param_format: str = '',
-    font_normal_format: str = '',
-    tag: str = 'repeated'
-) -> str:
+    memo: Optional[Dict[str, str]] = None
+) -> Optional[Callable[[str], str]]:
     """
-    Check repeated words.
+    Creates the filter that transforms a word into the term used to check
+    repetitions, or an empty string if the word must be ignored. The filter
+    computes each unique word only once.
 
-    :param s: Text
     :param lang: Language code
     :param min_chars: Min chars to accept
-    :param window: Window words span to check
     :param stopwords: Use stopwords
     :param stemming: Use stemming
     :param ignore: Ignore a list of words
-    :param remove_tokens: Remove keys before verify repeat
-    :param font_tag_format: Tag's format
-    :param font_param_format: Param's format
-    :param font_normal_format: Normal's format
-    :param tag: Tag's name
-    :return: Text with repeated words marked
+    :param remove_tokens: Remove keys before filtering
+    :param memo: Dict of the filtered words (word: term), thus, the caller can prune it. If None, use a new one
+    :return: Word filter, or None if the language is not available
     """
-    assert isinstance(window, int) and window > 1
-    assert isinstance(min_chars, int) and min_chars >= 1
-
     if not ignore:
         ignore = []
     if not remove_tokens:
@@ -218,60 +328,109 @@ def check_repeated_words(
 
     # Check languages
     if lang in _AVAILABLE_STEMMER_LANGS.keys():
-        stop = _STOPWORDS[lang]
-        stemmer = make_stemmer(lang)
+        stop = _STOPWORDS_SET[lang]
     else:
-        return s
+        return None
 
-    ignored_words = []
+    ignored_words = set()
     # Apply filters to ignored words
     for w in ignore:
         if stemming:
-            w = stemmer.stem(w)
+            w = stem_word(w, lang)
         if stopwords and w in stop:
             w = ''
         if w == '':
             continue
-        ignored_words.append(w)
+        ignored_words.add(w)
 
-    # Add space to newline
-    newline_format = '      \n'
-    s = s.replace('\n', newline_format)
+    filtered: Dict[str, str] = memo if memo is not None else {}  # Original word: filtered word
 
-    # Separeate words
-    wordswin = []  # Stores the words
-    words = s.split(' ')
-    new_s = []
-
-    for w in words:
-        original_w = w
+    def _filter_word(w_: str) -> str:
+        """
+        Apply the filters to the word, returning the word to compare with.
+        """
+        if w_ in filtered:
+            return filtered[w_]
+        original_w = w_
 
         # Remove tokens
-        if len(remove_tokens) > 0:
-            for rt in remove_tokens:
-                w = w.replace(rt, '')
+        for rt in remove_tokens:
+            w_ = w_.replace(rt, '')
 
         # If command in word
-        if '\\' in w:
-            w = ''
+        if '\\' in w_:
+            w_ = ''
 
         # Apply filters
-        if len(w) <= min_chars:
-            w = ''
-        if w != '':
-            w = tokenize(w)
+        if len(w_) <= min_chars:
+            w_ = ''
+        if w_ != '':
+            w_ = tokenize(w_)
         if stemming:
-            w = stemmer.stem(w)
-        if stopwords and w in stop:
-            w = ''
+            w_ = stem_word(w_, lang)
+        if stopwords and w_ in stop:
+            w_ = ''
 
         # Check if word is ignored
-        if w in ignored_words:
-            w = ''
+        if w_ in ignored_words:
+            w_ = ''
+        filtered[original_w] = w_
+        return w_
+
+    return _filter_word
+
+
+def check_repeated_words(
+    s: str,
+    lang: str,
+    min_chars: int,
+    window: int,
+    stopwords: bool,
+    stemming: bool,
+    ignore: Optional[List[str]] = None,
+    remove_tokens: Optional[List[str]] = None,
+    font_tag_format: str = '',
+    font_param_format: str = '',
+    font_normal_format: str = '',
+    tag: str = 'repeated'
+) -> str:
+    """
+    Check repeated words.
+
+    :param s: Text
+    :param lang: Language code
+    :param min_chars: Min chars to accept
+    :param window: Window words span to check
+    :param stopwords: Use stopwords
+    :param stemming: Use stemming
+    :param ignore: Ignore a list of words
+    :param remove_tokens: Remove keys before verify repeat
+    :param font_tag_format: Tag's format
+    :param font_param_format: Param's format
+    :param font_normal_format: Normal's format
+    :param tag: Tag's name
+    :return: Text with repeated words marked
+    """
+    assert isinstance(window, int) and window > 1
+    assert isinstance(min_chars, int) and min_chars >= 1
+
+    word_filter = _make_word_filter(lang, min_chars, stopwords, stemming, ignore, remove_tokens)
+    if word_filter is None:  # Language not available
+        return s
+
+    # Separate words. The window stores the last position of each word within it
+    last_seen: Dict[str, int] = {}  # Filtered word: last position
+    wordswin: Deque[str] = deque()  # Stores the words
+    words = _split_words(s)
+    new_s = []
+
+    for i in range(len(words)):
+        original_w = words[i]
+        w = word_filter(original_w)
 
-        # Check if the word exists on the list
-        if w in wordswin and w != '':
-            ww = wordswin[::-1].index(w) + 1
+        # Check if the word exists on the window
+        if w != '' and w in last_seen:
+            ww = i - last_seen[w]
             stemmed_word = tokenize(original_w)
             diff_word = get_diff_startend_word(original_w, stemmed_word)
             if diff_word == ('', ''):
@@ -282,15 +441,18 @@ def check_repeated_words(
 
         # Push the new word
         wordswin.append(w)
+        last_seen[w] = i
         if len(wordswin) > window:
-            wordswin.pop(0)
+            old_w = wordswin.popleft()
+            if last_seen[old_w] == i - window:  # Not seen again within the window
+                del last_seen[old_w]
 
         # Append word
         new_s.append(original_w)
 
     # Return string with repeated format
     out_s = ' '.join(new_s)
-    out_s = out_s.replace(newline_format, '\n')
+    out_s = out_s.replace(_NEWLINE_FORMAT, '\n')
     return out_s
 
 
@@ -0,0 +1,293 @@
+"""
+PyDetex
+https://github.com/ppizarror/PyDetex
+
+UTILS MMAP
+Scanner of latex files at byte level, using memory-mapped files.
+"""
+
+__all__ = ['TexMmapScanner']
+
+import mmap
+import os
+import re
+
+from typing import Iterator, List, Optional, Tuple
+
+# The latex syntax chars are ASCII, thus, they can be found on the UTF-8 bytes.
+# Each token is not escaped if it is preceded by an even number of backslashes
+_RE_TOKEN = re.compile(
+    rb'(?<!\\)(?:\\\\)*'
+    rb'(%[^\n]*'
+    rb'|\\(?:begin|end)[ \t]*{[^{}\n]*}'
+    rb'|\\(?:input|include|subfile|import)[ \t]*(?:{[^{}\n]*}[ \t]*)+'
+    rb'|\$\$?|\\[\[\]()])'
+)
+_RE_ENVIRONMENT = re.compile(rb'\\(begin|end)[ \t]*{([^{}\n]*)}')
+_RE_INPUT = re.compile(rb'\\(input|include|subfile|import)')
+_RE_INPUT_ARG = re.compile(rb'{([^{}\n]*)}')
+_MATH_CLOSE = {b'$': b'$', b'$$': b'$$', b'\\[': b'\\]', b'\\(': b'\\)'}
+
+# Cites and references, numbered by the pipelines before removing the environments
+_RE_NUMBERED = re.compile(rb'\\(?:cite[tp]?\*?|ref\*?|autoref|eqref)[ \t]*(?:\[[^\[\]{}]*\][ \t]*)*{[^{}]*}')
+
+
+class TexMmapScanner(object):
+    """
+    Scans a latex file directly on its UTF-8 bytes, which are memory-mapped
+    instead of read. The file is tokenized once, finding the comments, the
+    environments, the math delimiters and the input commands; the contents of the
+    removed environments (like verbatim) are skipped without being tokenized.
+    Then, only the regions which survive the filtering are decoded.
+
+    All positions are byte offsets. The scanner must be closed after use, or
+    used as a context manager.
+    """
+
+    _comments: List[Tuple[int, int]]
+    _environments: List[Tuple[str, int, int]]
+    _inputs: List[Tuple[str, int, int, str]]
+    _math: List[Tuple[int, int]]
+    _mm: Optional['mmap.mmap']
+    _removed: Tuple[str, ...]
+    _scanned: bool
+    _size: int
+
+    def __init__(self, path: str, removed_environments: Optional[List[str]] = None) -> None:
+        """
+        Constructor.
+
+        :param path: File path
+        :param removed_environments: Environments whose content is not scanned nor decoded. An environment is removed if its name contains any of these
+        """
+        self._comments = []
+        self._environments = []
+        self._inputs = []
+        self._math = []
+        self._mm = None
+        self._removed = tuple(removed_environments) if removed_environments else ()
+        self._scanned = False
+        with open(path, 'rb') as f:
+            self._size = os.fstat(f.fileno()).st_size
+            if self._size > 0:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __enter__(self) -> 'TexMmapScanner':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def close(self) -> None:
+        """
+        Close the memory map.
+        """
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+
+    def _is_removed(self, name: str) -> bool:
+        """
+        Check if an environment is removed.
+
+        :param name: Environment name
+        :return: True if removed
+        """
+        for r in self._removed:
+            if r in name:
+                return True
+        return False
+
+    def _find_end(self, name: bytes, k: int) -> int:
+        """
+        Find the end of a removed environment, skipping the nested ones of the
+        same name.
+
+        :param name: Environment name
+        :param k: Position after the begin
+        :return: Position after the end, or the file size if not closed
+        """
+        begin, end = b'\\begin{' + name + b'}', b'\\end{' + name + b'}'
+        depth = 1
+        while True:
+            j = self._mm.find(end, k)
+            if j == -1:
+                return self._size
+            i = self._mm.find(begin, k, j)
+            if i != -1:
+                depth += 1
+                k = i + len(begin)
+                continue
+            depth -= 1
+            k = j + len(end)
+            if depth == 0:
+                return k
+
+    def _scan(self) -> None:
+        """
+        Tokenize the file.
+        """
+        if self._scanned:
+            return
+        self._scanned = True
+        mm = self._mm
+        if mm is None:
+            return
+        envs: List[Tuple[str, int]] = []  # Open environments
+        math_close, math_start = b'', -1
+        k = 0
+        while True:
+            m = _RE_TOKEN.search(mm, k)
+            if m is None:
+                break
+            a, b = m.start(1), m.end(1)
+            t = m.group(1)
+            k = b
+            c = t[0:1]
+            if c == b'%':
+                self._comments.append((a, b))
+            elif c == b'$' or t in _MATH_CLOSE or t in (b'\\]', b'\\)'):
+                if math_start == -1:
+                    if t in _MATH_CLOSE:
+                        math_close, math_start = _MATH_CLOSE[t], a
+                elif t == math_close:
+                    self._math.append((math_start, b))
+                    math_start = -1
+            elif t[1:2] in (b'b', b'e'):
+                e = _RE_ENVIRONMENT.match(t)
+                name = e.group(2).decode('utf-8').strip()
+                if e.group(1) == b'begin':
+                    if self._is_removed(name):  # Jump to the end of the environment
+                        j = self._find_end(e.group(2), b)
+                        self._environments.append((name, a, j))
+                        k = j
+                    else:
+                        envs.append((name, a))
+                else:
+                    for j in range(len(envs) - 1, -1, -1):
+                        if envs[j][0] == name:
+                            self._environments.append((name, envs[j][1], b))
+                            del envs[j]
+                            break
+            else:
+                f = ''.join(arg.decode('utf-8').strip() for arg in _RE_INPUT_ARG.findall(t))
+                self._inputs.append((_RE_INPUT.match(t).group(1).decode('utf-8'), a, b, f))
+        self._environments.sort(key=lambda x: x[1])
+
+    def comments(self) -> List[Tuple[int, int]]:
+        """
+        Return the comments, from the ``%`` to the end of the line.
+
+        :return: List of (start, end)
+        """
+        self._scan()
+        return self._comments
+
+    def environments(self) -> List[Tuple[str, int, int]]:
+        """
+        Return the closed environments, sorted by their start.
+
+        :return: List of (name, begin start, end stop)
+        """
+        self._scan()
+        return self._environments
+
+    def inputs(self) -> List[Tuple[str, int, int, str]]:
+        """
+        Return the input commands (``\\input``, ``\\include``, ``\\subfile`` and ``\\import``).
+
+        :return: List of (command, start, end, file); the file joins all the arguments
+        """
+        self._scan()
+        return self._inputs
+
+    def math(self) -> List[Tuple[int, int]]:
+        """
+        Return the equations delimited by ``$``, ``$$``, ``\\[`` and ``\\(``.
+
+        :return: List of (start, end)
+        """
+        self._scan()
+        return self._math
+
+    def _body(self) -> Tuple[int, int]:
+        """
+        Return the document body, or the whole file if there is no document environment.
+
+        :return: Start, end
+        """
+        self._scan()
+        a, b = 0, self._size
+        for name, i, j in self._environments:
+            if name == 'document':
+                a, b = max(a, self._mm.find(b'}', i) + 1), min(b, self._mm.rfind(b'\\', i, j))
+        return a, b
+
+    def regions(self) -> List[Tuple[int, int]]:
+        """
+        Return the regions that survive the filtering: the document body if any,
+        without the comments and the removed environments. The ``%`` of each
+        comment is kept, as it joins the line with the next one.
+
+        :return: List of (start, end)
+        """
+        a, b = self._body()
+        excluded = [(i + 1, j) for i, j in self._comments if j > i + 1]
+        for name, i, j in self._environments:
+            if name != 'document' and self._is_removed(name):
+                excluded.append((i, j))
+        excluded.sort()
+        regions = []
+        for i, j in excluded + [(b, b)]:
+            i, j = max(i, a), min(j, b)
+            if i > a:
+                regions.append((a, i))
+            a = max(a, j)
+        return regions
+
+    def numbered(self) -> List[Tuple[int, str]]:
+        """
+        Return the cites and references within the removed environments of the
+        document body, as the pipelines number these before removing the
+        environments.
+
+        :return: List of (environment start, environment code with only its cites and references)
+        """
+        a, b = self._body()
+        numbered = []
+        for name, i, j in self._environments:
+            if name != 'document' and self._is_removed(name) and a <= i < b:
+                cmds = [m.group(0).decode('utf-8') for m in _RE_NUMBERED.finditer(self._mm, i, j)]
+                if len(cmds) > 0:
+                    numbered.append((i, f'\\begin{{{name}}}{" ".join(cmds)}\\end{{{name}}}'))
+        return numbered
+
+    def text(self, piece_size: int = 1 << 20) -> Iterator[str]:
+        """
+        Decode the regions that survive the filtering. Each removed environment
+        with cites or references is replaced by these (see ``numbered``), thus, the
+        pipeline numbers them as if the environment was decoded.
+
+        :param piece_size: Max bytes decoded at once. Pieces are cut at newlines
+        :return: Decoded pieces
+        """
+        assert isinstance(piece_size, int) and piece_size >= 1
+        numbered = self.numbered()
+        w = 0
+        for a, b in self.regions():
+            while w < len(numbered) and numbered[w][0] < a:
+                yield numbered[w][1]
+                w += 1
+            while a < b:
+                j = b
+                if b - a > piece_size:
+                    j = self._mm.rfind(b'\n', a, a + piece_size) + 1
+                    if j <= a:  # Very long line
+                        j = self._mm.find(b'\n', a + piece_size, b) + 1 or b
+                yield self._mm[a:j].decode('utf-8')
+                a = j
+        for _, code in numbered[w:]:
+            yield code
@@ -119,11 +119,14 @@ def find_tex_command_char(
         :param k: Position to start from
         :return: The index of the symbol within the list
         """
+        if s[k] not in initial_chars:
+            return -1
         for y in range(len(symbols_char)):
             if _find(k, y):
                 return y
         return -1
 
+    initial_chars = set(j[0][0] for j in symbols_char)
     s = '_' + s + ' ' * max_len
     r = False  # Inside tag
     r_u = -1
@@ -131,8 +134,8 @@ def find_tex_command_char(
     found = []
 
     for i in range(1, len(s) - max_len):
-        u = _find_initial(i)
-        v = _find(i, r_u, False)
+        u = -1 if r else _find_initial(i)
+        v = r and s[i] == symbols_char[r_u][1][0] and _find(i, r_u, False)
         # Open tag
         if not r and u >= 0:
             a = i
@@ -384,7 +387,7 @@ def find_tex_environments(s: str) -> Tuple[Tuple[str, int, int, int, int, str, i
     env: Dict[str, List[Tuple[int, int, str, int]]] = {}
     last_env = ''
     env_depth = 0
-    cmds_cont = []
+    cmds_cont = set()
     env_depths: Dict[str, int] = {}
 
     for t in tags:
@@ -402,7 +405,7 @@ def find_tex_environments(s: str) -> Tuple[Tuple[str, int, int, int, int, str, i
             else:
                 env[env_name].append(env_i)
             if a not in cmds_cont:
-                cmds_cont.append(a)
+                cmds_cont.add(a)
                 last_env = env_name
                 env_depth += 1
         elif 'end' in s[a:b + 1]:
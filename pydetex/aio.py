@@ -0,0 +1,326 @@
+"""
+PyDetex
+https://github.com/ppizarror/PyDetex
+
+AIO
+Asyncio API, which applies the pipelines within an executor without blocking
+the event loop.
+"""
+
+__all__ = [
+    'AsyncDetex',
+    'detex',
+    'detex_file',
+    'detex_many'
+]
+
+import asyncio
+import concurrent.futures
+import multiprocessing
+import os
+import threading
+
+import pydetex.pipelines as pip
+from pydetex.project import ProjectResolver
+from pydetex.utils import open_file, TimeBudget
+from typing import Any, AsyncIterator, Dict, Iterable, Optional, Tuple, Union
+
+# Runner used by the module functions, created on first use
+_DEFAULT_RUNNER: Optional['AsyncDetex'] = None
+_DEFAULT_RUNNER_LOCK = threading.Lock()
+
+
+def _run(
+    pipeline: 'pip.PipelineType',
+    s: str,
+    lang: str,
+    budget: Optional['TimeBudget'],
+    kwargs: Dict[str, Any]
+) -> str:
+    """
+    Apply a pipeline within the executor.
+
+    :param pipeline: Pipeline
+    :param s: Latex code
+    :param lang: Language tag of the code
+    :param budget: Budget cancelled if the task is cancelled, None within processes
+    :param kwargs: Pipeline arguments
+    :return: Pipeline output
+    """
+    if budget is None:
+        return pipeline(s, lang, **kwargs)
+    with budget:
+        return pipeline(s, lang, **kwargs)
+
+
+def _run_file(
+    pipeline: 'pip.PipelineType',
+    path: str,
+    lang: str,
+    budget: Optional['TimeBudget'],
+    kwargs: Dict[str, Any]
+) -> str:
+    """
+    Read a file, and apply a pipeline within the executor. The included files are
+    resolved from the file folder, unless a resolver is given.
+
+    :param pipeline: Pipeline
+    :param path: Latex file
+    :param lang: Language tag of the code
+    :param budget: Budget cancelled if the task is cancelled, None within processes
+    :param kwargs: Pipeline arguments
+    :return: Pipeline output
+    """
+    if kwargs.get('resolver') is None:
+        kwargs = dict(kwargs, resolver=ProjectResolver.from_file(path))
+    return _run(pipeline, open_file(path), lang, budget, kwargs)
+
+
+class AsyncDetex(object):
+    """
+    Applies the pipelines within an executor, awaiting their results, thus, the
+    event loop is not blocked. The file reads, including the files resolved from
+    ``\\input`` and ``\\include``, also run within the executor.
+
+    With threads (default), the cancelled tasks are aborted at the next check of
+    the parsers (see ``utils.TimeBudget``); the threads share the parsers state,
+    and the CPU, as the pipelines hold the GIL. With processes, the pipelines run
+    in parallel, but only the tasks not yet started can be cancelled, and the
+    pipeline arguments must be picklable.
+    """
+
+    _executor: 'concurrent.futures.Executor'
+    _own_executor: bool
+    processes: bool
+
+    def __init__(
+            self,
+            workers: int = 0,
+            processes: bool = False,
+            executor: Optional['concurrent.futures.Executor'] = None
+    ) -> None:
+        """
+        Constructor.
+
+        :param workers: Workers of the executor, if 0 use the CPU count
+        :param processes: Use a pool of processes instead of threads
+        :param executor: Executor to use instead of creating one, it is not shut down on close
+        """
+        assert isinstance(workers, int) and workers >= 0
+        workers = workers or os.cpu_count() or 1
+        self._own_executor = executor is None
+        if executor is not None:
+            self.processes = isinstance(executor, concurrent.futures.ProcessPoolExecutor)
+            self._executor = executor
+        elif processes:
+            self.processes = True
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        else:
+            self.processes = False
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers,
+                                                                   thread_name_prefix='pydetex')
+
+    async def __aenter__(self) -> 'AsyncDetex':
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Shut down the executor, if created by this object.
+        """
+        if self._own_executor:
+            self._executor.shutdown(wait=False)
+
+    async def _submit(self, f: Any, pipeline: Optional['pip.PipelineType'], s: str, lang: str,
+                      kwargs: Dict[str, Any]) -> str:
+        """
+        Run a function within the executor. If the task is cancelled, the pipeline
+        is aborted.
+
+        :param f: Function, ``_run`` or ``_run_file``
+        :param pipeline: Pipeline, if ``None`` use ``strict``
+        :param s: Latex code, or file
+        :param lang: Language tag of the code
+        :param kwargs: Pipeline arguments
+        :return: Pipeline output
+        """
+        budget = None if self.processes else TimeBudget()
+        future = asyncio.get_running_loop().run_in_executor(
+            self._executor, f, pipeline or pip.strict, s, lang, budget, kwargs)
+        try:
+            return await future
+        except asyncio.CancelledError:
+            if budget is not None:
+                budget.cancel()
+            raise
+
+    async def detex(
+            self,
+            s: str,
+            pipeline: Optional['pip.PipelineType'] = None,
+            lang: str = 'en',
+            **kwargs
+    ) -> str:
+        """
+        Apply a pipeline to a latex code.
+
+        :param s: Latex code
+        :param pipeline: Pipeline, if ``None`` use ``strict``
+        :param lang: Language tag of the code
+        :param kwargs: Pipeline arguments, like ``time_budget``
+        :return: String with no latex!
+        """
+        return await self._submit(_run, pipeline, s, lang, kwargs)
+
+    async def detex_file(
+            self,
+            path: str,
+            pipeline: Optional['pip.PipelineType'] = None,
+            lang: str = 'en',
+            **kwargs
+    ) -> str:
+        """
+        Read a latex file and apply a pipeline. The included files are resolved
+        from the file folder (see ``project.ProjectResolver``), unless a ``resolver``
+        is given.
+
+        :param path: Latex file
+        :param pipeline: Pipeline, if ``None`` use ``strict``
+        :param lang: Language tag of the code
+        :param kwargs: Pipeline arguments
+        :return: String with no latex!
+        """
+        return await self._submit(_run_file, pipeline, path, lang, kwargs)
+
+    async def detex_many(
+            self,
+            docs: Iterable[str],
+            pipeline: Optional['pip.PipelineType'] = None,
+            lang: str = 'en',
+            concurrency: int = 4,
+            return_exceptions: bool = False,
+            **kwargs
+    ) -> AsyncIterator[Tuple[int, Union[str, BaseException]]]:
+        """
+        Apply a pipeline to many latex codes, yielding each result as soon as it is
+        completed, with the index of its code. At most ``concurrency`` codes are
+        processed at once, and the codes are taken from the iterable as these finish.
+
+        If the iteration is stopped, or a pipeline fails, the pending codes are
+        cancelled.
+
+        :param docs: Latex codes
+        :param pipeline: Pipeline, if ``None`` use ``strict``
+        :param lang: Language tag of the code
+        :param concurrency: Max codes processed at once
+        :param return_exceptions: Yield the exceptions of the failed codes instead of raising them
+        :param kwargs: Pipeline arguments
+        :return: Iterator of (index, output)
+        """
+        assert isinstance(concurrency, int) and concurrency >= 1
+        docs_iter = enumerate(docs)
+        tasks: Dict['asyncio.Future', int] = {}
+        try:
+            while True:
+                while len(tasks) < concurrency:
+                    doc = next(docs_iter, None)
+                    if doc is None:
+                        break
+                    tasks[asyncio.ensure_future(self.detex(doc[1], pipeline, lang, **kwargs))] = doc[0]
+                if len(tasks) == 0:
+                    return
+                done, _ = await asyncio.wait(list(tasks.keys()), return_when=asyncio.FIRST_COMPLETED)
+                for task in sorted(done, key=lambda t: tasks[t]):
+                    i = tasks.pop(task)
+                    if task.exception() is not None and return_exceptions:
+                        yield i, task.exception()
+                    else:
+                        yield i, task.result()
+        finally:
+            for task in tasks.keys():
+                task.cancel()
+            if len(tasks) > 0:
+                await asyncio.wait(list(tasks.keys()))
+
+
+def _default_runner() -> 'AsyncDetex':
+    """
+    Return the runner of the module functions, a pool of threads.
+
+    :return: Runner
+    """
+    global _DEFAULT_RUNNER
+    with _DEFAULT_RUNNER_LOCK:
+        if _DEFAULT_RUNNER is None:
+            _DEFAULT_RUNNER = AsyncDetex()
+        return _DEFAULT_RUNNER
+
+
+async def detex(
+        s: str,
+        pipeline: Optional['pip.PipelineType'] = None,
+        lang: str = 'en',
+        runner: Optional['AsyncDetex'] = None,
+        **kwargs
+) -> str:
+    """
+    Apply a pipeline to a latex code, without blocking the event loop.
+
+    :param s: Latex code
+    :param pipeline: Pipeline, if ``None`` use ``strict``
+    :param lang: Language tag of the code
+    :param runner: Runner, if ``None`` use a shared pool of threads
+    :param kwargs: Pipeline arguments
+    :return: String with no latex!
+    """
+    return await (runner or _default_runner()).detex(s, pipeline, lang, **kwargs)
+
+
+async def detex_file(
+        path: str,
+        pipeline: Optional['pip.PipelineType'] = None,
+        lang: str = 'en',
+        runner: Optional['AsyncDetex'] = None,
+        **kwargs
+) -> str:
+    """
+    Read a latex file and apply a pipeline, without blocking the event loop.
+
+    :param path: Latex file
+    :param pipeline: Pipeline, if ``None`` use ``strict``
+    :param lang: Language tag of the code
+    :param runner: Runner, if ``None`` use a shared pool of threads
+    :param kwargs: Pipeline arguments
+    :return: String with no latex!
+    """
+    return await (runner or _default_runner()).detex_file(path, pipeline, lang, **kwargs)
+
+
+async def detex_many(
+        docs: Iterable[str],
+        pipeline: Optional['pip.PipelineType'] = None,
+        lang: str = 'en',
+        concurrency: int = 4,
+        return_exceptions: bool = False,
+        runner: Optional['AsyncDetex'] = None,
+        **kwargs
+) -> AsyncIterator[Tuple[int, Union[str, BaseException]]]:
+    """
+    Apply a pipeline to many latex codes, yielding each result as soon as it is
+    completed (see ``AsyncDetex.detex_many``).
+
+    :param docs: Latex codes
+    :param pipeline: Pipeline, if ``None`` use ``strict``
+    :param lang: Language tag of the code
+    :param concurrency: Max codes processed at once
+    :param return_exceptions: Yield the exceptions of the failed codes instead of raising them
+    :param runner: Runner, if ``None`` use a shared pool of threads
+    :param kwargs: Pipeline arguments
+    :return: Iterator of (index, output)
+    """
+    runner = runner or _default_runner()
+    async for i, out in runner.detex_many(docs, pipeline, lang, concurrency, return_exceptions, **kwargs):
+        yield i, out
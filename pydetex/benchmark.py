@@ -0,0 +1,360 @@
+"""
+PyDetex
+https://github.com/ppizarror/PyDetex
+
+BENCHMARK
+Times the parsers, the tex scanners and the pipelines over the test fixtures and
+synthetic documents, and compares the results between runs.
+"""
+
+__all__ = [
+    'compare',
+    'generate',
+    'get_inputs',
+    'get_targets',
+    'load_history',
+    'run',
+    'save_history'
+]
+
+import datetime
+import inspect
+import json
+import math
+import os
+import platform
+import random
+import re
+import subprocess
+import time
+
+import pydetex._utils_tex as ut_tex
+import pydetex.parsers as par
+import pydetex.pipelines as pip
+import pydetex.version as ver
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Arguments of the targets, by name. Functions with other required arguments are skipped
+_ARGS: Dict[str, Any] = {
+    'char': '\\cite{',
+    'chars': ut_tex.TEX_EQUATION_CHARS,
+    'lang': 'en',
+    'single_only': True,
+    'symbols_char': ut_tex.TEX_EQUATION_CHARS,
+    'tagname': 'textbf'
+}
+_TAGS: Dict[str, Tuple[str, ...]] = {  # Tags of the apply_tag functions
+    'apply_tag_between_inside_char_command': ('<c>', '<i>', '<c>', '<n>'),
+    'apply_tag_tex_commands': ('<c>', '<n>', '<a>', '<n>', ''),
+    'apply_tag_tex_commands_no_argv': ('<c>', '<n>')
+}
+
+# Words of the synthetic documents
+_WORDS = (
+    'the model of floor plan segmentation uses several convolutional layers which '
+    'compute a semantic map from the raster image and then the walls doors and rooms '
+    'are vectorized by a graph based method that considers the topology among elements '
+    'results show a notable improvement over previous approaches on public datasets'
+).split()
+
+_SIZE_UNITS = {'': 1, 'k': 1000, 'm': 1000 ** 2}
+
+
+def _parse_size(size: str) -> int:
+    """
+    Parse a size, for example ``10k`` or ``1M``.
+
+    :param size: Size
+    :return: Size in chars
+    """
+    m = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([kKmM]?)[bB]?\s*', size)
+    if m is None:
+        raise ValueError(f'invalid size {size}')
+    return int(float(m.group(1)) * _SIZE_UNITS[m.group(2).lower()])
+
+
+def generate(size: int, seed: int = 0, math_density: float = 0.1) -> str:
+    """
+    Generate a synthetic latex document, with sections, cites, references, nested
+    lists, inline and display math, figures, tables, verbatim, definitions and
+    comments. The document is the same for the same seed.
+
+    :param size: Min size of the document in chars
+    :param seed: Random seed
+    :param math_density: Probability of an inline equation after each word
+    :return: Latex code
+    """
+    rnd = random.Random(seed)
+    parts = ['\\documentclass{article}\n\\def\\model{FPNet}\n\\def\\data{CubiCasa}\n\\begin{document}\n']
+    length = len(parts[0])
+    n = 0  # Number of blocks, used for labels
+
+    def _text(words: int) -> str:
+        """
+        Return a sentence with commands, cites and math.
+
+        :param words: Number of words
+        :return: Text
+        """
+        t = []
+        for _ in range(words):
+            w = rnd.choice(_WORDS)
+            r = rnd.random()
+            if r < 0.05:
+                w = f'\\textbf{{{w}}}'
+            elif r < 0.08:
+                w = f'\\emph{{{w}}}'
+            elif r < 0.1:
+                w = '\\model'
+            t.append(w)
+            if rnd.random() < math_density:
+                t.append(rnd.choice(('$x$', '$x_{i}^{2}$', '$\\alpha + \\beta$', '$\\frac{a}{b}$')))
+        if rnd.random() < 0.5:
+            t.append(f'\\cite{{ref{rnd.randint(0, 200)}, ref{rnd.randint(0, 200)}}}')
+        if rnd.random() < 0.3:
+            t.append(f'(see Figure \\ref{{fig:{rnd.randint(0, max(n, 1))}}})')
+        return ' '.join(t) + '.'
+
+    def _items(depth: int) -> str:
+        """
+        Return a list, nested up to the depth.
+
+        :param depth: Depth
+        :return: List code
+        """
+        env = rnd.choice(('itemize', 'enumerate'))
+        s = f'\\begin{{{env}}}\n'
+        for _ in range(rnd.randint(2, 4)):
+            s += f'\\item {_text(rnd.randint(4, 12))}\n'
+            if depth > 1 and rnd.random() < 0.3:
+                s += _items(depth - 1)
+        return s + f'\\end{{{env}}}\n'
+
+    while length < size:
+        r = rnd.random()
+        if n % 20 == 0:
+            block = f'\\section{{Section {n}}}\\label{{sec:{n}}}\n\n'
+        elif r < 0.55:
+            block = _text(rnd.randint(30, 90)) + ('  % A comment\n' if rnd.random() < 0.2 else '\n') + '\n'
+        elif r < 0.7:
+            block = _items(3) + '\n'
+        elif r < 0.8:
+            block = f'\\begin{{equation}}\\label{{eq:{n}}}\ny_{{{n}}} = \\sum_{{i=0}}^{{N}} ' \
+                    f'\\alpha_i x_i^2 + \\frac{{\\beta}}{{{n + 1}}}\n\\end{{equation}}\n\n'
+        elif r < 0.88:
+            block = f'\\begin{{figure}}[t]\n\\centering\n\\includegraphics[width=\\linewidth]{{fig{n}.png}}\n' \
+                    f'\\caption{{{_text(12)}}}\n\\label{{fig:{n}}}\n\\end{{figure}}\n\n'
+        elif r < 0.95:
+            rows = ''.join(f'{i} & {rnd.choice(_WORDS)} & {rnd.random():.3f} \\\\\n' for i in range(5))
+            block = f'\\begin{{table}}\n\\caption{{Results {n}}}\n\\begin{{tabular}}{{lcr}}\n' \
+                    f'{rows}\\end{{tabular}}\n\\end{{table}}\n\n'
+        elif r < 0.98:
+            block = '\\begin{verbatim}\n' + '\n'.join(f'[log] step {i} loss={rnd.random():.4f}'
+                                                     for i in range(5)) + '\n\\end{verbatim}\n\n'
+        else:
+            block = f'\\def\\term{n}{{{rnd.choice(_WORDS)}}}\n'
+        parts.append(block)
+        length += len(block)
+        n += 1
+    parts.append('\\end{document}\n')
+    return ''.join(parts)
+
+
+def get_targets(pattern: str = '') -> Dict[str, Callable[[str], Any]]:
+    """
+    Return the benchmarked functions: the public parsers, the tex scanners and the
+    pipelines. Each one takes the latex code.
+
+    :param pattern: Regex that filters the target names
+    :return: Dict of name: function
+    """
+    targets: Dict[str, Callable[[str], Any]] = {}
+    for prefix, mod in (('parsers', par), ('utils', ut_tex)):
+        for name in mod.__all__:
+            f = getattr(mod, name)
+            if not inspect.isfunction(f):
+                continue
+            params = [p for p in inspect.signature(f).parameters.values()
+                      if p.default is p.empty and p.kind not in (p.VAR_KEYWORD, p.VAR_POSITIONAL)]
+            if len(params) == 0 or params[0].name != 's':
+                continue
+            args = {}
+            for p in params[1:]:
+                if p.name == 'tags' and name in _TAGS:
+                    args['tags'] = _TAGS[name]
+                elif p.name in _ARGS:
+                    args[p.name] = _ARGS[p.name]
+                else:
+                    break
+            else:
+                if name == 'process_inputs':
+                    args['print'] = False
+                targets[f'{prefix}.{name}'] = (lambda fun, kw: lambda s: fun(s, **kw))(f, args)
+    for name in ('simple', 'fast', 'strict', 'strict_eqn'):
+        targets[f'pipelines.{name}'] = getattr(pip, name)
+    targets['pipelines.stream'] = lambda s: ''.join(pip.stream(s.splitlines(True)))
+    if pattern != '':
+        targets = {k: v for k, v in targets.items() if re.search(pattern, k)}
+    return targets
+
+
+def get_inputs(
+    sizes: Optional[List[str]] = None,
+    fixtures: str = '',
+    seed: int = 0
+) -> Dict[str, str]:
+    """
+    Return the benchmark inputs: the fixtures of a folder, and the synthetic
+    documents of each size.
+
+    :param sizes: Sizes of the synthetic documents, for example ``['10k', '1M']``
+    :param fixtures: Folder of the fixtures (``.tex`` and ``.txt`` files, excluding the outputs). If empty, no fixture is used
+    :param seed: Random seed of the synthetic documents
+    :return: Dict of name: latex code
+    """
+    if sizes is None:
+        sizes = ['10k', '100k', '1M', '10M']
+    inputs = {}
+    if fixtures != '':
+        for f in sorted(os.listdir(fixtures)):
+            if os.path.splitext(f)[1] in ('.tex', '.txt') and '_output' not in f:
+                with open(os.path.join(fixtures, f), encoding='utf-8') as fo:
+                    inputs[f'fixture:{f}'] = fo.read()
+    for size in sizes:
+        inputs[f'synthetic:{size}'] = generate(_parse_size(size), seed)
+    return inputs
+
+
+def run(
+    targets: Dict[str, Callable[[str], Any]],
+    inputs: Dict[str, str],
+    budget: float = 10,
+    min_time: float = 0.2,
+    repeat: int = 5,
+    verbose: bool = False
+) -> Dict[str, Any]:
+    """
+    Time each target over each input, from the smallest input to the largest.
+    Each time is the min of several calls. If the time of the next input, from
+    the growth observed in the last inputs, would exceed the budget, the larger
+    inputs are skipped (stored as ``None``); thus, quadratic targets do not run
+    for hours.
+
+    :param targets: Targets
+    :param inputs: Inputs
+    :param budget: Max seconds of a single call
+    :param min_time: Repeat the calls until this time is reached
+    :param repeat: Max calls of each measure
+    :param verbose: Print each measure
+    :return: Run, with the environment and the times as {target: {input: seconds}}
+    """
+    order = sorted(inputs.keys(), key=lambda k: len(inputs[k]))
+    results: Dict[str, Dict[str, Optional[float]]] = {}
+    font_format = par.FONT_FORMAT_SETTINGS.copy()
+    for name in targets.keys():
+        results[name] = {}
+        measured: List[Tuple[int, float]] = []  # (size, time)
+        for inp in order:
+            s = inputs[inp]
+            if len(measured) > 0:
+                n0, t0 = measured[-2] if len(measured) > 1 else (0, 0)
+                n1, t1 = measured[-1]
+                k = 1
+                if n0 > 0 and t0 > 0 and t1 > 0 and n1 > n0:
+                    k = min(3, max(1, math.log(t1 / t0) / math.log(n1 / n0)))
+                if n1 > 0 and t1 * (len(s) / n1) ** k > budget:
+                    results[name][inp] = None
+                    continue
+            times = []
+            while len(times) == 0 or len(times) < repeat and sum(times) < min_time:
+                t = time.perf_counter()
+                targets[name](s)
+                times.append(time.perf_counter() - t)
+            par.FONT_FORMAT_SETTINGS.update(font_format)
+            results[name][inp] = min(times)
+            measured.append((len(s), min(times)))
+            if verbose:
+                print(f'{name}\t{inp}\t{min(times):.6f}')
+    return {
+        'commit': _git_commit(),
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'sizes': {inp: len(inputs[inp]) for inp in order},
+        'times': results,
+        'version': ver.ver
+    }
+
+
+def _git_commit() -> str:
+    """
+    Return the current git commit of the repo, if any.
+
+    :return: Commit, empty if not available
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=5,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ''
+
+
+def load_history(path: str) -> List[Dict[str, Any]]:
+    """
+    Load the runs of a history file.
+
+    :param path: History file
+    :return: Runs, empty if the file does not exist
+    """
+    if not os.path.isfile(path):
+        return []
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_history(path: str, result: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Append a run to a history file.
+
+    :param path: History file
+    :param result: Run
+    :return: Runs of the history
+    """
+    history = load_history(path)
+    history.append(result)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(history, f, indent=1)
+    return history
+
+
+def compare(
+    base: Dict[str, Any],
+    new: Dict[str, Any],
+    threshold: float = 0.25,
+    min_time: float = 0.001
+) -> List[Dict[str, Any]]:
+    """
+    Compare the times of two runs.
+
+    :param base: Base run
+    :param new: New run
+    :param threshold: Ratio increase of the time flagged as regression
+    :param min_time: Times lower than this in both runs are not flagged, as they are noisy
+    :return: List of {target, input, base, new, ratio, regression}, for the measures within both runs
+    """
+    rows = []
+    for target in new['times'].keys():
+        for inp, t in new['times'][target].items():
+            t0 = base['times'].get(target, {}).get(inp)
+            if t is None or t0 is None or t0 <= 0:
+                continue
+            ratio = t / t0
+            rows.append({
+                'target': target,
+                'input': inp,
+                'base': t0,
+                'new': t,
+                'ratio': ratio,
+                'regression': ratio > 1 + threshold and max(t, t0) >= min_time
+            })
+    return rows
@@ -0,0 +1,314 @@
+"""
+PyDetex
+https://github.com/ppizarror/PyDetex
+
+CACHE
+Persistent cache of the pipeline results.
+"""
+
+__all__ = ['ResultCache']
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import pydetex.parsers as par
+import pydetex.version as ver
+from pydetex.utils import get_local_path
+from typing import Any, Callable, Dict, Optional
+
+# Arguments which do not change the output of the pipelines
+_IGNORED_ARGS = ('cache', 'kwargs', 'pb', 'profiler', 'progressbar', 's', 'show_progress', 'time_budget')
+
+# Arguments which carry state between calls, their results are not cached
+_STATE_ARGS = ('cites', 'clear_learned_defs', 'eqn_number', 'refs')
+
+# Commands that include other files
+_INCLUDE_COMMANDS = ('\\input', '\\include', '\\import', '\\subfile', '\\subimport')
+
+# Representation of the objects that differs on each instance, as it has their address
+_RE_ADDRESS = re.compile(r'\bat 0x[0-9a-fA-F]+')
+
+# Number of pending access times and counters written at once
+_FLUSH_SIZE = 64
+
+
+class ResultCache(object):
+    """
+    Persistent cache of the pipeline results, stored in a SQLite database. The
+    results are keyed by a hash of the code, the pipeline, the language, the
+    pipeline arguments, the font format settings of the calling context (see
+    ``parsers.get_font_format``) and the PyDetex version.
+
+    The database uses the write-ahead log, thus, it can be shared by many worker
+    processes at once. When the size of the stored results exceeds the limit, the
+    least recently used ones are evicted. The total size is kept within the
+    database, and the access times and counters of the hits are written in
+    batches (before storing a result, reading the stats, or closing), so a hit
+    does not commit.
+
+    The code which includes other files is only cached if the pipeline is given a
+    ``resolver`` (``project.ProjectResolver``), as the included files are resolved
+    before hashing. Calls with state arguments (like ``cites``, used by ``stream``)
+    are not cached, neither are the calls whose arguments cannot be part of the
+    key (see ``key``).
+    """
+
+    _atimes: Dict[str, float]  # Key: access time, not written yet
+    _conn: 'sqlite3.Connection'
+    _counts: Dict[str, int]  # Counter: increase, not written yet
+    _lock: 'threading.RLock'
+    _stats: Dict[str, int]
+    max_size: int
+    path: str
+
+    def __init__(self, path: str = '', max_size: int = 256 * 1024 * 1024) -> None:
+        """
+        Constructor.
+
+        :param path: Database file. If empty, use the app local path
+        :param max_size: Max size of the stored results in bytes
+        """
+        assert isinstance(max_size, int) and max_size > 0
+        if path == '':
+            path = os.path.join(get_local_path(), '.pydetex.cache')
+        self.max_size = max_size
+        self.path = path
+        self._lock = threading.RLock()  # The connection is shared by the threads
+        self._stats = {'hits': 0, 'misses': 0, 'bypass': 0, 'evicted': 0}
+        self._atimes = {}
+        self._counts = {}
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        with self._conn:
+            self._conn.execute('CREATE TABLE IF NOT EXISTS results '
+                               '(key TEXT PRIMARY KEY, value TEXT, size INTEGER, atime REAL)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS results_atime ON results (atime)')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS totals (name TEXT PRIMARY KEY, value INTEGER)')
+            self._conn.execute("INSERT OR IGNORE INTO totals SELECT 'size', COALESCE(SUM(size), 0) FROM results")
+
+    def __enter__(self) -> 'ResultCache':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Close the database.
+        """
+        with self._lock:
+            self.flush()
+            self._conn.close()
+
+    @staticmethod
+    def key(s: str, pipeline: str, lang: str, args: Dict[str, Any]) -> str:
+        """
+        Return the key of a result. The arguments which are not JSON serializable
+        are represented by ``repr``; if it has the object address (e.g. the default
+        ``repr`` of the classes), the key would differ on each instance, thus,
+        these are rejected.
+
+        :param s: Latex code
+        :param pipeline: Pipeline name
+        :param lang: Language tag of the code
+        :param args: Pipeline arguments
+        :return: Key
+        """
+
+        def _repr(o: Any) -> str:
+            """
+            Represent an argument which is not JSON serializable.
+
+            :param o: Argument
+            :return: Representation
+            """
+            r = repr(o)
+            if _RE_ADDRESS.search(r) is not None:
+                raise ValueError(f'argument {r} cannot be part of the cache key, as its representation has its address')
+            return r
+
+        h = hashlib.sha256()
+        h.update(json.dumps([ver.ver, pipeline, lang, par.get_font_format(), sorted(args.items())],
+                            default=_repr).encode('utf-8'))
+        h.update(b'\0')
+        h.update(s.encode('utf-8', 'surrogatepass'))
+        return h.hexdigest()
+
+    def _count(self, name: str) -> None:
+        """
+        Increase a counter of this cache and of the database. The counters of the
+        database are written in batches.
+
+        :param name: Counter name
+        """
+        with self._lock:
+            self._stats[name] += 1
+            self._counts[name] = self._counts.get(name, 0) + 1
+            if sum(self._counts.values()) >= _FLUSH_SIZE:
+                self.flush()
+
+    def _flush(self) -> None:
+        """
+        Write the pending access times and counters, within a transaction.
+        """
+        self._conn.executemany('UPDATE results SET atime = MAX(atime, ?) WHERE key = ?',
+                               [(t, k) for k, t in self._atimes.items()])
+        self._conn.executemany('INSERT INTO counters VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + ?',
+                               [(k, v, v) for k, v in self._counts.items()])
+        self._atimes.clear()
+        self._counts.clear()
+
+    def flush(self) -> None:
+        """
+        Write the pending access times and counters to the database.
+        """
+        with self._lock:
+            if len(self._atimes) == 0 and len(self._counts) == 0:
+                return
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._flush()
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Return a stored result. Its access time is written in a batch.
+
+        :param key: Key
+        :return: Result, None if not stored
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self._count('misses')
+                return None
+            self._atimes[key] = time.time()
+            self._count('hits')
+        return row[0]
+
+    def put(self, key: str, value: str) -> None:
+        """
+        Store a result, and evict the least recently used ones if the size of the
+        stored results exceeds the limit.
+
+        :param key: Key
+        :param value: Result
+        """
+        size = len(value.encode('utf-8', 'surrogatepass'))
+        if size > self.max_size:
+            return
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._flush()  # The access times order the eviction
+                row = self._conn.execute('SELECT size FROM results WHERE key = ?', (key,)).fetchone()
+                self._conn.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)',
+                                   (key, value, size, time.time()))
+                total = self._add_size(size - (row[0] if row is not None else 0))
+                excess = total - self.max_size
+                evicted = []
+                if excess > 0:
+                    freed = 0
+                    for k, sz in self._conn.execute('SELECT key, size FROM results ORDER BY atime'):
+                        if freed >= excess:
+                            break
+                        evicted.append((k,))
+                        freed += sz
+                    self._conn.executemany('DELETE FROM results WHERE key = ?', evicted)
+                    self._add_size(-freed)
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._stats['evicted'] += len(evicted)
+
+    def _add_size(self, delta: int) -> int:
+        """
+        Add to the total size of the stored results, within a transaction.
+
+        :param delta: Size increase in bytes
+        :return: New total size
+        """
+        self._conn.execute("INSERT INTO totals VALUES ('size', ?) ON CONFLICT(name) DO UPDATE SET value = value + ?",
+                           (delta, delta))
+        return self._conn.execute("SELECT value FROM totals WHERE name = 'size'").fetchone()[0]
+
+    def apply(self, pipeline: Callable, s: str, lang: str, args: Dict[str, Any]) -> str:
+        """
+        Return the result of a pipeline, from the cache if stored.
+
+        :param pipeline: Pipeline function
+        :param s: Latex code
+        :param lang: Language tag of the code
+        :param args: Pipeline arguments, excluding the code and the language
+        :return: Pipeline result
+        """
+        if any(args.get(k) is not None for k in _STATE_ARGS):
+            self._count('bypass')
+            return pipeline(s, lang, **args)
+        if args.get('resolver') is not None:
+            s = args.get('resolver').resolve(s)
+            args = {k: args[k] for k in args.keys() if k != 'resolver'}
+        elif any(cmd in s for cmd in _INCLUDE_COMMANDS):  # The included files are unknown
+            self._count('bypass')
+            return pipeline(s, lang, **args)
+        try:
+            key = self.key(s, pipeline.__name__, lang, {k: args[k] for k in args.keys() if k not in _IGNORED_ARGS})
+        except ValueError:
+            self._count('bypass')
+            return pipeline(s, lang, **args)
+        out = self.get(key)
+        if out is None:
+            out = pipeline(s, lang, **args)
+            self.put(key, out)
+        return out
+
+    def clear(self) -> None:
+        """
+        Remove all the stored results and the counters.
+        """
+        with self._lock:
+            self._atimes.clear()
+            self._counts.clear()
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._conn.execute('DELETE FROM results')
+                self._conn.execute('DELETE FROM counters')
+                self._conn.execute("UPDATE totals SET value = 0 WHERE name = 'size'")
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return the cache stats, of this instance and of all the processes that
+        share the database.
+
+        :return: Stats dict
+        """
+        with self._lock:
+            self.flush()
+            entries, size = self._conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results').fetchone()
+            total = dict(self._conn.execute('SELECT name, value FROM counters').fetchall())
+        lookups = self._stats['hits'] + self._stats['misses']
+        total_lookups = total.get('hits', 0) + total.get('misses', 0)
+        return {
+            **self._stats,
+            'hit_rate': self._stats['hits'] / lookups if lookups > 0 else 0,
+            'entries': entries,
+            'size': size,
+            'total_hits': total.get('hits', 0),
+            'total_misses': total.get('misses', 0),
+            'total_hit_rate': total.get('hits', 0) / total_lookups if total_lookups > 0 else 0
+        }
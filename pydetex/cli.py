@@ -0,0 +1,429 @@
+"""
+PyDetex
+https://github.com/ppizarror/PyDetex
+
+CLI
+Command line interface to process several files in batch.
+"""
+
+__all__ = ['main']
+
+import argparse
+import json
+import os
+import sys
+
+import pydetex.benchmark as bm
+import pydetex.pipelines as pip
+import pydetex.profiling as prof
+import pydetex.stats as st
+import pydetex.utils as ut
+from pydetex.cache import ResultCache
+from pydetex.lsp import LanguageServer
+from pydetex.project import ProjectResolver
+from pydetex.server import DetexServer
+from pydetex.watch import ProjectWatcher
+
+from typing import Dict, List, Optional, Tuple
+
+# Pipelines available from the command line
+_PIPELINES: Dict[str, 'pip.PipelineType'] = {
+    'fast': pip.fast,
+    'simple': pip.simple,
+    'strict': pip.strict,
+    'strict_eqn': pip.strict_eqn
+}
+
+
+def _output_file(f: str, args: 'argparse.Namespace', relative: bool = False) -> str:
+    """
+    Return the output file of a tex file.
+
+    :param f: Tex file
+    :param args: Parsed arguments
+    :param relative: The file is relative to a watched folder, its subfolders are kept within the output
+    :return: Output file path
+    """
+    if not relative:
+        return os.path.join(args.output, os.path.splitext(os.path.basename(f))[0] + '.txt')
+    out = os.path.join(args.output, os.path.splitext(os.path.normpath(f))[0] + '.txt')
+    ut.make_path_if_not_exists(os.path.dirname(out))
+    return out
+
+
+def _resolver(f: str, resolvers: Dict[str, 'ProjectResolver'], root: str = '') -> 'ProjectResolver':
+    """
+    Return the resolver of the included files of a tex file. Files within the
+    same folder share the resolver, and its cache.
+
+    If the project root is not given, the folder of the file is the root, and only
+    its first levels are indexed (see ``ProjectResolver.from_file``).
+
+    :param f: Tex file
+    :param resolvers: Resolvers of each folder
+    :param root: Project root, if empty use the folder of the file
+    :return: Resolver
+    """
+    path = os.path.abspath(f)
+    if root:
+        root = os.path.abspath(root)
+        if root not in resolvers:
+            resolvers[root] = ProjectResolver(root)
+        resolvers[root].main = os.path.relpath(path, root).replace(os.sep, '/')
+        return resolvers[root]
+    root = os.path.dirname(path)
+    if root not in resolvers:
+        resolvers[root] = ProjectResolver.from_file(path)
+    resolvers[root].main = os.path.basename(f)
+    return resolvers[root]
+
+
+def _detex_stream(
+    f: str,
+    pipeline: 'pip.PipelineType',
+    args: 'argparse.Namespace',
+    resolver: 'ProjectResolver',
+    profiler: Optional['prof.Profiler']
+) -> None:
+    """
+    Apply a pipeline to a file in chunks, writing the output as it is produced.
+
+    :param f: Tex file
+    :param pipeline: Pipeline
+    :param args: Parsed arguments
+    :param resolver: Resolver of the included files
+    :param profiler: Profiler of the stages
+    """
+    chunks = pip.stream(f, args.lang, pipeline=pipeline, chunk_size=args.chunk_size,
+                        use_mmap=args.mmap, resolver=resolver, time_budget=args.time_budget,
+                        profiler=profiler)
+    if not args.output:
+        for chunk in chunks:
+            sys.stdout.write(chunk)
+        sys.stdout.write('\n')
+        return
+    with open(_output_file(f, args), 'w', encoding='utf-8') as o:
+        for chunk in chunks:
+            o.write(chunk)
+
+
+def _profiler(args: 'argparse.Namespace') -> Tuple[Optional['prof.Profiler'], List['prof.Collector']]:
+    """
+    Create the profiler of the stages, if enabled.
+
+    :param args: Parsed arguments
+    :return: Profiler, collectors whose report is printed at the end
+    """
+    if args.profile is None:
+        return None, []
+    collectors: List['prof.Collector'] = []
+    reports: List['prof.Collector'] = []
+    if 'summary' in args.profile:
+        reports.append(prof.SummaryCollector())
+    if 'memory' in args.profile:
+        reports.append(prof.MemoryCollector())
+    collectors.extend(reports)
+    if 'jsonl' in args.profile:
+        ut.make_path_if_not_exists(args.profile_output)
+        collectors.append(prof.JsonLinesCollector(os.path.join(args.profile_output, 'events.jsonl')))
+    if 'cprofile' in args.profile:
+        collectors.append(prof.CProfileCollector(args.profile_output))
+    memory = args.profile_memory or 'memory' in args.profile
+    return prof.Profiler(*collectors, memory=memory), reports
+
+
+def _detex(args: 'argparse.Namespace') -> int:
+    """
+    Apply a pipeline to the files.
+
+    :param args: Parsed arguments
+    :return: Exit code
+    """
+    pipeline = _PIPELINES[args.pipeline]
+    if args.output:
+        ut.make_path_if_not_exists(args.output)
+    status = 0
+    resolvers: Dict[str, 'ProjectResolver'] = {}
+    cache = ResultCache(args.cache) if args.cache is not None else None
+    profiler, reports = _profiler(args)
+    for f in args.files:
+        try:
+            resolver = _resolver(f, resolvers, args.root)
+            if args.stream:
+                _detex_stream(f, pipeline, args, resolver, profiler)
+                continue
+            if args.parallel is not None:
+                out = pip.parallel(ut.open_file(f), args.lang, pipeline, workers=args.parallel, resolver=resolver,
+                                   time_budget=args.time_budget)
+            else:
+                out = pipeline(ut.open_file(f), args.lang, resolver=resolver, cache=cache,
+                               time_budget=args.time_budget, profiler=profiler)
+        except (OSError, UnicodeDecodeError) as e:  # TimeoutError is an OSError
+            print(f'Cannot process {f}: {e}', file=sys.stderr)
+            status = 1
+            continue
+        if not args.output:
+            print(out)
+            continue
+        with open(_output_file(f, args), 'w', encoding='utf-8') as o:
+            o.write(out)
+    if cache is not None:
+        st_cache = cache.stats()
+        print(f'Cache: {st_cache["hits"]} hits, {st_cache["misses"]} misses', file=sys.stderr)
+        cache.close()
+    if profiler is not None:
+        profiler.close()
+        for report in reports:
+            print(report, file=sys.stderr)
+    return status
+
+
+def _bench(args: 'argparse.Namespace') -> int:
+    """
+    Run the benchmark, and compare it with a previous run.
+
+    :param args: Parsed arguments
+    :return: Exit code, 1 if there are regressions
+    """
+    fixtures = args.fixtures
+    if fixtures is None:
+        fixtures = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'test', 'data')
+        if not os.path.isdir(fixtures):
+            fixtures = ''
+    targets = bm.get_targets(args.targets)
+    inputs = bm.get_inputs(args.sizes, fixtures, args.seed)
+    result = bm.run(targets, inputs, budget=args.budget, verbose=not args.quiet)
+
+    base = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            base = json.load(f)
+        if isinstance(base, list):  # History, compare with the last run
+            base = base[-1] if len(base) > 0 else None
+    elif args.history:
+        history = bm.load_history(args.history)
+        base = history[-1] if len(history) > 0 else None
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=1)
+    if args.history:
+        bm.save_history(args.history, result)
+    if base is None:
+        return 0
+
+    regressions = [r for r in bm.compare(base, result, args.threshold) if r['regression']]
+    for r in regressions:
+        print(f'Regression {r["target"]} {r["input"]}: {r["base"]:.6f}s -> {r["new"]:.6f}s ({r["ratio"]:.2f}x)',
+              file=sys.stderr)
+    print(f'{len(regressions)} regressions against {base.get("commit") or base.get("date")}', file=sys.stderr)
+    return 1 if len(regressions) > 0 else 0
+
+
+def _cache(args: 'argparse.Namespace') -> int:
+    """
+    Print the stats of the results cache, or clear it.
+
+    :param args: Parsed arguments
+    :return: Exit code
+    """
+    with ResultCache(args.file) as cache:
+        if args.clear:
+            cache.clear()
+        print(json.dumps(cache.stats(), indent=2))
+    return 0
+
+
+def _stats(args: 'argparse.Namespace') -> int:
+    """
+    Print the stats of the files.
+
+    :param args: Parsed arguments
+    :return: Exit code
+    """
+    status = 0
+    results = {}
+    for f in args.files:
+        try:
+            sections = st.count(ut.open_file(f))
+        except (OSError, UnicodeDecodeError) as e:
+            print(f'Cannot process {f}: {e}', file=sys.stderr)
+            status = 1
+            continue
+        results[f] = {'total': st.total(sections).as_dict()}
+        if args.sections:
+            results[f]['sections'] = [sec.as_dict() for sec in sections]
+    if args.json:
+        print(json.dumps(results, indent=2, ensure_ascii=False))
+        return status
+
+    cols = ('words', 'header_words', 'caption_words', 'math_inline', 'math_display', 'cites')
+    print('\t'.join(cols) + '\tfile')
+    for f in results.keys():
+        rows = [('', results[f]['total'])]
+        if args.sections:
+            rows += [(f'  {"  " * max(0, sec["level"])}{sec["title"] or "-"}', sec) for sec in results[f]['sections']]
+        for title, row in rows:
+            print('\t'.join(str(row[c]) for c in cols) + '\t' + (title if title else f))
+    return status
+
+
+def _lsp(args: 'argparse.Namespace') -> int:
+    """
+    Run the language server on stdio, until the exit notification.
+
+    :param args: Parsed arguments
+    :return: Exit code
+    """
+    LanguageServer(args.pipeline, args.lang).run()
+    return 0
+
+
+def _serve(args: 'argparse.Namespace') -> int:
+    """
+    Run the local service until interrupted.
+
+    :param args: Parsed arguments
+    :return: Exit code
+    """
+    server = DetexServer(args.host, args.port, args.socket, workers=args.workers, max_pending=args.max_pending,
+                         timeout=args.timeout, root=args.root, verbose=args.verbose)
+    server.start()
+    print(f'Serving on {server.address} with {server.workers} workers', file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+    return 0
+
+
+def _watch(args: 'argparse.Namespace') -> int:
+    """
+    Watch a project, and apply a pipeline to the documents affected by each change.
+
+    :param args: Parsed arguments
+    :return: Exit code
+    """
+    if args.output:
+        ut.make_path_if_not_exists(args.output)
+
+    def _update(main_file: str, out: str) -> None:
+        """
+        Write the output of a document.
+
+        :param main_file: Main document
+        :param out: Pipeline output
+        """
+        print(f'Updated {main_file}', file=sys.stderr)
+        if not args.output:
+            print(out)
+            return
+        with open(_output_file(main_file, args, relative=True), 'w', encoding='utf-8') as o:
+            o.write(out)
+
+    watcher = ProjectWatcher(args.folder, _update, _PIPELINES[args.pipeline], args.lang, interval=args.interval,
+                             debounce=args.debounce, use_inotify=not args.no_inotify)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Command line entry point.
+
+    :param argv: Arguments, if None use the ones given to the program
+    :return: Exit code
+    """
+    parser = argparse.ArgumentParser(prog='pydetex-cli', description='Transforms LaTeX code to plain text')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    detex = subparsers.add_parser('detex', help='apply a pipeline to the files')
+    detex.add_argument('files', nargs='+', help='tex files')
+    detex.add_argument('-p', '--pipeline', choices=list(_PIPELINES.keys()), default='strict')
+    detex.add_argument('-l', '--lang', default='en', help='language tag of the code')
+    detex.add_argument('-o', '--output', default='', help='output folder, if empty print to stdout')
+    detex.add_argument('--root', default='', help='project folder of the included files, by default the file folder')
+    detex.add_argument('--stream', action='store_true', help='read and process the files in chunks')
+    detex.add_argument('--chunk-size', type=int, default=65536, help='min chars of each chunk if streaming')
+    detex.add_argument('--mmap', action='store_true', help='scan the files at byte level if streaming')
+    detex.add_argument('--parallel', nargs='?', type=int, const=0, default=None, metavar='WORKERS',
+                       help='process the segments of each file in parallel, if 0 workers use the cpu count')
+    detex.add_argument('--cache', nargs='?', const='', default=None,
+                       help='store the results in a cache file, if empty use the app local path')
+    detex.add_argument('--time-budget', type=float, default=None,
+                       help='max seconds to process each file, or each chunk if streaming')
+    detex.add_argument('--profile', action='append', choices=['summary', 'memory', 'jsonl', 'cprofile'],
+                       default=None, help='profile the stages, printing a summary or the memory report to stderr, or '
+                                          'writing the jsonl events or the cprofile stats of each stage to the '
+                                          'profile output. Can be repeated')
+    detex.add_argument('--profile-output', default='profile',
+                       help='folder of the jsonl events and the cprofile stats if profiling')
+    detex.add_argument('--profile-memory', action='store_true', help='measure the memory peak of each stage')
+    detex.set_defaults(func=_detex)
+
+    stats = subparsers.add_parser('stats', help='count the words, math and cites of the files')
+    stats.add_argument('files', nargs='+', help='tex files')
+    stats.add_argument('-s', '--sections', action='store_true', help='add the counts of each section')
+    stats.add_argument('--json', action='store_true', help='print as json')
+    stats.set_defaults(func=_stats)
+
+    watch = subparsers.add_parser('watch', help='apply a pipeline to the documents of a project on each change')
+    watch.add_argument('folder', nargs='?', default='.', help='project folder')
+    watch.add_argument('-p', '--pipeline', choices=list(_PIPELINES.keys()), default='strict')
+    watch.add_argument('-l', '--lang', default='en', help='language tag of the code')
+    watch.add_argument('-o', '--output', default='', help='output folder, if empty print to stdout')
+    watch.add_argument('--interval', type=float, default=0.5, help='seconds between each check')
+    watch.add_argument('--debounce', type=float, default=0.25, help='seconds without changes before processing')
+    watch.add_argument('--no-inotify', action='store_true', help='poll the files instead of using inotify')
+    watch.set_defaults(func=_watch)
+
+    lsp = subparsers.add_parser('lsp', help='run a language server on stdio for the editors')
+    lsp.add_argument('-p', '--pipeline', choices=list(_PIPELINES.keys()), default='strict')
+    lsp.add_argument('-l', '--lang', default='en', help='language tag of the code')
+    lsp.set_defaults(func=_lsp)
+
+    serve = subparsers.add_parser('serve', help='run a local json service with a pool of worker processes')
+    serve.add_argument('--host', default='127.0.0.1', help='host of the service')
+    serve.add_argument('--port', type=int, default=8000, help='port of the service')
+    serve.add_argument('--socket', default='', help='unix socket path, if given listen on it instead of the port')
+    serve.add_argument('--workers', type=int, default=0, help='worker processes, if 0 use the cpu count')
+    serve.add_argument('--max-pending', type=int, default=64, help='max documents waiting or running at once')
+    serve.add_argument('--timeout', type=float, default=30, help='max seconds to process each document')
+    serve.add_argument('--root', default='', help='folder of the included files, if empty these are not resolved')
+    serve.add_argument('-v', '--verbose', action='store_true', help='log the requests')
+    serve.set_defaults(func=_serve)
+
+    cache = subparsers.add_parser('cache', help='print the stats of the results cache')
+    cache.add_argument('file', nargs='?', default='', help='cache file, if empty use the app local path')
+    cache.add_argument('--clear', action='store_true', help='remove all the stored results')
+    cache.set_defaults(func=_cache)
+
+    bench = subparsers.add_parser('bench', help='time the parsers and pipelines, and find regressions')
+    bench.add_argument('--sizes', nargs='*', default=['10k', '100k', '1M', '10M'],
+                       help='sizes of the synthetic documents')
+    bench.add_argument('--targets', default='', help='regex of the timed functions')
+    bench.add_argument('--fixtures', default=None, help='folder of the fixtures, by default the test data')
+    bench.add_argument('--seed', type=int, default=0, help='seed of the synthetic documents')
+    bench.add_argument('--budget', type=float, default=10, help='max seconds of a single call')
+    bench.add_argument('-o', '--output', default='', help='json file of the results')
+    bench.add_argument('--history', default='', help='json file where the results are appended')
+    bench.add_argument('--compare', default='', help='json file of the base results, or history')
+    bench.add_argument('--threshold', type=float, default=0.25, help='time increase flagged as regression')
+    bench.add_argument('-q', '--quiet', action='store_true', help='do not print each time')
+    bench.set_defaults(func=_bench)
+
+    args = parser.parse_args(argv)
+    if args.command == 'detex' and args.parallel is not None and \
+            (args.stream or args.cache is not None or args.profile is not None or args.profile_memory):
+        detex.error('--parallel cannot be used with --stream, --cache or --profile')
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -42,7 +42,10 @@ from pydetex._fonts import FONT_TAGS
 from pydetex._gui_settings import Settings
 
 # Settings
+_DETECT_LANGUAGE_MIN_CHANGE: int = 64  # Min changed chars to detect the language again while writing
+_DETECT_LANGUAGE_SAMPLE: int = 4096  # Max chars used to detect the language
 _MAX_PASTE_RETRY: int = 3
+_SHOW_EVENT_LATENCY: bool = False  # Print the event latency report on close
 
 
 class PyDetexGUI(object):
@@ -55,10 +58,14 @@ class PyDetexGUI(object):
     _clip: bool
     _copy_clip_button: 'tk.Button'
     _detect_language_event_id: str
+    _detect_language_id: int
+    _detected_lang_length: int
     _detected_lang_tag: str
     _dictionary: 'MultiDictionary'
     _dictionary_btn: 'tk.Button'
     _dictionary_window: Optional['gui_ut.DictionaryGUI']
+    _executor: 'concurrent.futures.ThreadPoolExecutor'
+    _latency: 'ut.LatencyCounter'
     _paste_timeout_error: int
     _process_button: 'ut.Button'
     _process_clip_button: 'tk.Button'
@@ -92,6 +99,12 @@ class PyDetexGUI(object):
                 ctypes.windll.user32.SetProcessDPIAware()
         self._root = tk.Tk()
 
+        # Background tasks and events latency
+        self._detect_language_id = 0
+        self._detected_lang_length = 0
+        self._executor = concurrent.futures.ThreadPoolExecutor(1)
+        self._latency = ut.LatencyCounter()
+
         # Dictionary
         self._dictionary = MultiDictionary()
         self._dictionary_window = None
@@ -366,13 +379,14 @@ class PyDetexGUI(object):
         :param event: Event
         :return: Event
         """
-        if self._detect_language_event_id != '':
-            self._root.after_cancel(self._detect_language_event_id)
+        with self._latency.measure('key'):
+            if self._detect_language_event_id != '':
+                self._root.after_cancel(self._detect_language_event_id)
 
-        if event.char in string.printable and event.char != '':
-            self._status(self._cfg.lang('status_writing'), True, 1000)
-        self._detect_language_event_id = self.__after(100, self._detect_language)
-        self._process_cursor_in(event)
+            if event.char in string.printable and event.char != '':
+                self._status(self._cfg.lang('status_writing'), True, 1000)
+            self._detect_language_event_id = self.__after(100, lambda: self._detect_language(False))
+            self._process_cursor_in(event)
         return event
 
     def _process_cursor_in(self, event: Optional['tk.Event']) -> Optional['tk.Event']:
@@ -416,6 +430,13 @@ class PyDetexGUI(object):
         """
         Process cursor position.
         """
+        with self._latency.measure('cursor'):
+            self._process_cursor_event_inner()
+
+    def _process_cursor_event_inner(self) -> None:
+        """
+        Process cursor position, called within the cursor event.
+        """
         window_w = self._cfg.get(self._cfg.CFG_WINDOW_SIZE)[0]
         cur_pos = self._text_in.index(tk.INSERT)
 
@@ -439,11 +460,10 @@ class PyDetexGUI(object):
             chars = self._cfg.lang('status_cursor_selected_chars') if window_w > 900 else self._cfg.lang(
                 'status_cursor_selected_chars_min')
             s = f'{sel}: '
-            text = self._text_in.get(0.0, tk.END)
             if d == 1:
                 self._status_bar_cursor_sel['text'] = \
                     s + self._cfg.lang('status_cursor_selected_chars_single')
-            elif d == len(text) or d == len(text.strip()):
+            elif d == self._text_in.length() + 1 or d == self._text_in.length(strip=True):
                 self._status_bar_cursor_sel['text'] = self._cfg.lang('status_cursor_selected_all')
             else:
                 self._status_bar_cursor_sel['text'] = s + chars.format(d)
@@ -461,20 +481,61 @@ class PyDetexGUI(object):
         """
         return event if event.char == '' else None
 
-    def _detect_language(self) -> None:
+    def _detect_language(self, force: bool = True) -> None:
         """
-        Detects the input lang.
+        Detects the input lang. The detection uses a bounded sample of the text,
+        taken from its start and around the cursor. If not forced, the detection
+        is skipped if the text length did not change enough since the last one,
+        and it runs in background.
+
+        :param force: Force the detection, which runs in the main thread
         """
-        text = self._text_in.get(0.0, tk.END).strip()
+        self._detect_language_event_id = ''
+        length = self._text_in.length()
+        if not force and abs(length - self._detected_lang_length) < _DETECT_LANGUAGE_MIN_CHANGE:
+            return
+        self._detected_lang_length = length
+        self._detect_language_id += 1
+
+        # Get the text sample
+        with self._latency.measure('language_sample'):
+            text = self._text_in.get('1.0', f'1.0+{_DETECT_LANGUAGE_SAMPLE}c')
+            if length > _DETECT_LANGUAGE_SAMPLE:
+                w = _DETECT_LANGUAGE_SAMPLE // 2
+                text += '\n' + self._text_in.get(f'insert-{w}c', f'insert+{w}c')
+            text = text.strip()
+        if force:
+            return self._set_detected_language(ut.detect_language(text), text != '')
+
+        # Run on background, then update the status from the main thread
+        detection_id = self._detect_language_id
+        future = self._executor.submit(ut.detect_language, text)
+
+        def _check() -> None:
+            """
+            Check if the detection has finished.
+            """
+            if not future.done():
+                self.__after(20, _check)
+            elif detection_id == self._detect_language_id:  # Not superseded
+                self._set_detected_language(future.result(), text != '')
+
+        self.__after(20, _check)
+        return None
+
+    def _set_detected_language(self, lang_tag: str, has_text: bool) -> None:
+        """
+        Set the detected language, and update the status.
 
-        # Check language
-        self._detected_lang_tag = ut.detect_language(text)
+        :param lang_tag: Detected language tag
+        :param has_text: The input text is not empty
+        """
+        self._detected_lang_tag = lang_tag
         lang = self._dictionary.get_language_name(self._detected_lang_tag, self._cfg.get(self._cfg.CFG_LANG))
-        if text != '':
+        if has_text:
             self._status_bar_lang['text'] = self._cfg.lang('detected_lang').format(lang, self._detected_lang_tag)
         else:
             self._status_bar_lang['text'] = self._cfg.lang('detected_lang_write')
-        self._detect_language_event_id = ''
 
         # Check if dictionary is available
         # noinspection PyProtectedMember
@@ -502,7 +563,7 @@ class PyDetexGUI(object):
         """
         self._text_out['state'] = tk.NORMAL
         self._text_in.delete(0.0, tk.END)
-        self._text_out.delete(0.0, tk.END)
+        self._text_out.clear()
         self._text_out['state'] = tk.DISABLED
         self._copy_clip_button['state'] = tk.DISABLED
 
@@ -553,17 +614,7 @@ class PyDetexGUI(object):
 
         # Font format
         font_format = self._cfg.get(self._cfg.CFG_OUTPUT_FONT_FORMAT)
-        par.FONT_FORMAT_SETTINGS['bold'] = FONT_TAGS['bold'] if font_format else ''
-        par.FONT_FORMAT_SETTINGS['cite'] = FONT_TAGS['link'] if font_format else ''
-        par.FONT_FORMAT_SETTINGS['equation'] = FONT_TAGS['equation_inside'] if font_format else ''
-        par.FONT_FORMAT_SETTINGS['hl'] = FONT_TAGS['highlight'] if font_format else ''
-        par.FONT_FORMAT_SETTINGS['italic'] = FONT_TAGS['italic'] if font_format else ''
-        par.FONT_FORMAT_SETTINGS['normal'] = FONT_TAGS['normal'] if font_format else ''
-        par.FONT_FORMAT_SETTINGS['ref'] = FONT_TAGS['link'] if font_format else ''
-        par.FONT_FORMAT_SETTINGS['strike'] = FONT_TAGS['strike'] if font_format else ''
-        par.FONT_FORMAT_SETTINGS['tex_text_tag'] = FONT_TAGS['bold'] if font_format else ''
-        par.FONT_FORMAT_SETTINGS['tex_text_tag_content'] = FONT_TAGS['italic'] if font_format else ''
-        par.FONT_FORMAT_SETTINGS['underline'] = FONT_TAGS['underlined'] if font_format else ''
+        par.set_font_format(font_format)
 
         # Process the text and get the language
         # noinspection PyBroadException
@@ -607,7 +658,8 @@ class PyDetexGUI(object):
         out = par.replace_pydetex_tags(ut.syntax_highlight(out))
 
         # Insert the text
-        self._text_out.insert_highlighted_text(out, True, font_format)
+        text, spans = ut.tags_to_spans(out)
+        self._text_out.update_styled_text(text, spans, font_format)
 
         # Final
         return self._process_final(words)
@@ -792,6 +844,10 @@ class PyDetexGUI(object):
             self._settings_window.close()
         if self._dictionary_window:
             self._dictionary_window.close()
+        self._executor.shutdown(wait=False)
+        self._cfg.save_stem_cache()
+        if _SHOW_EVENT_LATENCY:
+            self._latency.detail_times()
         self._root.destroy()
 
     def _about(self) -> None:
@@ -802,10 +858,16 @@ class PyDetexGUI(object):
         # f'{self._cfg.lang("about_author")}: {pydetex.__author__}\n\n' \
         n_app_opened = self._cfg.get(self._cfg.CFG_TOTAL_OPENED_APP)
         n_word_processed = self._cfg.get(self._cfg.CFG_TOTAL_PROCESSED_WORDS)
+        stem_stats = ut.get_stem_cache_stats()
+        stem_cache = self._cfg.lang('about_stem_cache').format(
+            ut.format_number_d(stem_stats['words'], self._cfg.lang('format_d')),
+            f"{100 * stem_stats['hits'] / max(1, stem_stats['hits'] + stem_stats['misses']):.1f}"
+        )
         msg = f'PyDetex v{pydetex.version.ver}\n' \
               f'{ver}\n\n' \
               f'{self._cfg.lang("about_opened")}: {ut.format_number_d(n_app_opened, self._cfg.lang("format_d"))}\n' \
-              f'{self._cfg.lang("about_processed")}: {ut.format_number_d(n_word_processed, self._cfg.lang("format_d"))}\n\n' \
+              f'{self._cfg.lang("about_processed")}: {ut.format_number_d(n_word_processed, self._cfg.lang("format_d"))}\n' \
+              f'{stem_cache}\n\n' \
               f'{pydetex.__copyright__}'
 
         messagebox.showinfo(title=self._cfg.lang('about'), message=msg)
@@ -0,0 +1,467 @@
+"""
+PyDetex
+https://github.com/ppizarror/PyDetex
+
+LSP
+Language server, which shows the plain text, word count and repeated words of
+the open latex documents in the editors.
+"""
+
+__all__ = [
+    'LanguageServer',
+    'TextDocument'
+]
+
+import json
+import re
+import sys
+
+import pydetex.pipelines as pip
+import pydetex.sourcemap as sm
+import pydetex.utils as ut
+import pydetex.version as ver
+from typing import Any, BinaryIO, Callable, Dict, List, Optional, Tuple
+
+# Error codes of JSON-RPC
+_INVALID_PARAMS = -32602
+_METHOD_NOT_FOUND = -32601
+_SERVER_NOT_INITIALIZED = -32002
+
+# Markers of the repeated words, these are not used by the pipelines
+_MARK_TAG, _MARK_PARAM, _MARK_NORMAL = '\x1e', '\x1f', '\x1d'
+_RE_REPEATED = re.compile(_MARK_TAG + r'<repeated:(\d+)>' + _MARK_PARAM + '(.*?)' + _MARK_TAG + '</repeated>' +
+                          _MARK_NORMAL)
+_RE_WORD = re.compile(r'\w+')
+
+# Pipelines available from the server
+_PIPELINES: Dict[str, 'pip.PipelineType'] = {
+    'fast': pip.fast,
+    'simple': pip.simple,
+    'strict': pip.strict,
+    'strict_eqn': pip.strict_eqn
+}
+
+# Diagnostic severity of the repeated words, "information"
+_SEVERITY = 3
+
+# Text document sync kind, "incremental"
+_SYNC_INCREMENTAL = 2
+
+
+class TextDocument(object):
+    """
+    In-memory model of an open document. The positions are given as LSP does,
+    lines and UTF-16 code units.
+    """
+
+    _line_starts: Optional[List[int]]
+    text: str
+    uri: str
+    version: int
+
+    def __init__(self, uri: str, text: str, version: int = 0) -> None:
+        """
+        Constructor.
+
+        :param uri: Document uri
+        :param text: Document text
+        :param version: Document version
+        """
+        self._line_starts = None
+        self.text = text
+        self.uri = uri
+        self.version = version
+
+    def _lines(self) -> List[int]:
+        """
+        Return the offset of the start of each line.
+
+        :return: Line starts
+        """
+        if self._line_starts is None:
+            self._line_starts = [0] + [m.end() for m in re.finditer('\n', self.text)]
+        return self._line_starts
+
+    def offset(self, position: Dict[str, int]) -> int:
+        """
+        Return the offset of a position in the text.
+
+        :param position: Position ``{"line": ..., "character": ...}``
+        :return: Offset
+        """
+        lines = self._lines()
+        line = position['line']
+        if line >= len(lines):
+            return len(self.text)
+        start = lines[line]
+        end = lines[line + 1] - 1 if line + 1 < len(lines) else len(self.text)
+        units = position['character']
+        k = start
+        while k < end and units > 0:
+            units -= 2 if ord(self.text[k]) > 0xFFFF else 1
+            k += 1
+        return k
+
+    def position(self, offset: int) -> Dict[str, int]:
+        """
+        Return the position of an offset of the text.
+
+        :param offset: Offset
+        :return: Position ``{"line": ..., "character": ...}``
+        """
+        lines = self._lines()
+        lo, hi = 0, len(lines) - 1
+        while lo < hi:  # Last line which starts before the offset
+            mid = (lo + hi + 1) // 2
+            if lines[mid] <= offset:
+                lo = mid
+            else:
+                hi = mid - 1
+        line = self.text[lines[lo]:offset]
+        return {'line': lo, 'character': len(line) + sum(1 for c in line if ord(c) > 0xFFFF)}
+
+    def apply_change(self, change: Dict[str, Any]) -> None:
+        """
+        Apply a change of ``didChange``. If the change has no range, it replaces
+        the whole text.
+
+        :param change: Change ``{"range": ..., "text": ...}``
+        """
+        if 'range' not in change:
+            self.text = change['text']
+        else:
+            a = self.offset(change['range']['start'])
+            b = self.offset(change['range']['end'])
+            self.text = self.text[:a] + change['text'] + self.text[b:]
+        self._line_starts = None
+
+
+class _Segment(object):
+    """
+    Result of a segment of a document, processed on its own.
+    """
+
+    cites: Dict[str, int]
+    eqn_number: List[int]
+    output: str
+    refs: List[str]
+    repeated: List[Tuple[int, int, int, str]]
+
+    def __init__(self, output: str, cites: Dict[str, int], refs: List[str], eqn_number: List[int]) -> None:
+        """
+        Constructor.
+
+        :param output: Pipeline output
+        :param cites: Cites state after the segment
+        :param refs: References state after the segment
+        :param eqn_number: Equation number after the segment
+        """
+        self.cites = cites
+        self.eqn_number = eqn_number
+        self.output = output
+        self.refs = refs
+        self.repeated = []  # (source start, source end, distance, word), relative to the segment
+
+
+class LanguageServer(object):
+    """
+    Language server, which communicates through JSON-RPC on stdio. The documents
+    are kept in memory, and synced incrementally.
+
+    The documents are split at the blank lines outside any environment, equation
+    or brace group (as ``pipelines.stream`` does), and each segment is processed
+    on its own; the results are reused while the segment and the cites,
+    references and equations before it are not changed. Thus, each edit only
+    processes again the edited paragraphs.
+
+    The repeated words (see ``utils.check_repeated_words``) of each segment are
+    published as diagnostics, located in the source (see ``sourcemap``). The plain
+    text and word count of a document are returned by the ``pydetex/plainText``
+    request.
+
+    The ``initializationOptions`` may set the ``pipeline``, ``lang``, and the
+    repetition options ``min_chars``, ``window``, ``stopwords`` and ``stemming``.
+    """
+
+    _handlers: Dict[str, Callable[[Dict[str, Any]], Any]]
+    _initialized: bool
+    _output: Optional[BinaryIO]
+    _segments: Dict[str, Dict[Tuple[Any, ...], '_Segment']]
+    documents: Dict[str, 'TextDocument']
+    lang: str
+    pipeline: str
+    repetition: Dict[str, Any]
+    running: bool
+    stats: Dict[str, int]
+
+    def __init__(self, pipeline: str = 'strict', lang: str = 'en') -> None:
+        """
+        Constructor.
+
+        :param pipeline: Pipeline name
+        :param lang: Language tag of the documents
+        """
+        assert pipeline in _PIPELINES, f'invalid pipeline {pipeline}'
+        self._handlers = {
+            'exit': self._exit,
+            'initialize': self._initialize,
+            'initialized': lambda p: None,
+            'pydetex/plainText': self._plain_text,
+            'shutdown': lambda p: None,
+            'textDocument/didChange': self._did_change,
+            'textDocument/didClose': self._did_close,
+            'textDocument/didOpen': self._did_open
+        }
+        self._initialized = False
+        self._output = None
+        self._segments = {}
+        self.documents = {}
+        self.lang = lang
+        self.pipeline = pipeline
+        self.repetition = {'min_chars': 4, 'window': 15, 'stopwords': True, 'stemming': True}
+        self.running = False
+        self.stats = {'processed': 0, 'reused': 0}
+
+    @staticmethod
+    def read_message(stream: BinaryIO) -> Optional[Dict[str, Any]]:
+        """
+        Read a message.
+
+        :param stream: Input stream
+        :return: Message, None if the stream is closed
+        """
+        length = -1
+        while True:
+            line = stream.readline()
+            if line == b'':
+                return None
+            line = line.strip()
+            if line == b'':
+                if length >= 0:
+                    break
+                continue
+            name, _, value = line.decode('ascii').partition(':')
+            if name.strip().lower() == 'content-length':
+                length = int(value.strip())
+        return json.loads(stream.read(length).decode('utf-8'))
+
+    def send(self, message: Dict[str, Any]) -> None:
+        """
+        Write a message to the output stream.
+
+        :param message: Message
+        """
+        if self._output is None:
+            return
+        body = json.dumps(message, ensure_ascii=False).encode('utf-8')
+        self._output.write(b'Content-Length: ' + str(len(body)).encode('ascii') + b'\r\n\r\n' + body)
+        self._output.flush()
+
+    def run(self, stdin: Optional[BinaryIO] = None, stdout: Optional[BinaryIO] = None) -> None:
+        """
+        Serve the messages until the exit notification, or the input is closed.
+
+        :param stdin: Input stream, by default the standard input
+        :param stdout: Output stream, by default the standard output
+        """
+        stdin = stdin or sys.stdin.buffer
+        self._output = stdout or sys.stdout.buffer
+        self.running = True
+        while self.running:
+            message = self.read_message(stdin)
+            if message is None:
+                break
+            response = self.handle(message)
+            if response is not None:
+                self.send(response)
+
+    def handle(self, message: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Handle a message.
+
+        :param message: Request or notification
+        :return: Response, None if the message is a notification
+        """
+        method = message.get('method', '')
+        request = 'id' in message
+        handler = self._handlers.get(method)
+        error: Optional[Dict[str, Any]] = None
+        result = None
+        if handler is None:
+            error = {'code': _METHOD_NOT_FOUND, 'message': f'method not found {method}'}
+        elif not self._initialized and method not in ('initialize', 'exit'):
+            error = {'code': _SERVER_NOT_INITIALIZED, 'message': 'server not initialized'}
+        else:
+            try:
+                result = handler(message.get('params') or {})
+            except (KeyError, TypeError, ValueError) as e:
+                error = {'code': _INVALID_PARAMS, 'message': f'invalid params: {e}'}
+        if not request:
+            return None
+        if error is not None:
+            return {'jsonrpc': '2.0', 'id': message['id'], 'error': error}
+        return {'jsonrpc': '2.0', 'id': message['id'], 'result': result}
+
+    def _initialize(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Initialize the server.
+
+        :param params: Params
+        :return: Server capabilities
+        """
+        options = params.get('initializationOptions') or {}
+        pipeline = options.get('pipeline', self.pipeline)
+        if pipeline not in _PIPELINES:
+            raise ValueError(f'invalid pipeline {pipeline}')
+        self.pipeline = pipeline
+        self.lang = options.get('lang', self.lang)
+        for k in self.repetition.keys():
+            if k in options:
+                self.repetition[k] = type(self.repetition[k])(options[k])
+        self._initialized = True
+        return {
+            'capabilities': {'textDocumentSync': {'openClose': True, 'change': _SYNC_INCREMENTAL}},
+            'serverInfo': {'name': 'pydetex', 'version': ver.ver}
+        }
+
+    def _exit(self, params: Dict[str, Any]) -> None:
+        """
+        Stop the server.
+
+        :param params: Params
+        """
+        self.running = False
+
+    def _did_open(self, params: Dict[str, Any]) -> None:
+        """
+        Open a document.
+
+        :param params: Params
+        """
+        doc = params['textDocument']
+        self.documents[doc['uri']] = TextDocument(doc['uri'], doc['text'], doc.get('version', 0))
+        self._publish(doc['uri'])
+
+    def _did_change(self, params: Dict[str, Any]) -> None:
+        """
+        Apply the changes to a document.
+
+        :param params: Params
+        """
+        doc = self.documents[params['textDocument']['uri']]
+        for change in params['contentChanges']:
+            doc.apply_change(change)
+        doc.version = params['textDocument'].get('version', doc.version + 1)
+        self._publish(doc.uri)
+
+    def _did_close(self, params: Dict[str, Any]) -> None:
+        """
+        Close a document.
+
+        :param params: Params
+        """
+        uri = params['textDocument']['uri']
+        self.documents.pop(uri, None)
+        self._segments.pop(uri, None)
+        self.send({'jsonrpc': '2.0', 'method': 'textDocument/publishDiagnostics',
+                   'params': {'uri': uri, 'diagnostics': []}})
+
+    def _plain_text(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Return the plain text of a document.
+
+        :param params: Params
+        :return: Plain text, and word count
+        """
+        doc = self.documents[params['textDocument']['uri']]
+        text = '\n\n'.join(seg.output for _, seg in self.process(doc) if seg.output != '')
+        return {'text': text, 'words': len(_RE_WORD.findall(text)), 'version': doc.version}
+
+    def _publish(self, uri: str) -> None:
+        """
+        Publish the diagnostics of a document.
+
+        :param uri: Document uri
+        """
+        doc = self.documents[uri]
+        diagnostics = []
+        for start, seg in self.process(doc):
+            for a, b, distance, word in seg.repeated:
+                diagnostics.append({
+                    'range': {'start': doc.position(start + a), 'end': doc.position(start + b)},
+                    'severity': _SEVERITY,
+                    'source': 'pydetex',
+                    'message': f'Repeated word "{word}", {distance} words before'
+                })
+        self.send({'jsonrpc': '2.0', 'method': 'textDocument/publishDiagnostics',
+                   'params': {'uri': uri, 'version': doc.version, 'diagnostics': diagnostics}})
+
+    def process(self, doc: 'TextDocument') -> List[Tuple[int, '_Segment']]:
+        """
+        Process a document, reusing the results of the segments not changed.
+
+        :param doc: Document
+        :return: List of (segment start in the source, segment result)
+        """
+        prev = self._segments.get(doc.uri, {})
+        new: Dict[Tuple[Any, ...], '_Segment'] = {}
+        result: List[Tuple[int, '_Segment']] = []
+        cites: Dict[str, int] = {}
+        refs: List[str] = []
+        eqn_number: List[int] = [0]
+        k = 0
+        for i, code in enumerate(pip._stream_split([doc.text + '\n'], 1)):
+            start = doc.text.find(code, k)
+            if start == -1:  # Not expected, the segments are pieces of the text
+                start = k
+            k = start + len(code)
+            key = (code, i == 0, tuple(cites.items()), tuple(refs), eqn_number[0])
+            seg = new.get(key) or prev.get(key)
+            if seg is None:
+                seg = self._process_segment(code, cites, refs, eqn_number, i == 0)
+                self.stats['processed'] += 1
+            else:
+                self.stats['reused'] += 1
+            new[key] = seg
+            cites, refs, eqn_number = dict(seg.cites), list(seg.refs), list(seg.eqn_number)
+            result.append((start, seg))
+        self._segments[doc.uri] = new
+        return result
+
+    def _process_segment(
+            self,
+            code: str,
+            cites: Dict[str, int],
+            refs: List[str],
+            eqn_number: List[int],
+            first: bool
+    ) -> '_Segment':
+        """
+        Process a segment, and find its repeated words.
+
+        :param code: Latex code of the segment
+        :param cites: Cites state before the segment, updated
+        :param refs: References state before the segment, updated
+        :param eqn_number: Equation number before the segment, updated
+        :param first: The segment is the first one of the document
+        :return: Segment result
+        """
+        out, smap = sm.detex(code, _PIPELINES[self.pipeline], self.lang, cites=cites, refs=refs,
+                             eqn_number=eqn_number, clear_learned_defs=first)
+        seg = _Segment(out, cites, refs, eqn_number)
+        if out.strip() == '':
+            return seg
+        marked = ut.check_repeated_words(out, self.lang, self.repetition['min_chars'], self.repetition['window'],
+                                         self.repetition['stopwords'], self.repetition['stemming'],
+                                         font_tag_format=_MARK_TAG, font_param_format=_MARK_PARAM,
+                                         font_normal_format=_MARK_NORMAL)
+
+        # Positions of the repeated words within the output, without the markers,
+        # mapped to the source
+        removed = 0
+        for m in _RE_REPEATED.finditer(marked):
+            start = m.start() - removed
+            seg.repeated.append(smap.to_source_range(start, start + len(m.group(2))) + (int(m.group(1)), m.group(2)))
+            removed += len(m.group(0)) - len(m.group(2))
+        return seg
+
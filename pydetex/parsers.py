@@ -8,7 +8,9 @@ Defines parsers, which perform a single task for removal of LaTex things.
 
 __all__ = [
     'find_str',
+    'font_format_context',
     'FONT_FORMAT_SETTINGS',
+    'get_font_format',
     'process_begin_document',
     'process_chars_equations',
     'process_cite',
@@ -26,22 +28,33 @@ __all__ = [
     'remove_environments',
     'remove_equations',
     'remove_tag',
+    'REMOVED_ENVIRONMENTS',
     'replace_pydetex_tags',
+    'set_font_format',
     'simple_replace',
     'strip_punctuation',
     'unicode_chars_equations'
 ]
 
+import bisect
+import contextlib
+import contextvars
 import os
+import re
+import pydetex.profiling as prof
 import pydetex.utils as ut
 
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pydetex._fonts import FONT_TAGS as _FONT_TAGS
 from pydetex._symbols import *
-from typing import List, Tuple, Union, Optional, Callable
+from typing import List, Tuple, Union, Optional, Callable, Dict, Iterator
 
 # Files
+_INPUT_PREFETCH_WORKERS = 8
 _LAST_NOT_FOUND_FILES_PATH = [os.getcwd()]
 _NOT_FOUND_FILES = []
 _PRINT_LOCATION = False
+_RE_INPUT_FILE = re.compile(r'\\input{([^{}]*)}')
 
 # Tags
 _TAG_BRACE_CLOSE = '⇱BRACE_CLOSE⇲'
@@ -57,6 +70,10 @@ _TAG_OPEN_CITE_EQN = '⇱OPEN_CITE_EQN⇲'
 _TAG_PERCENTAGE_SYMBOL = '⇱COMMENT_PERCENTAGE_SYMBOL⇲'
 
 # Others
+_MAX_COMMAND_DEPTH = 300  # Commands within commands, bounds the recursion
+_RE_BRACES = re.compile(r'[{}]')
+_RE_COMMAND_NAME = re.compile(r'\\[a-zA-Z@]+\*?(?=\s*[\[{])')
+_RE_LABEL = re.compile(r'\\label{[^}]*}')
 _ROMAN_DIGITS = [
     (1000, 'M'),
     (900, 'CM'),
@@ -78,7 +95,8 @@ _DEFS = {}
 
 # Parser font format. This dict stores the font of some tex elements to be represented
 # in the GUI text editor. The values are the same of _fonts.FONT_TAGS. By default,
-# they are empty, and are updated in the PyDetexGUI._process() method
+# they are empty, and are updated in the PyDetexGUI._process() method. The parsers
+# read the settings from get_font_format(), thus, a context can override them
 FONT_FORMAT_SETTINGS = {
     'bold': '',
     'cite': '',
@@ -93,29 +111,51 @@ FONT_FORMAT_SETTINGS = {
     'underline': ''
 }
 
+# Font of each element within FONT_FORMAT_SETTINGS, used if the font format is enabled
+_FONT_FORMAT_FONTS = {
+    'bold': 'bold',
+    'cite': 'link',
+    'equation': 'equation_inside',
+    'hl': 'highlight',
+    'italic': 'italic',
+    'normal': 'normal',
+    'ref': 'link',
+    'strike': 'strike',
+    'tex_text_tag': 'bold',
+    'tex_text_tag_content': 'italic',
+    'underline': 'underlined'
+}
+
+# Font format of the current context, overrides FONT_FORMAT_SETTINGS if not None.
+# Each thread has its own context, see font_format_context()
+_FONT_FORMAT_CONTEXT: 'contextvars.ContextVar[Optional[Dict[str, str]]]' = \
+    contextvars.ContextVar('pydetex_font_format', default=None)
+
 LANG_TT_TAGS = ut.LangTexTextTags()
 
+# Environments removed by default, any environment which contains these names is removed
+REMOVED_ENVIRONMENTS = [
+    'lstlisting',
+    'references',
+    'minted',
+    'sourcecode',
+    'tabular',
+    'thebibiliography',
+    'tikzpicture',
+    'verbatim'
+]
+
 
-def _find_str(s: str, char: str) -> int:
+def _find_str(s: str, char: str, start: int = 0) -> int:
     """
     Finds a sequence within a string, and returns the position. If not exists, returns ``-1``.
 
     :param s: Latex string code
     :param char: Sequence
+    :param start: Position to look from
     :return: Position
     """
-    index = 0
-
-    if char in s:
-        c = char[0]
-        for ch in s:
-            if ch == c:
-                if s[index:index + len(char)] == char:
-                    return index
-
-            index += 1
-
-    return -1
+    return s.find(char, start)
 
 
 def _os_listfolder() -> List[str]:
@@ -146,24 +186,73 @@ def _load_file(f: str, path: str) -> str:
         return _TAG_FILE_ERROR
 
 
-def find_str(s: str, char: Union[str, List[str], Tuple[str, ...]]) -> int:
+def find_str(s: str, char: Union[str, List[str], Tuple[str, ...]], start: int = 0) -> int:
     """
     Finds a sequence within a string, and returns the position. If not exists, returns ``-1``.
 
     :param s: Latex string code
     :param char: Sequence or List of sequence
+    :param start: Position to look from
     :return: Position
     """
     if isinstance(char, str):
-        return _find_str(s, char)
+        return _find_str(s, char, start)
     else:
         for ch in char:
-            j = _find_str(s, ch)
+            j = _find_str(s, ch, start)
             if j != -1:
                 return j
     return -1
 
 
+def set_font_format(enabled: bool) -> None:
+    """
+    Enables or disables the font format of the parsers. If enabled, the output of
+    the parsers will contain the font tags (see ``_fonts.FONT_TAGS``).
+
+    :param enabled: Enable the font format
+    """
+    FONT_FORMAT_SETTINGS.update(_font_format(enabled))
+
+
+def _font_format(enabled: bool) -> Dict[str, str]:
+    """
+    Return the font format settings.
+
+    :param enabled: Enable the font format
+    :return: Settings, same keys of ``FONT_FORMAT_SETTINGS``
+    """
+    return {k: _FONT_TAGS[_FONT_FORMAT_FONTS[k]] if enabled else '' for k in FONT_FORMAT_SETTINGS.keys()}
+
+
+def get_font_format() -> Dict[str, str]:
+    """
+    Return the font format settings used by the parsers. These are the ones of the
+    current context (see ``font_format_context``), else, ``FONT_FORMAT_SETTINGS``.
+
+    :return: Font format settings
+    """
+    font_format = _FONT_FORMAT_CONTEXT.get()
+    return FONT_FORMAT_SETTINGS if font_format is None else font_format
+
+
+@contextlib.contextmanager
+def font_format_context(enabled: bool) -> Iterator[None]:
+    """
+    Enables or disables the font format of the parsers within a context, without
+    changing ``FONT_FORMAT_SETTINGS``. Each thread has its own context, thus, the
+    font format of the other threads is not modified.
+
+    :param enabled: Enable the font format
+    """
+    token = _FONT_FORMAT_CONTEXT.set(_font_format(enabled))
+    try:
+        yield
+    finally:
+        _FONT_FORMAT_CONTEXT.reset(token)
+
+
+@prof.stage
 def remove_tag(s: str, tagname: str) -> str:
     """
     Removes a latex tag code.
@@ -177,25 +266,64 @@ def remove_tag(s: str, tagname: str) -> str:
     if '{' not in tagname:
         tagname += '{'
         tagadd = 0
-    while True:
+    k = find_str(s, tagname)
+    if k == -1:
+        return s
+    if tagadd == 0 and tagname.count('\\') == 1:
+        # Remove all the tags and their closing braces at once. The removed braces
+        # are matched pairs, thus, the other pairs are not modified
+        closing: Dict[int, int] = {}  # Open brace: closing brace
+        opened: List[int] = []
+        for m in _RE_BRACES.finditer(s, k):
+            if m.group() == '{':
+                opened.append(m.start())
+            elif len(opened) > 0:
+                closing[opened.pop()] = m.start()
+        removed: List[Tuple[int, int]] = []
+        while k != -1:
+            j = closing.get(k + len(tagname) - 1)
+            if j is not None:  # Unbalanced tags are skipped
+                removed.append((k, k + len(tagname)))
+                removed.append((j, j + 1))
+            k = find_str(s, tagname, k + len(tagname))
+        new_s: List[str] = []
+        k = 0
+        for a, b in sorted(removed):
+            new_s.append(s[k:a])
+            k = b
+        new_s.append(s[k:])
+        new_s = ''.join(new_s)
+        if tagname not in new_s:
+            return new_s
+        # The removal joined the code around into new tags, or there are unbalanced
+        # tags; thus, remove the tags one by one
         k = find_str(s, tagname)
+    while True:
         if k == -1:  # No more tags, return
             return s
+        ut.check_time_budget()
         deep = 0
         f = False
-        for j in range(len(s)):
-            if s[k + j] == '{':
+        for m in _RE_BRACES.finditer(s, k):
+            if m.group() == '{':
                 deep += 1
                 f = True
                 continue
-            if s[k + j] == '}':
-                deep -= 1
+            deep -= 1
             if deep == 0 and f:
                 # update s
+                j = m.start() - k
                 s = s[:k] + s[k + len(tagname) + tagadd:k + j] + s[k + j + 1:]
                 break
+        else:  # Unbalanced braces, skip the tag
+            k += len(tagname) + 1
+
+        # The code before the last tag has no tags, except the ones formed by the
+        # chars that precede the removed tag
+        k = find_str(s, tagname, max(0, k - len(tagname)))
 
 
+@prof.stage
 def remove_common_tags(
     s: str,
     replace_tags: Optional[List] = None,
@@ -232,11 +360,13 @@ def remove_common_tags(
     return s
 
 
+@prof.stage
 def process_cite(
     s: str,
     sort_cites: bool = True,
     compress_cite: bool = True,
     cite_separator: str = ', ',
+    cites: Optional[Dict[str, int]] = None,
     **kwargs
 ) -> str:
     r"""
@@ -247,83 +377,88 @@ def process_cite(
     :param sort_cites: Sorts the cite numbers
     :param compress_cite: Compress the cite numbers, ex ``[1, 2, 3, 10]`` to ``[1-3, 10]``
     :param cite_separator: Separator of cites, for example ``[1{sep}2{sep}3]``
+    :param cites: Number of each cite key. If given, it is updated with the new cites, useful to keep the numbering between calls
     :return: Latex with cite as numbers
     """
+    font_format = get_font_format()
     assert isinstance(cite_separator, str)
-    cites = {}
+    if cites is None:
+        cites = {}
     look = ['\\cite*{', '\\citet*{', '\\citep*{', '\\cite{', '\\citet{', '\\citep{',
             '\\newcite{', '\\newcite*{', '\\cite* {', '\\citet* {', '\\citep* {',
             '\\cite {', '\\citet {', '\\citep {', '\\newcite {', '\\newcite* {']
     look_eqn = ['\\eqref{']
     look += look_eqn
-    k = -1
-    while True:
-        run_j = ''
-        for j in look.copy():
-            k = find_str(s, j)
-            if k == -1:
-                look.remove(j)
-            else:
-                run_j = j
+    for run_j in look:
+        new_s: List[str] = []
+        k, pos = find_str(s, run_j), 0
+        while k != -1:
+            ut.check_time_budget()
+            j = s.find('}', k)
+            if j == -1:  # Unbalanced braces
                 break
-        if k == -1:
-            if kwargs.get('pb'):  # Update progressbar
-                kwargs.get('pb').update('Processing cites')
-            return s
-        for j in range(len(s)):
-            if s[k + j] == '}':
-                c = s[k + len(run_j):k + j]
-
-                # Create the number of the cites
-                cite_nums: List[int] = []
-                for w in c.split(','):
-                    w = w.strip()
-                    if w not in cites.keys():
-                        cites[w] = len(cites.keys()) + 1
-                    cite_nums.append(cites[w])
-                    c = c.replace(w, str(cites[w]))
-
-                # Sort the cites
-                if sort_cites:
-                    cite_nums.sort()
-
-                new_cites: List[str] = []
-
-                # Compress
-                if compress_cite:
-                    cont = False  # Cite number continues
-                    prev_c = -1  # Previous cite
-                    compr_range = -1  # First compress
-                    for w in cite_nums:
-                        if w - prev_c != 1 or w == cite_nums[-1]:
-                            if cont:
-                                # Find if the first is present in the list
-                                for m in range(len(new_cites)):
-                                    if new_cites[m] == str(compr_range):
-                                        new_cites.pop(m)
-                                        break
-                                new_cites.append(f'{compr_range}-{w}')
-                            else:
-                                new_cites.append(str(w))
-                            cont = False
-                            compr_range = w
+            c = s[k + len(run_j):j]
+
+            # Create the number of the cites
+            cite_nums: List[int] = []
+            for w in c.split(','):
+                w = w.strip()
+                if w not in cites.keys():
+                    cites[w] = len(cites.keys()) + 1
+                cite_nums.append(cites[w])
+
+            # Sort the cites
+            if sort_cites:
+                cite_nums.sort()
+
+            new_cites: List[str] = []
+
+            # Compress
+            if compress_cite:
+                cont = False  # Cite number continues
+                prev_c = -1  # Previous cite
+                compr_range = -1  # First compress
+                for w in cite_nums:
+                    if w - prev_c != 1 or w == cite_nums[-1]:
+                        if cont:
+                            # Find if the first is present in the list
+                            for m in range(len(new_cites)):
+                                if new_cites[m] == str(compr_range):
+                                    new_cites.pop(m)
+                                    break
+                            new_cites.append(f'{compr_range}-{w}')
                         else:
-                            cont = True
-                        prev_c = w
+                            new_cites.append(str(w))
+                        cont = False
+                        compr_range = w
+                    else:
+                        cont = True
+                    prev_c = w
 
-                else:
-                    for w in cite_nums:
-                        new_cites.append(str(w))
-
-                c = cite_separator.join(new_cites)
-                eqn_mode = run_j in look_eqn
-                open_cite = _TAG_OPEN_CITE if not eqn_mode else _TAG_OPEN_CITE_EQN
-                close_cite = _TAG_CLOSE_CITE if not eqn_mode else _TAG_CLOSE_CITE_EQN
-                s = s[:k] + FONT_FORMAT_SETTINGS['cite'] + open_cite + c + \
-                    close_cite + FONT_FORMAT_SETTINGS['normal'] + s[k + j + 1:]
-                break
+            else:
+                for w in cite_nums:
+                    new_cites.append(str(w))
+
+            c = cite_separator.join(new_cites)
+            eqn_mode = run_j in look_eqn
+            open_cite = _TAG_OPEN_CITE if not eqn_mode else _TAG_OPEN_CITE_EQN
+            close_cite = _TAG_CLOSE_CITE if not eqn_mode else _TAG_CLOSE_CITE_EQN
+            new_s.append(s[pos:k])
+            new_s.append(font_format['cite'] + open_cite + c + close_cite + font_format['normal'])
+
+            # The replaced cites do not contain commands, thus, continue after the cite
+            pos = j + 1
+            k = find_str(s, run_j, pos)
+        if pos > 0:
+            new_s.append(s[pos:])
+            s = ''.join(new_s)
+
+    if kwargs.get('pb'):  # Update progressbar
+        kwargs.get('pb').update('Processing cites')
+    return s
 
 
+@prof.stage
 def process_citeauthor(
     s: str,
     lang: str,
@@ -338,34 +473,36 @@ def process_citeauthor(
     :param lang: Language tag of the code
     :return: Latex with replaced cites
     """
-    look = ['\\citeauthor{']
-    k = -1
-    while True:
-        run_j = ''
-        for j in look.copy():
-            k = find_str(s, j)
-            if k == -1:
-                look.remove(j)
-            else:
-                run_j = j
-                break
-        if k == -1:
-            if kwargs.get('pb'):  # Update progressbar
-                kwargs.get('pb').update('Processing citeauthor')
-            return s
-        for j in range(len(s)):
-            if s[k + j] == '}':
-                c = s[k + len(run_j):k + j].split(',')
+    font_format = get_font_format()
+    look = '\\citeauthor{'
+    new_s: List[str] = []
+    k, pos = find_str(s, look), 0
+    while k != -1:
+        ut.check_time_budget()
+        j = s.find('}', k)
+        if j == -1:  # Unbalanced braces
+            break
+        c = s[k + len(look):j].split(',')
 
-                # Count the number of cites
-                c = LANG_TT_TAGS.get(lang, 'citeauthor_single' if len(c) == 1 else 'citeauthor_multiple')
+        # Count the number of cites
+        c = LANG_TT_TAGS.get(lang, 'citeauthor_single' if len(c) == 1 else 'citeauthor_multiple')
 
-                # Write cite
-                s = s[:k] + FONT_FORMAT_SETTINGS['cite'] + _TAG_OPEN_CITE + c + \
-                    _TAG_CLOSE_CITE + FONT_FORMAT_SETTINGS['normal'] + s[k + j + 1:]
-                break
+        # Write cite
+        new_s.append(s[pos:k])
+        new_s.append(font_format['cite'] + _TAG_OPEN_CITE + c + _TAG_CLOSE_CITE +
+                     font_format['normal'])
+        pos = j + 1
+        k = find_str(s, look, pos)
+    if pos > 0:
+        new_s.append(s[pos:])
+        s = ''.join(new_s)
+
+    if kwargs.get('pb'):  # Update progressbar
+        kwargs.get('pb').update('Processing citeauthor')
+    return s
 
 
+@prof.stage
 def replace_pydetex_tags(
     s: str,
     cite_format: Tuple[str, str] = ('[', ']'),
@@ -395,6 +532,7 @@ def replace_pydetex_tags(
     return s
 
 
+@prof.stage
 def process_labels(s: str, **kwargs) -> str:
     """
     Removes labels.
@@ -402,51 +540,70 @@ def process_labels(s: str, **kwargs) -> str:
     :param s: Latex string code
     :return: String with no labels
     """
-    while True:
-        k = find_str(s, '\\label{')
-        if k == -1:
-            if kwargs.get('pb'):  # Update progressbar
-                kwargs.get('pb').update('Processing labels')
-            return s
-        for j in range(len(s)):
-            if s[k + j] == '}':
-                s = s[:k] + s[k + j + 1:]
+    new_s = _RE_LABEL.sub('', s)
+    if '\\label{' in new_s:
+        # The removal of a label can join the code around into a new one, or the
+        # labels are unbalanced; thus, remove the labels one by one
+        new_s, k = s, 0
+        while True:
+            # The code before the last label has no labels, except the one formed by
+            # the chars that precede the removed label
+            k = find_str(new_s, '\\label{', max(0, k - 6))
+            if k == -1:
                 break
+            ut.check_time_budget()
+            j = new_s.find('}', k)
+            if j == -1:  # Unbalanced braces, skip the label
+                k += 7
+                continue
+            new_s = new_s[:k] + new_s[j + 1:]
+    if kwargs.get('pb'):  # Update progressbar
+        kwargs.get('pb').update('Processing labels')
+    return new_s
 
 
-def process_ref(s: str, **kwargs) -> str:
+@prof.stage
+def process_ref(s: str, refs: Optional[List[str]] = None, **kwargs) -> str:
     """
     Process references, same as cites, replace by numbers.
 
     :param s: Latex string code
+    :param refs: Numbered references. If given, it is updated with the new references, useful to keep the numbering between calls
     :return: String with numbers instead of references.
     """
+    font_format = get_font_format()
     look = ['\\ref{', '\\ref*{', '\\autoref{']
-    refs = []
-    k = -1
-    while True:
-        run_j = ''
-        for j in look.copy():
-            k = find_str(s, j)
-            if k == -1:
-                look.remove(j)
-            else:
-                run_j = j
-                break
-        if k == -1:
-            if kwargs.get('pb'):  # Update progressbar
-                kwargs.get('pb').update('Processing references')
-            return s
-        for j in range(len(s)):
-            if s[k + j] == '}':
-                ref_label = s[k + len(run_j):k + j].strip()
-                if ref_label not in refs:
-                    refs.append(ref_label)
-                ref_idx = refs.index(ref_label) + 1
-                s = s[:k] + FONT_FORMAT_SETTINGS['ref'] + str(ref_idx) + FONT_FORMAT_SETTINGS['normal'] + s[k + j + 1:]
+    if refs is None:
+        refs = []
+    refs_idx: Dict[str, int] = {}  # Number of each reference
+    for i in range(len(refs)):
+        refs_idx.setdefault(refs[i], i + 1)
+    for run_j in look:
+        new_s: List[str] = []
+        k, pos = find_str(s, run_j), 0
+        while k != -1:
+            ut.check_time_budget()
+            j = s.find('}', k)
+            if j == -1:  # Unbalanced braces
                 break
+            ref_label = s[k + len(run_j):j].strip()
+            if ref_label not in refs_idx:
+                refs.append(ref_label)
+                refs_idx[ref_label] = len(refs)
+            new_s.append(s[pos:k])
+            new_s.append(font_format['ref'] + str(refs_idx[ref_label]) + font_format['normal'])
+            pos = j + 1
+            k = find_str(s, run_j, pos)
+        if pos > 0:
+            new_s.append(s[pos:])
+            s = ''.join(new_s)
 
+    if kwargs.get('pb'):  # Update progressbar
+        kwargs.get('pb').update('Processing references')
+    return s
 
+
+@prof.stage
 def remove_comments(s: str, **kwargs) -> str:
     """
     Remove comments from the text.
@@ -515,6 +672,7 @@ def remove_comments(s: str, **kwargs) -> str:
     return s
 
 
+@prof.stage
 def simple_replace(s: str, **kwargs) -> str:
     """
     Replace simple tokens.
@@ -534,6 +692,7 @@ def simple_replace(s: str, **kwargs) -> str:
             k = s.find(word)
             if k == -1:
                 break
+            ut.check_time_budget()
             if s[k + len(word)] not in ut.TEX_COMMAND_CHARS:
                 s = s[0:k] + repl + s[k + len(word):]
             else:
@@ -561,6 +720,7 @@ def simple_replace(s: str, **kwargs) -> str:
             elif tex_tags[k][2] < i < tex_tags[k][3]:
                 new_s += s[i]
             elif i == tex_tags[k][3]:  # Advance to another tag
+                ut.check_time_budget()
                 new_s += s[i]
                 k += 1
                 added_s = False
@@ -594,18 +754,82 @@ def _load_file_search(tex_file: str, print_error: bool = False) -> str:
     return tx
 
 
+def _load_input(tex_file: str) -> str:
+    """
+    Search and load an input file, and remove its comments.
+
+    :param tex_file: Name of the file
+    :return: Loaded file or tag error
+    """
+    tx = _load_file_search(tex_file)
+    if tx != _TAG_FILE_ERROR:
+        tx = remove_comments('\n'.join(tx.splitlines()))
+    return tx
+
+
+def _input_files(s: str) -> List[str]:
+    """
+    Return the names of the input files of a code, as searched by ``process_inputs``.
+
+    :param s: Latex string code without comments
+    :return: File names
+    """
+    files = []
+    for tex_file in _RE_INPUT_FILE.findall(s):
+        if '.tex' not in tex_file:
+            tex_file += '.tex'
+        if tex_file not in _NOT_FOUND_FILES and r'\jobname' not in tex_file and tex_file not in files:
+            files.append(tex_file)
+    return files
+
+
+def _prefetch_inputs(s: str) -> Dict[str, str]:
+    """
+    Load the input files of a code, recursively, using a thread pool. Each loaded
+    file is scanned for its inputs, which are loaded next.
+
+    :param s: Latex string code without comments
+    :return: Dict of file name: loaded file without comments, or tag error
+    """
+    files = _input_files(s)
+    if len(files) == 0:
+        return {}
+    loaded: Dict[str, str] = {}
+    with ThreadPoolExecutor(max_workers=_INPUT_PREFETCH_WORKERS) as executor:
+        pending = {executor.submit(_load_input, f): f for f in files}
+        while len(pending) > 0:
+            done, _ = wait(list(pending.keys()), return_when=FIRST_COMPLETED)
+            for fut in done:
+                tex_file = pending.pop(fut)
+                loaded[tex_file] = _TAG_FILE_ERROR if fut.exception() else fut.result()
+                for f in _input_files(loaded[tex_file]):
+                    if f not in loaded and f not in pending.values():
+                        pending[executor.submit(_load_input, f)] = f
+    return loaded
+
+
+@prof.stage
 def process_inputs(
     s: str,
     clear_not_found_files: bool = False,
     **kwargs
 ) -> str:
     """
-    Process inputs, which find the input files and retrieve its contents.
+    Process inputs, which find the input files and retrieve its contents. All the
+    input files are found and loaded concurrently first, then, the code is assembled.
+
+    If a ``resolver`` (``project.ProjectResolver``) is given in the kwargs, it
+    resolves the inputs, includes, subfiles and imports instead.
 
     :param s: Latex string code with inputs
     :param clear_not_found_files: Clear the not found files. Used when changing the path
     :return: Text copied with data from inputs
     """
+    if kwargs.get('resolver') is not None:
+        s = kwargs.get('resolver').resolve(s)
+        if kwargs.get('pb'):  # Update progressbar
+            kwargs.get('pb').update('Processing \\input')
+        return s
     global _PRINT_LOCATION, _NOT_FOUND_FILES
     if os.getcwd() != _LAST_NOT_FOUND_FILES_PATH[0] or clear_not_found_files:
         _LAST_NOT_FOUND_FILES_PATH[0] = os.getcwd()
@@ -614,12 +838,19 @@ def process_inputs(
     print_ = kwargs.get('print', True)
     symbol = '⇱INPUT_FILE_TAG⇲'
     s = remove_comments(s)
+    prefetched = _prefetch_inputs(s)
+    k = 0
     while True:
-        k = find_str(s, '\\input{')
+        # The loaded files are processed next, as they can contain inputs
+        k = find_str(s, '\\input{', max(0, k - 6))
         if k == -1:
             if kwargs.get('pb'):  # Update progressbar
                 kwargs.get('pb').update('Processing \\input')
             return s.replace(symbol, '\\input{')
+        ut.check_time_budget()
+        if s.find('}', k) == -1:  # Unbalanced braces
+            s = s[:k] + symbol + s[k + 7:]
+            continue
         m = 0
         for j in range(len(s)):
             if s[k + j] == '{':
@@ -635,21 +866,24 @@ def process_inputs(
                         _PRINT_LOCATION = True
                     if print_:
                         print(f'Detected file {tex_file}:')
-                    tx = _load_file_search(tex_file, print_error=print_)
+                    tx = prefetched.get(tex_file, _TAG_FILE_ERROR)
+                    if tx == _TAG_FILE_ERROR:  # Search again, printing the errors
+                        tx = _load_file_search(tex_file, print_error=print_)
+                        if tx != _TAG_FILE_ERROR:
+                            tx = remove_comments('\n'.join(tx.splitlines()))
                     if tx == _TAG_FILE_ERROR:
                         _NOT_FOUND_FILES.append(tex_file)
                         s = s[:k] + symbol + s[k + m + 1:]
                     else:
                         if print_:
                             print('\tFile found and loaded')
-                        tx = '\n'.join(tx.splitlines())
-                        tx = remove_comments(tx)
                         s = s[:k] + tx + s[k + j + 1:]
                 else:
                     s = s[:k] + symbol + s[k + m + 1:]
                 break
 
 
+@prof.stage
 def remove_commands_char(s: str, chars: List[Tuple[str, str, bool]]) -> str:
     """
     Remove all char commands.
@@ -671,6 +905,7 @@ def remove_commands_char(s: str, chars: List[Tuple[str, str, bool]]) -> str:
             # elif tex_tags[k][0] <= i < tex_tags[k][3]:
             #     pass
             elif i == tex_tags[k][3]:  # Advance to other tag
+                ut.check_time_budget()
                 k += 1
         else:
             new_s += s[i]
@@ -678,6 +913,7 @@ def remove_commands_char(s: str, chars: List[Tuple[str, str, bool]]) -> str:
     return new_s
 
 
+@prof.stage
 def remove_equations(s: str, **kwargs) -> str:
     """
     Remove all equations from a string.
@@ -693,15 +929,18 @@ def remove_equations(s: str, **kwargs) -> str:
 
 def output_text_for_some_commands(
     s: str,
-    lang: str
+    lang: str,
+    depth: int = 0
 ) -> str:
     """
     Replaces the command for a particular text.
 
     :param s: Latex string code
     :param lang: Language tag of the code
+    :param depth: Depth of the command within other commands. Deeper than ``_MAX_COMMAND_DEPTH``, only the command names are removed
     :return: Text string or empty if error
     """
+    font_format = get_font_format()
     # Stores the commands to be transformed
     # (
     #   command name,
@@ -794,12 +1033,15 @@ def output_text_for_some_commands(
                             cmd_argnum, cmd_is_optional = (j, False)
                         if len(c) - 1 >= cmd_argnum >= 0 and c[cmd_argnum][1] == cmd_is_optional:
                             argv = c[cmd_argnum][0].replace('\n', ' ')  # Command's argument to process
-                            argv = remove_commands_param(argv, lang)  # Remove commands within the argument
+                            if depth < _MAX_COMMAND_DEPTH:  # Remove commands within the argument
+                                argv = remove_commands_param(argv, lang, depth=depth + 1)
+                            else:  # Too deep, only remove the command names
+                                argv = _RE_COMMAND_NAME.sub('', argv)
                             args.append(argv.strip())
                     if len(args) == len(cmd_args):
                         # Add format text
                         for a in range(len(args)):
-                            args[a] = FONT_FORMAT_SETTINGS[font_content] + args[a] + FONT_FORMAT_SETTINGS[font_tag]
+                            args[a] = font_format[font_content] + args[a] + font_format[font_tag]
                         if callable(cmd_tag):
                             text = cmd_tag(*args)
                         else:
@@ -807,7 +1049,7 @@ def output_text_for_some_commands(
                                 text = cmd_tag.format(*args)
                             except IndexError:
                                 text = cmd_tag
-                        text = FONT_FORMAT_SETTINGS[font_tag] + text + FONT_FORMAT_SETTINGS['normal']
+                        text = font_format[font_tag] + text + font_format['normal']
                         if cmd_newline[0]:
                             text = _TAG_NEW_LINE + text
                         new_s += text
@@ -818,6 +1060,7 @@ def output_text_for_some_commands(
     return new_s.strip()
 
 
+@prof.stage
 def remove_environments(
     s: str,
     env_list: Optional[List[str]] = None,
@@ -831,22 +1074,12 @@ def remove_environments(
     :return: Code without given environments
     """
     if not env_list:
-        env_list = [
-            'lstlisting',
-            'references',
-            'minted',
-            'sourcecode',
-            'tabular',
-            'thebibiliography',
-            'tikzpicture',
-            'verbatim'
-        ]
+        env_list = REMOVED_ENVIRONMENTS
     tex_tags = ut.find_tex_environments(s)
     if len(tex_tags) == 0 or len(env_list) == 0:
         if kwargs.get('pb'):  # Update progressbar
             kwargs.get('pb').update('No environment found in code')
         return s
-    new_s = ''
 
     new_tex_tags = []
     # Remove all the environments not in env_list
@@ -863,27 +1096,24 @@ def remove_environments(
     if len(new_tex_tags) == 0:
         return s
 
-    def is_in_tags(v: int) -> bool:
-        """
-        Check if a position is within tags.
-
-        :param v: Position
-        :return: True if in tags range
-        """
-        for j_ in new_tex_tags:
-            if j_[1] <= v <= j_[4] + 1:
-                return True
-        return False
-
-    for i in range(len(s)):
-        if not is_in_tags(i):
-            new_s += s[i]
+    # Merge the ranges of the removed environments, and keep the code outside
+    kept: List[str] = []
+    k = 0  # First position not removed
+    for a, b in sorted((t[1], t[4] + 1) for t in new_tex_tags):
+        if a > b:
+            continue
+        if a > k:
+            kept.append(s[k:a])
+        k = max(k, b + 1)
+    kept.append(s[k:])
+    new_s = ''.join(kept)
 
     if kwargs.get('pb'):  # Update progressbar
         kwargs.get('pb').update('Removing environments')
     return new_s
 
 
+@prof.stage
 def remove_commands_param(
     s: str,
     lang: str,
@@ -923,6 +1153,7 @@ def remove_commands_param(
             elif i < tex_tags[k][3] + 1:
                 pass
             else:  # Advance to other tag
+                ut.check_time_budget()
                 sub_s = s[tex_tags[k][0]:tex_tags[k][3] + 2]
 
                 # If the command does not continue, write the text for such
@@ -943,7 +1174,7 @@ def remove_commands_param(
                     # If not invalid, call the analysis for its commands, check that
                     # it can be recursive
                     if not is_invalid:
-                        new_s += output_text_for_some_commands(sub_s, lang)
+                        new_s += output_text_for_some_commands(sub_s, lang, kwargs.get('depth', 0))
                 k += 1
         else:
             new_s += s[i]
@@ -968,6 +1199,7 @@ def remove_commands_param(
     return new_s
 
 
+@prof.stage
 def remove_commands_param_noargv(s: str, **kwargs) -> str:
     """
     Remove all commands without arguments.
@@ -990,6 +1222,7 @@ def remove_commands_param_noargv(s: str, **kwargs) -> str:
             elif i < tex_tags[k][1]:
                 pass
             else:  # Advance to other tag
+                ut.check_time_budget()
                 k += 1
         else:
             new_s += s[i]
@@ -999,6 +1232,7 @@ def remove_commands_param_noargv(s: str, **kwargs) -> str:
     return new_s
 
 
+@prof.stage
 def unicode_chars_equations(s: str, **kwargs) -> str:
     """
     Converts all equations to unicode.
@@ -1024,6 +1258,7 @@ def unicode_chars_equations(s: str, **kwargs) -> str:
             elif tex_tags[k][2] < i < tex_tags[k][3]:
                 new_s += s[i]
             elif i == tex_tags[k][3]:  # Advance to other tag
+                ut.check_time_budget()
                 new_s += s[i]
                 k += 1
                 added_s = False
@@ -1035,10 +1270,12 @@ def unicode_chars_equations(s: str, **kwargs) -> str:
     return new_s
 
 
+@prof.stage
 def process_chars_equations(
     s: str,
     lang: str,
     single_only: bool,
+    eqn_number: Optional[List[int]] = None,
     **kwargs
 ) -> str:
     """
@@ -1047,8 +1284,10 @@ def process_chars_equations(
     :param s: Latex string code
     :param lang: Language tag of the code
     :param single_only: Only process single char equations. If False, replaces the equation by a text-label
+    :param eqn_number: Single element list with the next equation label number. If given, it is updated, useful to keep the numbering between calls
     :return: Code without symbols
     """
+    font_format = get_font_format()
     tex_tags = ut.find_tex_command_char(s, ut.TEX_EQUATION_CHARS)
     if len(tex_tags) == 0:
         if kwargs.get('pb'):  # Update progressbar
@@ -1057,7 +1296,8 @@ def process_chars_equations(
 
     new_s = ''
     k = 0  # Moves through tags
-    eqn_number = 0
+    if eqn_number is None:
+        eqn_number = [0]
     added_equ = False
 
     for i in range(len(s)):
@@ -1069,19 +1309,20 @@ def process_chars_equations(
             elif tex_tags[k][1] <= i <= tex_tags[k][2] and not added_equ:
                 equ = s[tex_tags[k][1]:tex_tags[k][2] + 1]
                 if len(equ) == 1:
-                    new_s += FONT_FORMAT_SETTINGS['equation'] + s[i] + FONT_FORMAT_SETTINGS['normal']
+                    new_s += font_format['equation'] + s[i] + font_format['normal']
                 else:
                     if not single_only:
-                        new_s += FONT_FORMAT_SETTINGS['equation'] + \
-                                 LANG_TT_TAGS.get(lang, 'multi_char_equ').format(eqn_number) + \
-                                 FONT_FORMAT_SETTINGS['normal']
-                        eqn_number += 1
+                        new_s += font_format['equation'] + \
+                                 LANG_TT_TAGS.get(lang, 'multi_char_equ').format(eqn_number[0]) + \
+                                 font_format['normal']
+                        eqn_number[0] += 1
                     else:
                         new_s += equ
                 added_equ = True
             # elif tex_tags[k][2] < i < tex_tags[k][3]:
             #     continue
             elif tex_tags[k][3] == i:
+                ut.check_time_budget()
                 k += 1
                 added_equ = False
                 continue
@@ -1093,6 +1334,7 @@ def process_chars_equations(
     return new_s
 
 
+@prof.stage
 def strip_punctuation(s: str, **kwargs) -> str:
     """
     Strips punctuation. For example, ``'mycode :'`` to ``'mycode:'``.
@@ -1109,6 +1351,7 @@ def strip_punctuation(s: str, **kwargs) -> str:
     return s
 
 
+@prof.stage
 def process_def(
     s: str,
     clear_learned: bool = True,
@@ -1123,7 +1366,7 @@ def process_def(
     :param replace: Replace instances of learned defs
     :return: Latex without definitions
     """
-    if '\\def' not in s:
+    if '\\def' not in s and (clear_learned or not replace or len(_DEFS) == 0):
         if kwargs.get('pb'):  # Update progressbar
             kwargs.get('pb').update('No definitions found in code')
         return s
@@ -1148,6 +1391,7 @@ def process_def(
             if found_def and s[i] == '}' and s[i - 1] != '\\':
                 depth -= 1
                 if depth == 0:
+                    ut.check_time_budget()
                     c = i
                     def_ranges.append((a, c))
 
@@ -1182,6 +1426,7 @@ def process_def(
                             new_s_def += new_s[a:b + 1]
                         k += b - a
                         w += 1
+                        ut.check_time_budget()
                         if w == len(st):
                             new_s_def += new_s[k + 1:]
                             break
@@ -1194,6 +1439,7 @@ def process_def(
     return new_s
 
 
+@prof.stage
 def process_items(s: str, lang: str, **kwargs) -> str:
     """
     Process itemize and enumerate.
@@ -1233,36 +1479,96 @@ def process_items(s: str, lang: str, **kwargs) -> str:
         """
         return e == 'itemize' or e == 'enumerate' or e == 'tablenotes'
 
-    # First, process the nested ones
-    while True:
-        equal = False
-        envs = ut.find_tex_environments(s)
-        for tag in envs:
-            t, a, b, c, d, t2, _, item_depth = tag
-            t, t2 = _get_name(t), _get_name(t2)
-            if t == '' or t2 == '':
-                continue
-            if t == t2 or _are_item(t) and _are_item(t2):
-                s = s[0:a] + _process_item(s[b:c].strip(), t, item_depth) + s[d + 2:]
-                equal = True
+    def _process_envs(code: str) -> str:
+        """
+        Process the item environments of a code.
+
+        :param code: Latex code
+        :return: Processed code
+        """
+        # First, process the nested ones
+        while True:
+            ut.check_time_budget()
+            equal = False
+            envs = ut.find_tex_environments(code)
+            for tag in envs:
+                t, a, b, c, d, t2, _, item_depth = tag
+                t, t2 = _get_name(t), _get_name(t2)
+                if t == '' or t2 == '':
+                    continue
+                if t == t2 or _are_item(t) and _are_item(t2):
+                    code = code[0:a] + _process_item(code[b:c].strip(), t, item_depth) + code[d + 2:]
+                    equal = True
+                    break
+            if not equal:
                 break
-        if not equal:
-            break
 
-    # Not nested
-    while True:
-        conv = False
-        envs = ut.find_tex_environments(s)
-        for tag in envs:
-            t, a, b, c, d, _, _, _ = tag
-            t = _get_name(t)
-            if t == '':
-                continue
-            s = s[0:a] + remove_commands_param(_process_item(s[b:c].strip(), t), lang) + s[d + 2:]
-            conv = True
+        # Not nested
+        while True:
+            ut.check_time_budget()
+            conv = False
+            envs = ut.find_tex_environments(code)
+            for tag in envs:
+                t, a, b, c, d, _, _, _ = tag
+                t = _get_name(t)
+                if t == '':
+                    continue
+                code = code[0:a] + remove_commands_param(_process_item(code[b:c].strip(), t), lang) + code[d + 2:]
+                conv = True
+                break
+            if not conv:
+                break
+        return code
+
+    # Each outermost item environment is processed apart, thus, the environments
+    # are only found again within the processed one. If the environments or the
+    # braces are unbalanced, an environment crosses a block, or an environment is
+    # not found until the others are processed, the whole code is processed
+    blocks = []
+    envs = ut.find_tex_environments(s)
+    for tag in envs:
+        t, a, _, _, d, t2, _, item_depth = tag
+        if _get_name(t) != '':
+            blocks.append((a, d + 2, _get_name(t2) == '' and item_depth == 0))
+    blocks.sort()
+    new_s: Optional[List[str]] = []
+    starts: List[int] = []
+    ends: List[int] = []
+    k = 0  # End of the last block
+    for a, b, outer in blocks:
+        if b <= k:  # Within the last block
+            continue
+        if a < k or not outer:
+            new_s = None
             break
-        if not conv:
+        block = _process_envs(s[a:b])
+        if block == s[a:b]:  # The environment is not found apart
+            new_s = None
             break
+        new_s.append(s[k:a])
+        new_s.append(block)
+        starts.append(a)
+        ends.append(b)
+        k = b
+
+    def _block(p: int) -> int:
+        """
+        Return the block which contains a position.
+
+        :param p: Position
+        :return: Block index, -1 if not within a block
+        """
+        j = bisect.bisect_right(starts, p) - 1
+        return j if j >= 0 and p < ends[j] else -1
+
+    if new_s is not None and any(_block(tag[1]) != _block(tag[4] + 1) for tag in envs):
+        new_s = None
+    if new_s is not None:
+        new_s.append(s[k:])
+        new_s = ''.join(new_s)
+        if any(_get_name(tag[0]) != '' for tag in ut.find_tex_environments(new_s)):
+            new_s = None
+    s = _process_envs(s) if new_s is None else new_s
 
     if kwargs.get('pb'):  # Update progressbar
         kwargs.get('pb').update('Processing item/enumerate environments')
@@ -1383,6 +1689,7 @@ def _int_to_alph(n: int) -> str:
     return string
 
 
+@prof.stage
 def process_begin_document(s: str, **kwargs) -> str:
     """
     Removes all code outside begin document, if found.
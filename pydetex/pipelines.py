@@ -7,19 +7,117 @@ Defines the pipelines which apply parsers.
 """
 
 __all__ = [
+    'fast',
+    'parallel',
     'simple',
+    'stream',
     'strict',
     'strict_eqn',
+    'styled',
     'PipelineType'
 ]
 
+import concurrent.futures
+import functools
+import inspect
+import multiprocessing
+import os
+import re
+import time
+
 import pydetex.parsers as par
-from pydetex.utils import ProgressBar
-from typing import Callable
+import pydetex.profiling as prof
+from pydetex._symbols import REPLACE_SYMBOLS_LIBRARY, REPLACE_TEX_COMMANDS_LIBRARY
+from pydetex.utils import find_tex_command_char, ProgressBar, tags_to_spans, TEX_EQUATION_CHARS, TexMmapScanner, \
+    TimeBudget
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union, IO
 
 PipelineType = Callable
 
+# Regexes used by the fast pipeline
+_FAST_ARGS = r'(?:\s*\[[^\[\]]*\])*'  # Optional arguments
+_FAST_RE_ARG_COMMANDS = re.compile(
+    r'\\(?:label|ref|eqref|autoref|[cC]ref|pageref|[a-zA-Z]*cite[a-zA-Z]*|include(?:graphics)?|input|'
+    r'url|usepackage|documentclass|bibliography(?:style)?|(?:re)?newcommand|[hv]space|vskip|hskip|'
+    r'setlength|begin|end)\*?' + _FAST_ARGS + r'(?:\s*{[^{}]*})*' + _FAST_ARGS
+)
+_FAST_RE_BLANK_LINES = re.compile(r'\n{3,}')
+_FAST_RE_BRACES = re.compile(r'(?<!\\)[{}]')
+_FAST_RE_COMMAND = re.compile(r'\\[a-zA-Z@]+\*?' + _FAST_ARGS)
+_FAST_RE_COMMENTS = re.compile(r'(?<!\\)%[^\n]*')
+_FAST_RE_ENVIRONMENTS = re.compile(
+    r'\\begin{([a-zA-Z]*(?:' + '|'.join(par.REMOVED_ENVIRONMENTS) +
+    r'|equation|align|gather|multline|displaymath|math|eqnarray)[a-zA-Z]*\*?)}.*?\\end{\1}', re.DOTALL
+)
+_FAST_RE_MATH = re.compile(r'\$\$.*?\$\$|(?<!\\)\$.*?(?<!\\)\$|\\\(.*?\\\)|\\\[.*?\\\]', re.DOTALL)
+_FAST_RE_SPACES = re.compile(r'[ \t]+')
+_FAST_RE_SPACES_NEWLINE = re.compile(r' *\n *')
+_FAST_RE_SYMBOLS = re.compile('|'.join(re.escape(k) for k, _ in sorted(
+    REPLACE_SYMBOLS_LIBRARY, key=lambda x: -len(x[0]))) + r'|\\[%${}]')
+_FAST_RE_TEX_SYMBOLS = re.compile(r'\\[a-zA-Z]+(?![a-zA-Z])')
+_FAST_RE_UNWRAP = re.compile(r'\\[a-zA-Z@]+\*?' + _FAST_ARGS + r'\s*{([^{}]*)}')
+_FAST_SYMBOLS = dict(REPLACE_SYMBOLS_LIBRARY + [('\\%', '%'), ('\\$', '$'), ('\\{', '{'), ('\\}', '}')])
+_FAST_TEX_SYMBOLS = dict(REPLACE_TEX_COMMANDS_LIBRARY)
+_FAST_UNWRAP_DEPTH = 3  # Max nested commands unwrapped
+
+# Tokens tracked by the stream splitter
+_STREAM_RE_TOKENS = re.compile(r'\\(begin|end)\s*{([^{}]*)}|\\[\\$%{}]|\\[\[\]()]|\$\$|[$%{}]')
+_STREAM_RE_COMMENT = re.compile(r'(?<!\\)%')
+_STREAM_VERBATIM_ENVIRONMENTS = ('comment', 'lstlisting', 'minted', 'verbatim', 'verbatim*')
+
+# Text around the segments processed in parallel, as the code next to them
+_PARALLEL_MARK = 'PYDETEXPARALLELSEGMENT'
+
+
+def _cached(pipeline: PipelineType) -> PipelineType:
+    """
+    Enable the ``cache`` argument of a pipeline. If given a ``cache.ResultCache``,
+    the result is returned from the cache if stored.
+
+    :param pipeline: Pipeline
+    :return: Pipeline with cache
+    """
+    signature = inspect.signature(pipeline)
+
+    @functools.wraps(pipeline)
+    def _pipeline(*args, **kwargs) -> str:
+        cache = kwargs.pop('cache', None)
+        if cache is None:
+            return pipeline(*args, **kwargs)
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        pargs = dict(bound.arguments)
+        pargs.update(pargs.pop('kwargs', {}))
+        s, lang = pargs.pop('s'), pargs.pop('lang')
+        return cache.apply(pipeline, s, lang, pargs)
+
+    return _pipeline
+
+
+def _time_budget(pipeline: PipelineType) -> PipelineType:
+    """
+    Enable the ``time_budget`` argument of a pipeline, the max seconds to process
+    the code. If exceeded, the pipeline is aborted raising ``TimeoutError`` (see
+    ``utils.TimeBudget``).
 
+    :param pipeline: Pipeline
+    :return: Pipeline with time budget
+    """
+
+    @functools.wraps(pipeline)
+    def _pipeline(*args, **kwargs) -> str:
+        time_budget = kwargs.pop('time_budget', None)
+        if time_budget is None:
+            return pipeline(*args, **kwargs)
+        with TimeBudget(time_budget):
+            return pipeline(*args, **kwargs)
+
+    return _pipeline
+
+
+@prof.pipeline
+@_time_budget
+@_cached
 def simple(
     s: str,
     lang: str = 'en',
@@ -49,16 +147,18 @@ def simple(
         steps -= 1
     pb = kwargs.get('progressbar', ProgressBar(steps)) if show_progress else None
     s = '\n'.join(s.splitlines())  # Removes \r\n
-    s = par.process_inputs(s, pb=pb)
-    s = par.remove_comments(s, pb=pb)
-    s = par.process_begin_document(s, pb=pb)
+    if kwargs.get('document_passes', True):  # Disabled if already applied to the whole code
+        s = par.process_inputs(s, pb=pb, resolver=kwargs.get('resolver'))
+        s = par.remove_comments(s, pb=pb)
+        s = par.process_begin_document(s, pb=pb)
     s = par.simple_replace(s, pb=pb)
-    s = par.process_def(s, pb=pb, replace=kwargs.get('replace_defs', False))
+    s = par.process_def(s, pb=pb, replace=kwargs.get('replace_defs', False),
+                        clear_learned=kwargs.get('clear_learned_defs', True))
     if remove_common_tags:
         s = par.remove_common_tags(s, pb=pb)
-    s = par.process_cite(s, pb=pb, compress_cite=kwargs.get('compress_cite', True))
+    s = par.process_cite(s, pb=pb, compress_cite=kwargs.get('compress_cite', True), cites=kwargs.get('cites'))
     s = par.process_citeauthor(s, lang, pb=pb)
-    s = par.process_ref(s, pb=pb)
+    s = par.process_ref(s, pb=pb, refs=kwargs.get('refs'))
     s = par.process_labels(s, pb=pb)
     s = par.process_items(s, lang, pb=pb)
     if replace_single_chars_eqn:
@@ -69,11 +169,67 @@ def simple(
         s = par.replace_pydetex_tags(s, pb=pb, **kwargs)
     s = par.strip_punctuation(s, pb=pb)
     s = par.simple_replace(s, pb=pb)
-    if s[-1] == '\\':
+    if s.endswith('\\'):
         s = s[0:len(s) - 1]
     return s
 
 
+@prof.pipeline
+@_time_budget
+@_cached
+def fast(
+    s: str,
+    lang: str = 'en',
+    show_progress: bool = False,
+    **kwargs
+) -> str:
+    """
+    Approximate pipeline for bulk workloads, like search indexing. It applies a
+    fixed set of regexes, each one in a linear pass: it removes the comments, the
+    preamble, the math, the default removed environments, and the references;
+    unwraps the commands, keeping their arguments; replaces the tex symbols; and
+    normalizes the whitespace. Cites, references and equations are dropped instead
+    of replaced, and nested braces deeper than three levels are not unwrapped.
+
+    :param s: String latex
+    :param lang: Language tag of the code
+    :param show_progress: Show progress bar
+    :return: String with no latex!
+    """
+    pb = kwargs.get('progressbar', ProgressBar(steps=6)) if show_progress else None
+    s = '\n'.join(s.splitlines())  # Removes \r\n
+    s = _FAST_RE_COMMENTS.sub('', s)
+    s = par.process_begin_document(s, pb=pb)
+    s = _FAST_RE_ENVIRONMENTS.sub(' ', s)
+    s = _FAST_RE_MATH.sub(' ', s)
+    if pb:
+        pb.update('Removing environments and equations')
+    s = _FAST_RE_ARG_COMMANDS.sub('', s)
+    for _ in range(_FAST_UNWRAP_DEPTH):
+        s, n = _FAST_RE_UNWRAP.subn(r'\1', s)
+        if n == 0:
+            break
+    if pb:
+        pb.update('Unwrapping commands')
+    s = _FAST_RE_TEX_SYMBOLS.sub(lambda m: _FAST_TEX_SYMBOLS.get(m.group(0), m.group(0)), s)
+    s = _FAST_RE_COMMAND.sub('', s)
+    if pb:
+        pb.update('Removing commands')
+    s = _FAST_RE_SYMBOLS.sub(lambda m: _FAST_SYMBOLS[m.group(0)], s)
+    s = _FAST_RE_BRACES.sub('', s)
+    if pb:
+        pb.update('Replacing symbols')
+    s = _FAST_RE_SPACES.sub(' ', s)
+    s = _FAST_RE_SPACES_NEWLINE.sub('\n', s)
+    s = _FAST_RE_BLANK_LINES.sub('\n\n', s)
+    if pb:
+        pb.update('Normalizing whitespace')
+    return s.strip()
+
+
+@prof.pipeline
+@_time_budget
+@_cached
 def strict(
     s: str,
     lang: str = 'en',
@@ -96,7 +252,8 @@ def strict(
         kwargs['progressbar'] = pb
     s = simple(s, lang, replace_pydetex_tags=False, remove_common_tags=False,
                show_progress=show_progress, replace_single_chars_eqn=False, **kwargs)  # 15 steps
-    s = par.process_chars_equations(s, lang, single_only=not eqn_simple, pb=pb)
+    s = par.process_chars_equations(s, lang, single_only=not eqn_simple, pb=pb,
+                                    eqn_number=kwargs.get('eqn_number'))
     s = par.remove_equations(s, pb=pb)
     s = par.remove_environments(s, pb=pb)
     s = par.remove_commands_param(s, lang, pb=pb)
@@ -108,6 +265,9 @@ def strict(
     return s
 
 
+@prof.pipeline
+@_time_budget
+@_cached
 def strict_eqn(
     s: str,
     lang: str = 'en',
@@ -123,3 +283,387 @@ def strict_eqn(
     :return: String with no latex!
     """
     return strict(s, lang, show_progress, eqn_simple=False, **kwargs)
+
+
+def styled(
+    s: str,
+    lang: str = 'en',
+    pipeline: Optional[PipelineType] = None,
+    **kwargs
+) -> Tuple[str, List[Tuple[int, int, str]]]:
+    """
+    Apply a pipeline with the font format enabled, and return the plain text with
+    its style spans ``(start, end, style)``, where ``style`` is a font name of
+    ``_fonts.FONT_PROPERTIES``. The text not covered by any span has the normal style.
+    The font format is only enabled within the call (see ``parsers.font_format_context``),
+    thus, it is thread-safe.
+
+    :param s: String latex
+    :param lang: Language tag of the code
+    :param pipeline: Pipeline to apply, if ``None`` use ``strict``
+    :return: String with no latex, style spans
+    """
+    if pipeline is None:
+        pipeline = strict
+    with par.font_format_context(True):
+        s = pipeline(s, lang, **kwargs)
+    return tags_to_spans(s)
+
+
+def _stream_find(line: str, token: str) -> int:
+    """
+    Find a token within a code line, ignoring the comments.
+
+    :param line: Code line
+    :param token: Token
+    :return: Position of the token, -1 if not found or commented
+    """
+    k = line.find(token)
+    if k == -1:
+        return -1
+    c = _STREAM_RE_COMMENT.search(line, 0, k)
+    return -1 if c is not None else k
+
+
+def _stream_split(lines: Iterable[str], chunk_size: int) -> Iterator[str]:
+    """
+    Split the lines of a latex code into chunks of at least ``chunk_size`` chars.
+    The chunks are only cut at blank lines outside any environment, equation and
+    brace group, thus, each one can be processed on its own. The code before
+    ``\\begin{document}`` (the preamble, after any leading comment) is dropped, as
+    well as the text after ``\\end{document}``.
+
+    :param lines: Code lines, or string pieces of the code
+    :param chunk_size: Min chars of each chunk
+    :return: Chunks
+    """
+    buffer: List[str] = []
+    size = 0
+    envs: List[str] = []  # Open environments
+    math = ''  # Token which closes the open equation
+    depth = 0  # Brace depth
+    preamble = False
+    started = False
+    document = False  # Begin document found
+    pending = ''
+    for piece in lines:
+        pending += piece
+        if '\n' not in pending:
+            continue
+        *complete, pending = pending.split('\n')
+        for line in complete:
+            if not started and line.strip() != '' and not line.lstrip().startswith('%'):
+                started = True
+                preamble = line.lstrip().startswith('\\documentclass')
+            if not document:
+                k = _stream_find(line, '\\begin{document}')
+                if k != -1:  # The code before is dropped, and the token is not left to the pipeline
+                    document, preamble = True, False
+                    line = line[k + 16:]
+                    buffer.clear()
+                    size = 0
+                elif preamble:
+                    continue
+            k = _stream_find(line, '\\end{document}')
+            if k != -1:
+                buffer.append(line[0:k])
+                yield '\n'.join(buffer)
+                return
+            for m in _STREAM_RE_TOKENS.finditer(line):
+                t = m.group(0)
+                if envs and envs[-1] in _STREAM_VERBATIM_ENVIRONMENTS:
+                    if m.group(1) == 'end' and m.group(2) == envs[-1]:
+                        envs.pop()
+                elif t == '%':  # Comment, the rest of the line is ignored
+                    break
+                elif m.group(1) == 'begin':
+                    if m.group(2) != 'document':
+                        envs.append(m.group(2))
+                elif m.group(1) == 'end':
+                    if m.group(2) in envs:
+                        del envs[len(envs) - 1 - envs[::-1].index(m.group(2))]
+                elif t == '{':
+                    depth += 1
+                elif t == '}':
+                    depth = max(0, depth - 1)
+                elif math != '':
+                    if t == math:
+                        math = ''
+                elif t in ('$', '$$'):
+                    math = t
+                elif t in ('\\[', '\\('):
+                    math = '\\]' if t == '\\[' else '\\)'
+            if size >= chunk_size and line.strip() == '' and not envs and math == '' and depth == 0:
+                yield '\n'.join(buffer)
+                buffer.clear()
+                size = 0
+            buffer.append(line)
+            size += len(line) + 1
+    if not preamble:
+        buffer.append(pending)
+    if ''.join(buffer).strip() != '':
+        yield '\n'.join(buffer)
+
+
+def stream(
+    f: Union[str, IO[str], Iterable[str]],
+    lang: str = 'en',
+    pipeline: Optional[PipelineType] = None,
+    chunk_size: int = 65536,
+    use_mmap: bool = False,
+    **kwargs
+) -> Iterator[str]:
+    """
+    Apply a pipeline to a large latex code, reading it incrementally. The code is
+    cut in chunks at blank lines outside any environment, equation and brace
+    group, and each chunk is processed by the pipeline; the cite, reference and
+    equation numbers, and the learned definitions, are kept between chunks. Thus, the
+    memory is bounded by the chunk size, not by the document size.
+
+    The output is yielded chunk by chunk, each one separated by a blank line
+    from the previous.
+
+    If ``use_mmap`` is enabled, the file is memory-mapped and scanned at byte
+    level (see ``utils.TexMmapScanner``); the comments, the preamble and the
+    removed environments are dropped before decoding, thus, the code is not read
+    nor decoded as a whole. This is faster for files of many megabytes. The
+    environments are only dropped for the pipelines which remove them (``strict``,
+    ``strict_eqn`` and ``fast``), keeping their cites and references numbered.
+
+    :param f: Latex file path, file object, or iterable of code lines
+    :param lang: Language tag of the code
+    :param pipeline: Pipeline to apply, if ``None`` use ``strict``
+    :param chunk_size: Min chars of each chunk
+    :param use_mmap: Scan the file at byte level. Requires ``f`` to be a file path
+    :return: Output chunks
+    """
+    assert isinstance(chunk_size, int) and chunk_size >= 1
+    if pipeline is None:
+        pipeline = strict
+    if use_mmap:
+        assert isinstance(f, str), 'mmap scanner requires a file path'
+        removed = par.REMOVED_ENVIRONMENTS if pipeline in (strict, strict_eqn, fast) else None
+        with TexMmapScanner(f, removed) as scanner:
+            yield from stream(scanner.text(), lang, pipeline, chunk_size, **kwargs)
+        return
+    if isinstance(f, str):
+        with open(f, 'r', encoding='utf-8') as fo:
+            yield from stream(fo, lang, pipeline, chunk_size, **kwargs)
+        return
+    cites: Dict[str, int] = {}
+    eqn_number: List[int] = [0]
+    refs: List[str] = []
+    first, empty = True, True
+    for chunk in _stream_split(f, chunk_size):
+        s = pipeline(chunk, lang, cites=cites, refs=refs, eqn_number=eqn_number,
+                     clear_learned_defs=first, **kwargs)
+        first = False
+        if s == '':
+            continue
+        yield s if empty else '\n\n' + s
+        empty = False
+
+
+def _parallel_segment(
+        pipeline: PipelineType,
+        s: str,
+        lang: str,
+        cites: Dict[str, int],
+        refs: List[str],
+        eqn_start: int,
+        defs: Dict[str, str],
+        kwargs: Dict[str, object],
+        marks: Tuple[bool, bool] = (False, False)
+) -> Tuple[Optional[Tuple[str, str, str]], int, int, int]:
+    """
+    Apply a pipeline to a segment, within a worker. The segment can be marked by
+    a text before and after it, as the code next to it; thus, the whitespace the
+    pipeline writes on each side is the same as within the whole code.
+
+    :param pipeline: Pipeline
+    :param s: Segment code
+    :param lang: Language tag of the code
+    :param cites: Number of each cite key of the whole code
+    :param refs: Numbered references of the whole code
+    :param eqn_start: Number of the first equation label of the segment
+    :param defs: Definitions learned from the whole code
+    :param kwargs: Pipeline arguments
+    :param marks: Mark the segment before, after
+    :return: Output (whitespace before, text, whitespace after), None if the marks were changed; cites and references count after the segment, equation labels numbered
+    """
+    par._DEFS.clear()
+    par._DEFS.update(defs)
+    eqn_number = [eqn_start]
+    before = _PARALLEL_MARK + '\n' if marks[0] else ''
+    after = '\n' + _PARALLEL_MARK if marks[1] else ''
+    out = pipeline(before + s + after, lang, cites=cites, refs=refs, eqn_number=eqn_number,
+                   clear_learned_defs=False, document_passes=False, **kwargs)
+    before, after = before.strip(), after.strip()
+    if not out.startswith(before) or not out.endswith(after) or len(out) < len(before) + len(after):
+        return None, len(cites), len(refs), eqn_number[0] - eqn_start
+    out = out[len(before):len(out) - len(after)]
+    text = out.lstrip() if marks[0] else out
+    text = text.rstrip() if marks[1] else text
+    if text.strip() == '':
+        return (out if marks[0] else '', '', ''), len(cites), len(refs), eqn_number[0] - eqn_start
+    k = out.index(text)
+    return (out[0:k], text, out[k + len(text):]), len(cites), len(refs), eqn_number[0] - eqn_start
+
+
+def parallel(
+    s: str,
+    lang: str = 'en',
+    pipeline: Optional[PipelineType] = None,
+    workers: int = 0,
+    segment_size: int = 16384,
+    executor: Optional['concurrent.futures.Executor'] = None,
+    **kwargs
+) -> str:
+    """
+    Apply a pipeline to a latex code, processing its segments in parallel within
+    a pool of processes. The text of the output is the same as the serial
+    execution, but the number of blank lines between two segments may differ, as
+    the pipelines strip their output.
+
+    First, the passes which depend on the whole code run once: the inputs,
+    comments and document environment are processed, the definitions are learned,
+    and the cites and references are numbered. Then, the code is cut in segments
+    at blank lines outside any environment, equation and brace group (as
+    ``stream`` does), each one processed by the pipeline with the global state,
+    and the outputs are joined. Each segment is processed between two lines of
+    text, as the code next to it, thus, its first and last commands are processed
+    as within the whole code. The equation labels of each segment are numbered
+    from an estimate of the previous ones; the segments which estimate was wrong
+    are processed again.
+
+    The definitions are removed from the segments before these are processed,
+    thus, as in the serial execution, the instances of a definition are replaced
+    by its last value within the code. If a segment finds a cite or reference not
+    numbered by the global pass, or the pipeline is not ``simple``, ``strict`` or
+    ``strict_eqn``, the code is processed serially.
+
+    The ``time_budget`` argument limits the whole call, including the global
+    passes; each segment is given the remaining time.
+
+    :param s: Latex code
+    :param lang: Language tag of the code
+    :param pipeline: Pipeline to apply, if ``None`` use ``strict``
+    :param workers: Worker processes, if 0 use the CPU count
+    :param segment_size: Min chars of each segment
+    :param executor: Executor to use instead of creating a pool of processes
+    :param kwargs: Pipeline arguments, these must be picklable
+    :return: String with no latex!
+    """
+    assert isinstance(segment_size, int) and segment_size >= 1
+    assert isinstance(workers, int) and workers >= 0
+    if pipeline is None:
+        pipeline = strict
+    kwargs.pop('show_progress', None)
+    kwargs.pop('progressbar', None)
+    cites: Dict[str, int] = kwargs.pop('cites', None)
+    cites = {} if cites is None else cites
+    refs: List[str] = kwargs.pop('refs', None)
+    refs = [] if refs is None else refs
+    eqn_number: List[int] = kwargs.pop('eqn_number', None) or [0]
+    resolver = kwargs.pop('resolver', None)
+    clear_learned_defs = kwargs.pop('clear_learned_defs', True)
+    time_budget: Optional[float] = kwargs.pop('time_budget', None)
+
+    def _serial() -> str:
+        """
+        Apply the pipeline to the whole code, within the time budget of the call.
+
+        :return: Pipeline output
+        """
+        return pipeline(s, lang, cites=cites, refs=refs, eqn_number=eqn_number, resolver=resolver,
+                        clear_learned_defs=clear_learned_defs, **kwargs)
+
+    with TimeBudget(float('inf') if time_budget is None else time_budget) as budget:
+        if pipeline not in (simple, strict, strict_eqn) or len(s) == 0:
+            return _serial()
+
+        # Global passes, as the first stages of the pipeline
+        t = '\n'.join(s.splitlines())
+        t = par.process_inputs(t, resolver=resolver)
+        t = par.remove_comments(t)
+        t = par.process_begin_document(t)
+        segments = list(_stream_split([t], segment_size))
+        if len(segments) < 2 or '\n'.join(segments) != t:
+            return _serial()
+
+        # Learn the definitions and number the cites and references. The segments with
+        # definitions are replaced first, as the pipeline does before learning these
+        g = '\n'.join(par.simple_replace(x) if '\\def' in x else x for x in segments)
+        g = par.process_def(g, clear_learned=clear_learned_defs, replace=kwargs.get('replace_defs', False))
+        if pipeline is simple and kwargs.get('remove_common_tags', True):
+            g = par.remove_common_tags(g)
+        g = par.process_cite(g, cites=cites)
+        par.process_ref(g, refs=refs)
+        defs = dict(par._DEFS)
+        n_cites, n_refs = len(cites), len(refs)
+
+        # Remove the definitions, else, each segment would learn its own values
+        segments = [par.process_def(x, clear_learned=False) if '\\def' in x else x for x in segments]
+        par._DEFS.clear()
+        par._DEFS.update(defs)
+
+        # Estimate the equation labels of each segment
+        starts = [eqn_number[0]]
+        for x in segments[0:-1]:
+            starts.append(starts[-1] + sum(1 for tag in find_tex_command_char(x, TEX_EQUATION_CHARS)
+                                           if tag[2] > tag[1]))
+
+        own_executor = executor is None
+        if own_executor:
+            executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=min(workers or os.cpu_count() or 1, len(segments)),
+                mp_context=multiprocessing.get_context('spawn'))
+        futures: Dict[int, 'concurrent.futures.Future'] = {}
+        try:
+            results: List[Tuple[Optional[Tuple[str, str, str]], int, int, int]] = [(('', '', ''), 0, 0, 0)] * len(segments)
+            redo = list(range(len(segments)))
+            while len(redo) > 0:
+                remaining = budget.deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f'time budget of {time_budget} seconds exceeded')
+                seg_kwargs = kwargs if time_budget is None else dict(kwargs, time_budget=remaining)
+                futures = {i: executor.submit(_parallel_segment, pipeline, segments[i], lang, dict(cites),
+                                              list(refs), starts[i], defs, seg_kwargs,
+                                              (i > 0, i < len(segments) - 1)) for i in redo}
+                for i in redo:
+                    try:
+                        results[i] = futures[i].result(
+                            timeout=None if time_budget is None else max(budget.deadline - time.monotonic(), 0))
+                    except concurrent.futures.TimeoutError:  # Not a builtin TimeoutError before Python 3.11
+                        raise TimeoutError(f'time budget of {time_budget} seconds exceeded')
+                    if results[i][0] is None or results[i][1] != n_cites or results[i][2] != n_refs:
+                        # The marks were changed, or a cite was not numbered by the global pass
+                        for f in futures.values():
+                            f.cancel()
+                        return _serial()
+
+                # Number again the segments which labels start was wrong
+                redo = []
+                start = eqn_number[0]
+                for i in range(len(segments)):
+                    if results[i][3] > 0 and starts[i] != start:
+                        redo.append(i)
+                    starts[i] = start
+                    start += results[i][3]
+        finally:
+            for f in futures.values():  # Pending if aborted
+                f.cancel()
+            if own_executor:
+                executor.shutdown()
+    eqn_number[0] = start
+
+    # Join the segments, the whitespace between two is the longest written by these
+    out: List[str] = []
+    space = ''
+    for (before, text, after), _, _, _ in results:
+        space = max(space, before, key=len)
+        if text != '':
+            out.extend((space, text) if len(out) > 0 else (text,))
+            space = after
+    return ''.join(out)
+
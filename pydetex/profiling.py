@@ -0,0 +1,543 @@
+"""
+PyDetex
+https://github.com/ppizarror/PyDetex
+
+PROFILING
+Structured profiling of the pipelines and their stages.
+"""
+
+__all__ = [
+    'Collector',
+    'CProfileCollector',
+    'JsonLinesCollector',
+    'MemoryCollector',
+    'pipeline',
+    'Profiler',
+    'stage',
+    'StageEvent',
+    'SummaryCollector'
+]
+
+import contextvars
+import cProfile
+import functools
+import itertools
+import json
+import os
+import re
+import threading
+import time
+import tracemalloc
+
+from typing import Any, Callable, Dict, IO, List, Optional, Tuple, Union
+
+# Active profiler, and the pipeline being profiled, of the current context
+_ACTIVE: 'contextvars.ContextVar[Optional[Profiler]]' = contextvars.ContextVar('pydetex_profiler', default=None)
+_PIPELINE: 'contextvars.ContextVar[str]' = contextvars.ContextVar('pydetex_pipeline', default='')
+
+# Traces ignored when accounting the memory of the stages
+_MEMORY_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, __file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>')
+]
+
+# Chars not allowed within the profile file names
+_RE_FILENAME = re.compile(r'[^a-zA-Z0-9_.-]')
+
+
+class StageEvent(object):
+    """
+    Measure of a single pipeline or stage (parser) call. If the call raised an
+    exception, ``error`` is its type name.
+    """
+
+    cpu_time: float
+    error: str
+    index: int
+    input_size: int
+    kind: str
+    memory_net: Optional[int]
+    memory_peak: Optional[int]
+    name: str
+    output_size: int
+    pipeline: str
+    wall_time: float
+
+    def __init__(self, index: int, kind: str, name: str, pipeline: str, input_size: int) -> None:
+        """
+        Constructor.
+
+        :param index: Number of the event within the profiler, assigned on start
+        :param kind: ``pipeline`` or ``stage``
+        :param name: Pipeline or stage name
+        :param pipeline: Name of the pipeline which runs the stage, empty if called alone
+        :param input_size: Chars of the input code
+        """
+        self.cpu_time = 0
+        self.error = ''
+        self.index = index
+        self.input_size = input_size
+        self.kind = kind
+        self.memory_net = None
+        self.memory_peak = None
+        self.name = name
+        self.output_size = 0
+        self.pipeline = pipeline
+        self.wall_time = 0
+
+    def as_dict(self) -> Dict[str, Any]:
+        """
+        Return the event as a dict.
+
+        :return: Event data
+        """
+        return {
+            'index': self.index,
+            'kind': self.kind,
+            'name': self.name,
+            'pipeline': self.pipeline,
+            'input_size': self.input_size,
+            'output_size': self.output_size,
+            'wall_time': self.wall_time,
+            'cpu_time': self.cpu_time,
+            'memory_peak': self.memory_peak,
+            'memory_net': self.memory_net,
+            'error': self.error
+        }
+
+
+class Collector(object):
+    """
+    Observer of the profiler events. Subclasses override the hooks they need.
+    """
+
+    def on_start(self, event: 'StageEvent') -> None:
+        """
+        Called before a pipeline or stage runs. The event has no measures yet.
+
+        :param event: Event
+        """
+        pass
+
+    def on_event(self, event: 'StageEvent') -> None:
+        """
+        Called after a pipeline or stage runs.
+
+        :param event: Measured event
+        """
+        pass
+
+    def on_result(self, event: 'StageEvent', s: str, out: str) -> None:
+        """
+        Called after a pipeline or stage succeeds, after ``on_event``, with its
+        input and output code. The time of this hook is not measured.
+
+        :param event: Measured event
+        :param s: Input code
+        :param out: Output code
+        """
+        pass
+
+    def close(self) -> None:
+        """
+        Release the resources of the collector.
+        """
+        pass
+
+
+class SummaryCollector(Collector):
+    """
+    Aggregate the events of each pipeline and stage, in the order they were first
+    called.
+    """
+
+    _lock: 'threading.Lock'
+    _rows: Dict[Tuple[str, str], Dict[str, Any]]
+
+    def __init__(self) -> None:
+        """
+        Constructor.
+        """
+        self._lock = threading.Lock()
+        self._rows = {}
+
+    def on_event(self, event: 'StageEvent') -> None:
+        with self._lock:
+            key = (event.kind, event.name)
+            if key not in self._rows:
+                self._rows[key] = {'kind': event.kind, 'name': event.name, 'calls': 0, 'wall_time': 0, 'cpu_time': 0,
+                                   'input_size': 0, 'output_size': 0, 'memory_peak': None}
+            row = self._rows[key]
+            row['calls'] += 1
+            row['wall_time'] += event.wall_time
+            row['cpu_time'] += event.cpu_time
+            row['input_size'] += event.input_size
+            row['output_size'] += event.output_size
+            if event.memory_peak is not None:
+                row['memory_peak'] = max(row['memory_peak'] or 0, event.memory_peak)
+
+    def rows(self) -> List[Dict[str, Any]]:
+        """
+        Return the aggregated rows.
+
+        :return: Rows, each one with the kind, name, calls, total times, total sizes and max memory peak
+        """
+        with self._lock:
+            return [dict(r) for r in self._rows.values()]
+
+    def table(self) -> str:
+        """
+        Return the summary as a text table, the stages sorted by wall time.
+
+        :return: Table
+        """
+        rows = self.rows()
+        total = sum(r['wall_time'] for r in rows if r['kind'] == 'stage')
+        lines = [f'{"stage":32s} {"calls":>6s} {"wall (s)":>10s} {"cpu (s)":>10s} {"%":>6s} '
+                 f'{"in":>10s} {"out":>10s} {"peak":>10s}']
+        for r in sorted(rows, key=lambda x: (x['kind'] == 'stage', -x['wall_time'])):
+            pct = f'{100 * r["wall_time"] / total:.1f}' if r['kind'] == 'stage' and total > 0 else ''
+            name = r['name'] if r['kind'] == 'stage' else f'[{r["name"]}]'
+            peak = '' if r['memory_peak'] is None else str(r['memory_peak'])
+            lines.append(f'{name:32s} {r["calls"]:6d} {r["wall_time"]:10.4f} {r["cpu_time"]:10.4f} {pct:>6s} '
+                         f'{r["input_size"]:10d} {r["output_size"]:10d} {peak:>10s}')
+        return '\n'.join(lines)
+
+    def __str__(self) -> str:
+        return self.table()
+
+
+class JsonLinesCollector(Collector):
+    """
+    Write each event as a JSON line.
+    """
+
+    _close: bool
+    _file: IO[str]
+    _lock: 'threading.Lock'
+
+    def __init__(self, f: Union[str, IO[str]]) -> None:
+        """
+        Constructor.
+
+        :param f: File path, the lines are appended; or file object
+        """
+        self._close = isinstance(f, str)
+        self._file = open(f, 'a', encoding='utf-8') if isinstance(f, str) else f
+        self._lock = threading.Lock()
+
+    def on_event(self, event: 'StageEvent') -> None:
+        line = json.dumps(event.as_dict())
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+
+    def close(self) -> None:
+        if self._close:
+            self._file.close()
+
+
+class CProfileCollector(Collector):
+    """
+    Run each stage within ``cProfile``, dumping the stats of each call into a
+    folder as ``<index>_<pipeline>_<stage>.prof``. The files can be read with
+    ``pstats`` or ``snakeviz``. The pipelines are not profiled, only their stages.
+    """
+
+    _local: 'threading.local'
+    files: List[str]
+    path: str
+
+    def __init__(self, path: str) -> None:
+        """
+        Constructor.
+
+        :param path: Folder of the stats files, created if not exists
+        """
+        os.makedirs(path, exist_ok=True)
+        self._local = threading.local()
+        self.files = []
+        self.path = path
+
+    def on_start(self, event: 'StageEvent') -> None:
+        if event.kind != 'stage':
+            return
+        self._local.profile = cProfile.Profile()
+        self._local.profile.enable()
+
+    def on_event(self, event: 'StageEvent') -> None:
+        profile: Optional['cProfile.Profile'] = getattr(self._local, 'profile', None)
+        if event.kind != 'stage' or profile is None:
+            return
+        profile.disable()
+        self._local.profile = None
+        name = _RE_FILENAME.sub('_', f'{event.index:05d}_{event.pipeline or "none"}_{event.name}.prof')
+        f = os.path.join(self.path, name)
+        profile.dump_stats(f)
+        self.files.append(f)
+
+
+class MemoryCollector(Collector):
+    """
+    Account the memory of each stage, taking a ``tracemalloc`` snapshot before
+    and after each call. It records the peak and net allocation of each pipeline
+    and stage call, and the sites (file and line) which allocated the memory kept
+    by each stage, like its output. Requires a profiler with ``memory`` enabled.
+    The snapshots are slow, thus, this collector is meant for offline runs.
+    """
+
+    _local: 'threading.local'
+    _lock: 'threading.Lock'
+    _sites: Dict[str, Dict[str, List[int]]]
+    records: List[Dict[str, Any]]
+
+    def __init__(self) -> None:
+        """
+        Constructor.
+        """
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._sites = {}  # Stage => site => [size, blocks]
+        self.records = []
+
+    def on_start(self, event: 'StageEvent') -> None:
+        if event.kind != 'stage' or not tracemalloc.is_tracing():
+            return
+        self._local.snapshot = tracemalloc.take_snapshot().filter_traces(_MEMORY_FILTERS)
+
+    def on_event(self, event: 'StageEvent') -> None:
+        if event.memory_peak is None:
+            return
+        diff = []
+        snapshot: Optional['tracemalloc.Snapshot'] = getattr(self._local, 'snapshot', None)
+        if event.kind == 'stage' and snapshot is not None:
+            self._local.snapshot = None
+            diff = tracemalloc.take_snapshot().filter_traces(_MEMORY_FILTERS).compare_to(snapshot, 'lineno')
+        with self._lock:
+            self.records.append({'index': event.index, 'kind': event.kind, 'name': event.name,
+                                 'pipeline': event.pipeline, 'input_size': event.input_size,
+                                 'memory_peak': event.memory_peak, 'memory_net': event.memory_net})
+            if event.kind != 'stage':
+                return
+            sites = self._sites.setdefault(event.name, {})
+            for d in diff:
+                if d.size_diff <= 0:
+                    continue
+                frame = d.traceback[0]
+                site = sites.setdefault(f'{frame.filename}:{frame.lineno}', [0, 0])
+                site[0] += d.size_diff
+                site[1] += max(0, d.count_diff)
+
+    def rows(self) -> List[Dict[str, Any]]:
+        """
+        Return the memory of each pipeline and stage, sorted by the max peak. The
+        ``peak_per_char`` is the max ratio between the peak and the input size,
+        useful to size the memory limit of the workers.
+
+        :return: Rows, each one with the kind, name, calls, max peak, total net allocation and peak per char
+        """
+        rows: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        with self._lock:
+            for r in self.records:
+                key = (r['kind'], r['name'])
+                if key not in rows:
+                    rows[key] = {'kind': r['kind'], 'name': r['name'], 'calls': 0, 'memory_peak': 0,
+                                 'memory_net': 0, 'peak_per_char': 0}
+                row = rows[key]
+                row['calls'] += 1
+                row['memory_peak'] = max(row['memory_peak'], r['memory_peak'])
+                row['memory_net'] += r['memory_net']
+                row['peak_per_char'] = max(row['peak_per_char'], r['memory_peak'] / max(1, r['input_size']))
+        return sorted(rows.values(), key=lambda x: (x['kind'] == 'stage', -x['memory_peak']))
+
+    def sites(self, name: str, top: int = 5) -> List[Tuple[str, int, int]]:
+        """
+        Return the sites which allocated the most memory kept by a stage.
+
+        :param name: Stage name
+        :param top: Max number of sites
+        :return: List of (file:line, bytes, blocks)
+        """
+        with self._lock:
+            sites = [(k, v[0], v[1]) for k, v in self._sites.get(name, {}).items()]
+        return sorted(sites, key=lambda x: -x[1])[0:top]
+
+    def report(self, top: int = 3) -> str:
+        """
+        Return the memory of each pipeline and stage as a text table, each stage
+        followed by its top allocation sites.
+
+        :param top: Max number of sites of each stage
+        :return: Report
+        """
+        lines = [f'{"stage":32s} {"calls":>6s} {"peak":>12s} {"net":>12s} {"peak/char":>10s}']
+        for r in self.rows():
+            name = r['name'] if r['kind'] == 'stage' else f'[{r["name"]}]'
+            lines.append(f'{name:32s} {r["calls"]:6d} {r["memory_peak"]:12d} {r["memory_net"]:12d} '
+                         f'{r["peak_per_char"]:10.1f}')
+            if r['kind'] == 'stage':
+                for site, size, blocks in self.sites(r['name'], top):
+                    lines.append(f'    {size:10d} B {blocks:6d} blocks  {site}')
+        return '\n'.join(lines)
+
+    def __str__(self) -> str:
+        return self.report()
+
+
+class Profiler(object):
+    """
+    Emit an event to the collectors for each pipeline and stage call, with its
+    input and output size, wall time, CPU time (of the calling thread) and,
+    optionally, the ``tracemalloc`` memory peak and net allocation in bytes.
+
+    The profiler is enabled within its context, or given to a pipeline through
+    the ``profiler`` argument. The stages called by another stage are measured
+    as part of it, not as new events. If no profiler is enabled, the cost of each
+    call is a context variable lookup.
+    """
+
+    _counter: 'itertools.count'
+    _local: 'threading.local'
+    _tracemalloc: bool
+    collectors: List['Collector']
+    memory: bool
+
+    def __init__(self, *collectors: 'Collector', memory: bool = False) -> None:
+        """
+        Constructor.
+
+        :param collectors: Collectors of the events
+        :param memory: Measure the memory peak with ``tracemalloc``. Requires Python 3.9 or later
+        """
+        for c in collectors:
+            assert isinstance(c, Collector), f'invalid collector {c}'
+        self._counter = itertools.count()
+        self._local = threading.local()
+        self._tracemalloc = False
+        self.collectors = list(collectors)
+        self.memory = memory and hasattr(tracemalloc, 'reset_peak')
+
+    def __enter__(self) -> 'Profiler':
+        if not hasattr(self._local, 'tokens'):
+            self._local.tokens = []
+        self._local.tokens.append(_ACTIVE.set(self))
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracemalloc = True
+        return self
+
+    def __exit__(self, *args) -> None:
+        _ACTIVE.reset(self._local.tokens.pop())
+        if self._tracemalloc and len(self._local.tokens) == 0:
+            tracemalloc.stop()
+            self._tracemalloc = False
+
+    def close(self) -> None:
+        """
+        Close the collectors.
+        """
+        for c in self.collectors:
+            c.close()
+
+    def measure(self, kind: str, name: str, f: Callable[..., str], s: str, args: tuple, kwargs: Dict[str, Any]) -> str:
+        """
+        Call a pipeline or stage, emitting its events.
+
+        :param kind: ``pipeline`` or ``stage``
+        :param name: Pipeline or stage name
+        :param f: Function, which receives the code as first argument
+        :param s: Latex code
+        :param args: Other arguments
+        :param kwargs: Keyword arguments
+        :return: Function output
+        """
+        event = StageEvent(next(self._counter), kind, name, _PIPELINE.get(), len(s))
+        for c in self.collectors:
+            c.on_start(event)
+        memory = self.memory and tracemalloc.is_tracing()
+        base = 0
+        if memory:
+            base = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            if kind == 'pipeline':
+                self._local.peak = 0
+        # Within a stage, the nested stages are not profiled
+        token = _ACTIVE.set(None) if kind == 'stage' else None
+        t0, c0 = time.perf_counter(), time.thread_time()
+        out = None
+        try:
+            out = f(s, *args, **kwargs)
+        except BaseException as e:
+            event.error = type(e).__name__
+            raise
+        finally:
+            event.wall_time = time.perf_counter() - t0
+            event.cpu_time = time.thread_time() - c0
+            if token is not None:
+                _ACTIVE.reset(token)
+            if memory:
+                peak = tracemalloc.get_traced_memory()[1]
+                if kind == 'stage':
+                    self._local.peak = max(getattr(self._local, 'peak', 0), peak)
+                else:  # The stages reset the peak, thus, keep the max of all of them
+                    peak = max(peak, self._local.peak)
+                event.memory_peak = max(0, peak - base)
+                event.memory_net = tracemalloc.get_traced_memory()[0] - base
+            event.output_size = len(out) if isinstance(out, str) else 0
+            for c in self.collectors:
+                c.on_event(event)
+        if isinstance(out, str):
+            for c in self.collectors:
+                c.on_result(event, s, out)
+        return out
+
+
+def stage(f: Callable[..., str]) -> Callable[..., str]:
+    """
+    Decorate a stage (parser), which receives the code as first argument, to be
+    measured by the enabled profiler.
+
+    :param f: Stage
+    :return: Profiled stage
+    """
+    name = f.__name__
+
+    @functools.wraps(f)
+    def _stage(s: str, *args, **kwargs) -> str:
+        profiler = _ACTIVE.get()
+        if profiler is None:
+            return f(s, *args, **kwargs)
+        return profiler.measure('stage', name, f, s, args, kwargs)
+
+    return _stage
+
+
+def pipeline(f: Callable[..., str]) -> Callable[..., str]:
+    """
+    Decorate a pipeline to be measured by the enabled profiler, and enable its
+    ``profiler`` argument. The pipelines called by another pipeline are measured
+    as part of it.
+
+    :param f: Pipeline
+    :return: Profiled pipeline
+    """
+    name = f.__name__
+
+    @functools.wraps(f)
+    def _pipeline(s: str, *args, **kwargs) -> str:
+        profiler: Optional['Profiler'] = kwargs.pop('profiler', None)
+        if profiler is not None:
+            with profiler:
+                return _pipeline(s, *args, **kwargs)
+        profiler = _ACTIVE.get()
+        if profiler is None or _PIPELINE.get() != '':
+            return f(s, *args, **kwargs)
+        token = _PIPELINE.set(name)
+        try:
+            return profiler.measure('pipeline', name, f, s, args, kwargs)
+        finally:
+            _PIPELINE.reset(token)
+
+    return _pipeline
+
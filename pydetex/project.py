@@ -0,0 +1,324 @@
+"""
+PyDetex
+https://github.com/ppizarror/PyDetex
+
+PROJECT
+Resolves the files included by a latex project.
+"""
+
+__all__ = ['ProjectResolver']
+
+import os
+import re
+import threading
+
+import pydetex.parsers as par
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pydetex.utils import open_file
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+# Commands which include a file, with the file as the single argument
+_RE_INCLUDE = re.compile(r'\\(input|include|subfile)\s*{([^{}]*)}')
+# Commands which include a file from a folder: \import{folder}{file}
+_RE_IMPORT = re.compile(r'\\(import|subimport|inputfrom|subinputfrom|includefrom|subincludefrom)\*?'
+                        r'\s*{([^{}]*)}\s*{([^{}]*)}')
+_RE_DOCUMENT = re.compile(r'\\begin\s*{document}(.*?)(?:\\end\s*{document}|$)', re.DOTALL)
+# Folder levels indexed if the project root is the folder of a file, which may be large (e.g. the home)
+_FILE_MAX_DEPTH = 2
+
+
+class ProjectResolver(object):
+    """
+    Resolves the ``\\input``, ``\\include``, ``\\subfile`` and ``\\import`` commands
+    of a latex project, replacing them by the contents of the files, recursively.
+
+    The files of the project folder are indexed once, thus, finding a file does
+    not list the folders. If ``max_depth`` is given, only the folders up to that
+    depth are indexed, and the deeper files are only found by their path, as
+    written in the include commands. The loaded files are cached without comments, and are
+    only read again if their modification time changes. Cyclic includes and the
+    files not found are left unresolved, and reported by ``errors``.
+
+    Before resolving, the included files are loaded concurrently by a thread pool
+    (see ``prefetch``); thus, the latency of each read overlaps with the others
+    instead of adding up, which is notable on network filesystems.
+    """
+
+    _cache: Dict[str, Tuple[int, str]]  # Path: (mtime, code without comments)
+    _errors: List[Tuple[str, str]]
+    _files: Dict[str, str]  # Relative path: absolute path
+    _graph: Dict[str, List[str]]
+    _lock: 'threading.Lock'
+    _names: Dict[str, List[str]]  # File name: absolute paths
+    _stats: Dict[str, int]
+    main: str
+    max_depth: int
+    root: str
+    workers: int
+
+    def __init__(self, root: str = '.', main: str = '', workers: int = 8, max_depth: int = -1) -> None:
+        """
+        Constructor.
+
+        :param root: Project folder, where the main file is
+        :param main: Main file, relative to the root. Used to find cyclic includes of the code given to ``resolve``
+        :param workers: Number of threads that load the included files. If ``1``, the files are loaded while resolving
+        :param max_depth: Max depth of the indexed folders, the root is ``0``. If ``-1``, all the folders are indexed
+        """
+        assert isinstance(workers, int) and workers >= 1
+        assert isinstance(max_depth, int) and max_depth >= -1
+        self.max_depth = max_depth
+        self.workers = workers
+        self._lock = threading.Lock()
+        self.main = main.replace('\\', '/')
+        self.root = os.path.abspath(root)
+        self._cache = {}
+        self._errors = []
+        self._files = {}
+        self._graph = {}
+        self._names = {}
+        self._stats = {'hits': 0, 'misses': 0}
+        self.refresh()
+
+    @classmethod
+    def from_file(cls, path: str, workers: int = 8) -> 'ProjectResolver':
+        """
+        Create the resolver of a file whose project root is unknown. The folder of
+        the file is the root, and only its first levels are indexed; the deeper
+        files are still found by their path.
+
+        :param path: Main file
+        :param workers: Number of threads that load the included files
+        :return: Resolver
+        """
+        path = os.path.abspath(path)
+        return cls(os.path.dirname(path), main=os.path.basename(path), workers=workers, max_depth=_FILE_MAX_DEPTH)
+
+    def refresh(self) -> None:
+        """
+        Index the files of the project folder again. Hidden folders, and the folders
+        deeper than ``max_depth``, are skipped.
+        """
+        self._files.clear()
+        self._names.clear()
+        for path, dirs, files in os.walk(self.root):
+            depth = 0 if path == self.root else os.path.relpath(path, self.root).count(os.sep) + 1
+            if 0 <= self.max_depth <= depth:
+                dirs[:] = []
+            dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+            for f in sorted(files):
+                p = os.path.join(path, f)
+                self._files[os.path.relpath(p, self.root).replace(os.sep, '/')] = p
+                self._names.setdefault(f, []).append(p)
+
+    def find(self, name: str, folder: str = '') -> Optional[str]:
+        """
+        Find a file of the project. The name is looked relative to the folder, then
+        relative to the project root, and finally, by its file name in any folder
+        of the project. If the name has no extension, ``.tex`` is added.
+
+        :param name: File name, as written in the latex code
+        :param folder: Folder to look from, relative to the project root
+        :return: Absolute path, None if not found
+        """
+        name = name.strip().replace('\\', '/')
+        if name == '':
+            return None
+        names = [name] if os.path.splitext(name)[1] != '' else [name + '.tex', name]
+        for n in names:
+            if os.path.isabs(n):
+                if os.path.isfile(n):
+                    return os.path.normpath(n)
+                continue
+            for d in (folder, ''):
+                rel = os.path.normpath(os.path.join(d, n)).replace(os.sep, '/')
+                if rel in self._files:
+                    return self._files[rel]
+                if rel.startswith('..') or self.max_depth >= 0:  # Outside the project, or not indexed
+                    p = os.path.join(self.root, rel)
+                    if os.path.isfile(p):
+                        return os.path.normpath(p)
+        for n in names:
+            if os.path.basename(n) in self._names:
+                return self._names[os.path.basename(n)][0]
+        return None
+
+    def load(self, path: str) -> str:
+        """
+        Load a file without its comments. The contents are cached until the file
+        is modified.
+
+        :param path: File path
+        :return: Code without comments
+        """
+        path = os.path.abspath(path)
+        mtime = os.stat(path).st_mtime_ns
+        cached = self._cache.get(path)
+        if cached is not None and cached[0] == mtime:
+            with self._lock:
+                self._stats['hits'] += 1
+            return cached[1]
+        s = par.remove_comments('\n'.join(open_file(path).splitlines()))
+        with self._lock:
+            self._stats['misses'] += 1
+            self._cache[path] = (mtime, s)
+        return s
+
+    def cache_stats(self) -> Dict[str, int]:
+        """
+        Return the stats of the contents cache.
+
+        :return: Dict with hits, misses, and cached files
+        """
+        return {'hits': self._stats['hits'], 'misses': self._stats['misses'], 'files': len(self._cache)}
+
+    def errors(self) -> List[Tuple[str, str]]:
+        """
+        Return the errors of the last resolution.
+
+        :return: List of (message, file name)
+        """
+        return list(self._errors)
+
+    def graph(self) -> Dict[str, List[str]]:
+        """
+        Return the include graph of the last resolution.
+
+        :return: Dict of file: included files, relative to the project root. The code given to ``resolve`` is the main file
+        """
+        return {k: list(v) for k, v in self._graph.items()}
+
+    def _rel(self, path: str) -> str:
+        """
+        Return a path relative to the project root.
+
+        :param path: Absolute path
+        :return: Relative path
+        """
+        return os.path.relpath(path, self.root).replace(os.sep, '/')
+
+    @staticmethod
+    def _includes(s: str, folder: str) -> Iterator[Tuple['re.Match', str, str]]:
+        """
+        Find the include commands of a code.
+
+        :param s: Latex code without comments
+        :param folder: Folder of the relative includes, relative to the project root
+        :return: Iterator of (command match, file name, folder of the file name)
+        """
+        k = 0
+        for m in sorted(list(_RE_INCLUDE.finditer(s)) + list(_RE_IMPORT.finditer(s)), key=lambda x: x.start()):
+            if m.start() < k:  # Within another command
+                continue
+            k = m.end()
+            cmd = m.group(1)
+            if cmd in ('input', 'include', 'subfile'):
+                name, sub_folder = m.group(2), folder
+            else:
+                base = folder if cmd.startswith('sub') else ''
+                sub_folder = os.path.normpath(os.path.join(base, m.group(2).strip())).replace(os.sep, '/')
+                name = m.group(3)
+            if '\\jobname' not in name:
+                yield m, name, sub_folder
+
+    def prefetch(self, s: str, folder: str = '') -> int:
+        """
+        Load the files included by a code, recursively, using a thread pool. Each
+        loaded file is scanned for its includes, which are loaded next.
+
+        :param s: Latex code without comments
+        :param folder: Folder of the code, relative to the project root
+        :return: Number of included files
+        """
+        seen: Set[str] = set()
+        pending: Dict['Future', Tuple[str, str]] = {}
+
+        def _submit(code: str, code_folder: str) -> None:
+            """
+            Submit the loading of the files included by a code.
+
+            :param code: Code
+            :param code_folder: Folder of the code
+            """
+            for m, name, sub_folder in self._includes(code, code_folder):
+                path = self.find(name, sub_folder)
+                if path is None or path in seen:
+                    continue
+                seen.add(path)
+                if m.group(1) == 'subfile':
+                    sub_folder = os.path.dirname(self._rel(path))
+                pending[executor.submit(self.load, path)] = (path, sub_folder)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            _submit(s, folder)
+            while len(pending) > 0:
+                done, _ = wait(list(pending.keys()), return_when=FIRST_COMPLETED)
+                for f in done:
+                    path, sub_folder = pending.pop(f)
+                    if f.exception() is None:
+                        _submit(f.result(), sub_folder)
+        return len(seen)
+
+    def _resolve(self, s: str, folder: str, stack: List[str]) -> str:
+        """
+        Resolve the includes of a code.
+
+        :param s: Latex code without comments
+        :param folder: Folder of the relative includes, relative to the project root
+        :param stack: Files being resolved, the last one includes the code
+        :return: Code with the included files
+        """
+        if len(stack) == 1 and self.workers > 1:
+            self.prefetch(s, folder)
+        parent = stack[-1]
+        edges = self._graph.setdefault(parent, [])
+        new_s = []
+        k = 0
+        for m, name, sub_folder in self._includes(s, folder):
+            cmd = m.group(1)
+            path = self.find(name, sub_folder)
+            if path is None:
+                self._errors.append(('not found', name))
+                continue
+            rel = self._rel(path)
+            edges.append(rel)
+            if rel in stack:
+                self._errors.append(('cyclic include', rel))
+                continue
+            tx = self.load(path)
+            if cmd == 'subfile':
+                doc = _RE_DOCUMENT.search(tx)
+                if doc is not None:
+                    tx = doc.group(1)
+                sub_folder = os.path.dirname(rel)
+            tx = self._resolve(tx, sub_folder, stack + [rel])
+            new_s.append(s[k:m.start()])
+            new_s.append(tx)
+            k = m.end()
+        new_s.append(s[k:])
+        return ''.join(new_s)
+
+    def resolve(self, s: str, folder: str = '') -> str:
+        """
+        Replace the included files of a code by their contents, recursively.
+
+        :param s: Latex code
+        :param folder: Folder of the code, relative to the project root
+        :return: Code without comments, with the included files
+        """
+        self._errors.clear()
+        self._graph.clear()
+        return self._resolve(par.remove_comments(s), folder, [self.main])
+
+    def resolve_file(self, path: str) -> str:
+        """
+        Load a file of the project and replace its included files, recursively.
+
+        :param path: File path, relative to the project root or absolute
+        :return: Code without comments, with the included files
+        """
+        path = os.path.join(self.root, path)
+        rel = self._rel(path)
+        self._errors.clear()
+        self._graph.clear()
+        return self._resolve(self.load(path), '', [rel])
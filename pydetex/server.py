@@ -0,0 +1,628 @@
+"""
+PyDetex
+https://github.com/ppizarror/PyDetex
+
+SERVER
+Local JSON service, which applies the pipelines within a pool of warm worker
+processes.
+"""
+
+__all__ = ['DetexServer']
+
+import collections
+import concurrent.futures
+import http.server
+import json
+import multiprocessing
+import os
+import queue
+import socketserver
+import threading
+import time
+
+import pydetex.pipelines as pip
+from pydetex.project import ProjectResolver
+from pydetex.utils import LatencyCounter
+from typing import Any, Deque, Dict, List, Optional, Tuple, Union
+
+# Pipelines available from the service
+_PIPELINES: Dict[str, 'pip.PipelineType'] = {
+    'fast': pip.fast,
+    'simple': pip.simple,
+    'strict': pip.strict,
+    'strict_eqn': pip.strict_eqn
+}
+
+# Pipeline options accepted within the requests
+_OPTIONS = ('compress_cite', 'eqn_simple', 'remove_common_tags', 'replace_defs', 'replace_pydetex_tags',
+            'replace_single_chars_eqn')
+
+# Latencies kept to compute the percentiles
+_LATENCY_WINDOW = 1000
+
+# Extra seconds waited for a worker after the timeout, before killing it and failing the document
+_TIMEOUT_GRACE = 1
+
+# Code processed by each worker on start, loading the tables and regexes
+_WARM_UP_CODE = '\\section{A} \\textbf{b} $x^2$ \\cite{c} \\ref{d} \\begin{itemize}\\item e\\end{itemize}'
+
+# Resolver of the included files within the worker process
+_WORKER_RESOLVER: Optional[Union['ProjectResolver', '_NoIncludes']] = None
+
+
+class _NoIncludes(object):
+    """
+    Resolver which keeps the included files as-is, thus, the service does not
+    read the files of the server.
+    """
+
+    @staticmethod
+    def resolve(s: str, folder: str = '') -> str:
+        """
+        Return the code as-is.
+
+        :param s: Latex code
+        :param folder: Folder of the code
+        :return: Latex code
+        """
+        return s
+
+
+def _init_worker(root: str) -> None:
+    """
+    Initialize a worker process.
+
+    :param root: Root folder of the included files, if empty these are not resolved
+    """
+    global _WORKER_RESOLVER
+    _WORKER_RESOLVER = ProjectResolver(root) if root != '' else _NoIncludes()
+    for pipeline in _PIPELINES.values():
+        pipeline(_WARM_UP_CODE, resolver=_WORKER_RESOLVER)
+
+
+def _process(s: str, pipeline: str, lang: str, options: Dict[str, Any], timeout: float) -> str:
+    """
+    Apply a pipeline within a worker process.
+
+    :param s: Latex code
+    :param pipeline: Pipeline name
+    :param lang: Language tag of the code
+    :param options: Pipeline options
+    :param timeout: Max seconds to process the code
+    :return: Pipeline output
+    """
+    return _PIPELINES[pipeline](s, lang, resolver=_WORKER_RESOLVER, time_budget=timeout, **options)
+
+
+def _worker_loop(conn: 'multiprocessing.connection.Connection', root: str) -> None:
+    """
+    Main loop of a worker process, which processes the documents received from
+    the server, one at a time, until it receives ``None``.
+
+    :param conn: Connection to the server
+    :param root: Root folder of the included files, if empty these are not resolved
+    """
+    _init_worker(root)
+    conn.send(os.getpid())  # Ready
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:  # The server exited
+            return
+        if job is None:
+            return
+        try:
+            out = (True, _process(*job))
+        except Exception as e:
+            out = (False, e)
+        try:
+            conn.send(out)
+        except Exception:  # The exception cannot be pickled
+            conn.send((False, RuntimeError(f'{type(out[1]).__name__}: {out[1]}')))
+
+
+class _Worker(object):
+    """
+    Worker process, which applies the pipelines to one document at a time. If a
+    document is not done within its timeout, for example, if a parser does not
+    check the time budget, the process is killed and started again.
+    """
+
+    _conn: 'multiprocessing.connection.Connection'
+    _process: 'multiprocessing.process.BaseProcess'
+    restarts: int
+    root: str
+
+    def __init__(self, root: str) -> None:
+        """
+        Constructor. The process is started, see ``wait``.
+
+        :param root: Root folder of the included files, if empty these are not resolved
+        """
+        self.restarts = 0
+        self.root = root
+        self.start()
+
+    def start(self) -> None:
+        """
+        Start the process, without waiting until it is ready.
+        """
+        # Spawned, as forking a process with threads is not safe
+        ctx = multiprocessing.get_context('spawn')
+        self._conn, conn = ctx.Pipe()
+        self._process = ctx.Process(target=_worker_loop, args=(conn, self.root), daemon=True)
+        self._process.start()
+        conn.close()
+
+    def wait(self) -> int:
+        """
+        Wait until the process is ready.
+
+        :return: Process id
+        """
+        return self._conn.recv()
+
+    def kill(self) -> None:
+        """
+        Kill the process.
+        """
+        self._process.kill()
+        self._process.join()
+        self._conn.close()
+
+    def restart(self) -> None:
+        """
+        Kill the process and start it again, waiting until it is ready.
+        """
+        self.kill()
+        self.start()
+        self.wait()
+        self.restarts += 1
+
+    def run(self, job: Tuple[str, str, str, Dict[str, Any], float], timeout: float) -> str:
+        """
+        Process a document. If the process does not answer within the timeout, or
+        exits, it is started again.
+
+        :param job: Code, pipeline, language, options and time budget of the document
+        :param timeout: Max seconds to wait for the process
+        :return: Pipeline output
+        """
+        try:
+            self._conn.send(job)
+            done = self._conn.poll(timeout)
+            out = self._conn.recv() if done else None
+        except (EOFError, OSError):
+            self.restart()
+            raise RuntimeError('the worker process exited')
+        if not done:
+            self.restart()
+            raise TimeoutError('time budget exceeded')
+        ok, value = out
+        if not ok:
+            raise value
+        return value
+
+    def close(self) -> None:
+        """
+        Stop the process, killing it if it does not exit.
+        """
+        try:
+            self._conn.send(None)
+        except OSError:
+            pass
+        self._process.join(_TIMEOUT_GRACE)
+        if self._process.is_alive():
+            self.kill()
+        else:
+            self._conn.close()
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    """
+    Handles the requests of the service.
+    """
+
+    server: Union['_ThreadingHTTPServer', '_ThreadingUnixHTTPServer']
+    protocol_version = 'HTTP/1.1'
+
+    def address_string(self) -> str:
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+    def log_message(self, format_: str, *args) -> None:
+        if self.server.service.verbose:
+            super().log_message(format_, *args)
+
+    def _send(self, status: int, data: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+        """
+        Send a JSON response.
+
+        :param status: HTTP status code
+        :param data: Response data
+        :param headers: Extra headers
+        """
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        service = self.server.service
+        if self.path == '/health':
+            self._send(200, {'status': 'ok'})
+        elif self.path == '/stats':
+            self._send(200, service.stats())
+        else:
+            self._send(404, {'error': f'not found {self.path}'})
+
+    def do_POST(self) -> None:
+        service = self.server.service
+        if self.path != '/detex':
+            return self._send(404, {'error': f'not found {self.path}'})
+        size = int(self.headers.get('Content-Length', 0))
+        if size > service.max_body:
+            self.close_connection = True  # The body is not read
+            return self._send(413, {'error': f'the body exceeds {service.max_body} bytes'})
+        try:
+            request = json.loads(self.rfile.read(size).decode('utf-8'))
+            if not isinstance(request, dict):
+                raise ValueError('the request must be an object')
+            batch = 'documents' in request
+            docs = request['documents'] if batch else [request]
+            if not isinstance(docs, list):
+                raise ValueError('documents must be a list')
+            common = {k: v for k, v in request.items() if k != 'documents'}
+            jobs = [service._check(dict(common, **d) if batch and isinstance(d, dict) else d) for d in docs]
+        except ValueError as e:
+            return self._send(400, {'error': str(e)})
+        if len(jobs) > service.max_pending:
+            return self._send(413, {'error': f'the batch exceeds {service.max_pending} documents'})
+        if not service._acquire(len(jobs)):
+            return self._send(503, {'error': 'too many pending documents'}, {'Retry-After': '1'})
+        results = service._run(jobs)
+        if batch:
+            return self._send(200, {'results': [{k: v for k, v in r.items() if k != 'status'} for r in results]})
+        self._send(results[0].pop('status', 200), results[0])
+
+
+class _ThreadingHTTPServer(http.server.ThreadingHTTPServer):
+    """
+    HTTP server of the service.
+    """
+
+    daemon_threads = True
+    service: 'DetexServer'
+
+
+class _ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    HTTP server of the service, listening on a Unix socket.
+    """
+
+    daemon_threads = True
+    service: 'DetexServer'
+
+
+class DetexServer(object):
+    """
+    Local JSON service which applies the pipelines. The code is processed within
+    a pool of worker processes, started on ``start`` with the pipelines imported
+    and their tables loaded, thus, the requests do not pay the startup cost. A
+    worker which does not finish a document within its timeout is killed and
+    started again, thus, it is not lost.
+
+    Endpoints:
+
+    - ``POST /detex``: Apply a pipeline to a document, ``{"text": ..., "pipeline":
+      "strict", "lang": "en", "timeout": 10}``, returning ``{"text": ...}``. A batch,
+      ``{"documents": [{"text": ...}, ...]}``, returns ``{"results": [...]}``, each
+      one with the ``text`` or the ``error``; the options outside the documents are
+      shared by all of them
+    - ``GET /stats``: Queue depth, counters (including the restarted workers) and
+      latency of the requests
+    - ``GET /health``: Service status
+
+    Each document is processed within a time budget, the ``timeout`` of the request
+    limited by the one of the server. If more than ``max_pending`` documents are
+    waiting or running, the requests are rejected with status 503 (backpressure).
+    The included files are not resolved unless a ``root`` folder is given.
+    """
+
+    _httpd: Optional[Union['_ThreadingHTTPServer', '_ThreadingUnixHTTPServer']]
+    _latencies: Deque[float]
+    _latency: 'LatencyCounter'
+    _lock: 'threading.Lock'
+    _dispatchers: List['threading.Thread']
+    _pending: int
+    _queue: 'queue.Queue'
+    _stats: Dict[str, int]
+    _thread: Optional['threading.Thread']
+    _workers: List['_Worker']
+    host: str
+    max_body: int
+    max_pending: int
+    port: int
+    root: str
+    socket_path: str
+    timeout: float
+    verbose: bool
+    workers: int
+
+    def __init__(
+            self,
+            host: str = '127.0.0.1',
+            port: int = 8000,
+            socket_path: str = '',
+            workers: int = 0,
+            max_pending: int = 64,
+            timeout: float = 30,
+            root: str = '',
+            max_body: int = 64 * 1024 * 1024,
+            verbose: bool = False
+    ) -> None:
+        """
+        Constructor.
+
+        :param host: Host
+        :param port: Port, if 0 use any free port
+        :param socket_path: Unix socket path, if given, listen on it instead of the host and port
+        :param workers: Worker processes, if 0 use the CPU count
+        :param max_pending: Max documents waiting or running at once
+        :param timeout: Max seconds to process each document
+        :param root: Root folder of the included files, if empty these are not resolved
+        :param max_body: Max bytes of a request body
+        :param verbose: Log the requests to stderr
+        """
+        assert isinstance(workers, int) and workers >= 0
+        assert isinstance(max_pending, int) and max_pending >= 1
+        assert timeout > 0
+        self._dispatchers = []
+        self._httpd = None
+        self._latencies = collections.deque(maxlen=_LATENCY_WINDOW)
+        self._latency = LatencyCounter()
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._queue = queue.Queue()
+        self._stats = {'requests': 0, 'documents': 0, 'rejected': 0, 'timeouts': 0, 'errors': 0}
+        self._thread = None
+        self._workers = []
+        self.host = host
+        self.max_body = max_body
+        self.max_pending = max_pending
+        self.port = port
+        self.root = root
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.verbose = verbose
+        self.workers = workers or os.cpu_count() or 1
+
+    def __enter__(self) -> 'DetexServer':
+        self.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.shutdown()
+
+    @property
+    def address(self) -> Union[Tuple[str, int], str]:
+        """
+        Return the address the server listens on.
+
+        :return: Host and port, or the Unix socket path
+        """
+        if self.socket_path != '':
+            return self.socket_path
+        return self.host, self.port
+
+    def start(self) -> None:
+        """
+        Start the worker processes and the server, which serves the requests
+        within a background thread.
+        """
+        assert self._httpd is None, 'server already started'
+        self._workers = [_Worker(self.root) for _ in range(self.workers)]
+        for w in self._workers:
+            w.wait()
+        self._dispatchers = [threading.Thread(target=self._dispatch, args=(w,), daemon=True) for w in self._workers]
+        for th in self._dispatchers:
+            th.start()
+        if self.socket_path != '':
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            self._httpd = _ThreadingUnixHTTPServer(self.socket_path, _Handler)
+        else:
+            self._httpd = _ThreadingHTTPServer((self.host, self.port), _Handler)
+            self.port = self._httpd.server_address[1]
+        self._httpd.service = self
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+
+    def serve_forever(self) -> None:
+        """
+        Start the server, if not started, and wait until it is shut down.
+        """
+        if self._httpd is None:
+            self.start()
+        while self._thread.is_alive():
+            self._thread.join(1)
+
+    def shutdown(self) -> None:
+        """
+        Stop the server and the worker processes.
+        """
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+            if self.socket_path != '' and os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+        for _ in self._dispatchers:  # The queued documents are processed first
+            self._queue.put(None)
+        for th in self._dispatchers:
+            th.join()
+        for w in self._workers:
+            w.close()
+        self._dispatchers = []
+        self._workers = []
+
+    def _dispatch(self, worker: '_Worker') -> None:
+        """
+        Send the queued documents to a worker, until the server is shut down.
+
+        :param worker: Worker
+        """
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            future, job = item
+            if not future.set_running_or_notify_cancel():  # Cancelled
+                continue
+            try:
+                future.set_result(worker.run(job, job[4] + _TIMEOUT_GRACE))
+            except Exception as e:
+                future.set_exception(e)
+
+    def _count(self, name: str, n: int = 1) -> None:
+        """
+        Increase a counter.
+
+        :param name: Counter name
+        :param n: Increment
+        """
+        with self._lock:
+            self._stats[name] += n
+
+    def _check(self, doc: Any) -> Tuple[str, str, str, Dict[str, Any], float]:
+        """
+        Check a document of a request, raising ``ValueError`` if not valid.
+
+        :param doc: Document
+        :return: Code, pipeline, language, options, timeout
+        """
+        if not isinstance(doc, dict) or not isinstance(doc.get('text'), str):
+            raise ValueError('each document must be an object with a text')
+        pipeline = doc.get('pipeline', 'strict')
+        if pipeline not in _PIPELINES:
+            raise ValueError(f'invalid pipeline {pipeline}, use one of {", ".join(_PIPELINES.keys())}')
+        lang = doc.get('lang', 'en')
+        if not isinstance(lang, str):
+            raise ValueError('lang must be a string')
+        options = {k: v for k, v in doc.items() if k in _OPTIONS}
+        for k, v in options.items():
+            if not isinstance(v, bool):
+                raise ValueError(f'{k} must be a boolean')
+        timeout = doc.get('timeout', self.timeout)
+        if not isinstance(timeout, (int, float)) or isinstance(timeout, bool) or timeout <= 0:
+            raise ValueError('timeout must be a positive number')
+        return doc['text'], pipeline, lang, options, min(timeout, self.timeout)
+
+    def _acquire(self, n: int) -> bool:
+        """
+        Reserve the pending slots of the documents of a request.
+
+        :param n: Number of documents
+        :return: False if there are not enough free slots, thus, the request is rejected
+        """
+        with self._lock:
+            if self._pending + n > self.max_pending:
+                self._stats['rejected'] += 1
+                return False
+            self._pending += n
+            self._stats['requests'] += 1
+            self._stats['documents'] += n
+        return True
+
+    def _release(self, future: 'concurrent.futures.Future') -> None:
+        """
+        Release the pending slot of a document, once its future is done.
+
+        :param future: Future of the document
+        """
+        with self._lock:
+            self._pending -= 1
+
+    def _result(self, future: 'concurrent.futures.Future') -> Dict[str, Any]:
+        """
+        Return the result of a document.
+
+        :param future: Future of the document, done
+        :return: Result, with the ``text``, or the ``error`` and its ``status``
+        """
+        try:
+            return {'text': future.result()}
+        except TimeoutError:
+            self._count('timeouts')
+            return {'error': 'time budget exceeded', 'status': 504}
+        except Exception as e:
+            self._count('errors')
+            return {'error': f'{type(e).__name__}: {e}', 'status': 500}
+
+    def _run(self, jobs: List[Tuple[str, str, str, Dict[str, Any], float]]) -> List[Dict[str, Any]]:
+        """
+        Process the documents of a request within the workers. The pending slot of
+        each document is released once it is done, thus, the documents still
+        running after their request failed keep counting.
+
+        Each document is processed within its timeout, measured by the worker from
+        its start, thus, the documents are not failed for waiting in the queue. A
+        document running longer than its timeout (and a grace) is failed, and its
+        worker killed and started again.
+
+        :param jobs: Checked documents
+        :return: Results, each one with the ``text``, or the ``error`` and its ``status``
+        """
+        if len(jobs) == 0:
+            return []
+        t0 = time.perf_counter()
+        futures: List['concurrent.futures.Future'] = []
+        try:
+            for job in jobs:
+                futures.append(concurrent.futures.Future())
+                futures[-1].add_done_callback(self._release)
+                self._queue.put((futures[-1], job))
+            concurrent.futures.wait(futures)
+        finally:
+            for f in futures:  # The documents still queued, if the request failed
+                f.cancel()
+            dt = time.perf_counter() - t0
+            with self._lock:
+                self._pending -= len(jobs) - len(futures)  # Not submitted
+                self._latency.add('request', dt)
+                self._latencies.append(dt)
+        return [self._result(f) for f in futures]
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return the stats of the service.
+
+        :return: Workers, pending documents, queue depth (documents waiting for a worker), restarted workers, counters, and request latency in seconds
+        """
+        with self._lock:
+            latencies = sorted(self._latencies)
+            _, mean, max_ = self._latency.stats('request')
+            stats: Dict[str, Any] = {
+                'workers': self.workers,
+                'pending': self._pending,
+                'queue_depth': max(0, self._pending - self.workers),
+                'max_pending': self.max_pending,
+                'restarts': sum(w.restarts for w in self._workers)
+            }
+            stats.update(self._stats)
+
+        def _percentile(p: float) -> float:
+            """
+            Return a percentile of the latencies.
+
+            :param p: Percentile between 0 and 1
+            :return: Latency
+            """
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))] if latencies else 0
+
+        stats['latency'] = {'mean': mean, 'max': max_, 'p50': _percentile(0.5), 'p95': _percentile(0.95),
+                            'p99': _percentile(0.99)}
+        return stats
@@ -0,0 +1,361 @@
+"""
+PyDetex
+https://github.com/ppizarror/PyDetex
+
+SOURCEMAP
+Maps the positions of the output of the pipelines to the latex source.
+"""
+
+__all__ = [
+    'detex',
+    'SourceMap',
+    'SourceMapper'
+]
+
+import array
+import bisect
+import collections
+import difflib
+import re
+import threading
+
+import pydetex.pipelines as pip
+from pydetex.profiling import Collector, Profiler, StageEvent
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+# noinspection PyProtectedMember
+from pydetex.utils import _anchors
+
+# Pieces compared on each level of the alignment, from lines to single chars
+_RE_LINES = re.compile(r'[^\n]*\n|[^\n]+')
+_RE_TOKENS = re.compile(r'\w+|\s+|[^\w\s]+')
+_SPLITTERS = (_RE_LINES.findall, _RE_TOKENS.findall, list)
+
+# Max product of the pieces compared with difflib, if greater, the lists are
+# aligned on their unique pieces, which bounds the time
+_MAX_EXACT = 1 << 16
+
+# Max product of the chars of two blocks aligned char by char
+_MAX_CHARS = 1 << 16
+
+
+def _prefix(a: str, b: str) -> int:
+    """
+    Return the length of the common prefix of two strings.
+
+    :param a: String
+    :param b: String
+    :return: Length
+    """
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[lo:mid] == b[lo:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def _suffix(a: str, b: str) -> int:
+    """
+    Return the length of the common suffix of two strings.
+
+    :param a: String
+    :param b: String
+    :return: Length
+    """
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[len(a) - mid:len(a) - lo] == b[len(b) - mid:len(b) - lo]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def _matches(pa: List[str], pb: List[str], i0: int, j0: int, blocks: List[Tuple[int, int, int]]) -> None:
+    """
+    Add the (i, j, length) blocks of equal pieces of two lists, in order. The
+    blank pieces do not anchor the matches, as these would split the changed
+    paragraphs.
+
+    Small lists are compared with ``difflib``; within large ones, the pieces
+    unique in both are used as anchors (patience diff), and the gaps between
+    these are compared again, thus, the time is near linear.
+
+    :param pa: Input pieces
+    :param pb: Output pieces
+    :param i0: Offset of the input pieces
+    :param j0: Offset of the output pieces
+    :param blocks: Blocks
+    """
+    # Equal pieces at the start and end
+    n = 0
+    while n < len(pa) and n < len(pb) and pa[n] == pb[n]:
+        n += 1
+    if n > 0:
+        blocks.append((i0, j0, n))
+        pa, pb, i0, j0 = pa[n:], pb[n:], i0 + n, j0 + n
+    m = 0
+    while m < len(pa) and m < len(pb) and pa[len(pa) - m - 1] == pb[len(pb) - m - 1]:
+        m += 1
+    if m > 0:
+        _matches(pa[:len(pa) - m], pb[:len(pb) - m], i0, j0, blocks)
+        blocks.append((i0 + len(pa) - m, j0 + len(pb) - m, m))
+        return
+    if len(pa) == 0 or len(pb) == 0:
+        return
+    if len(pa) * len(pb) <= _MAX_EXACT:
+        sm = difflib.SequenceMatcher(str.isspace, pa, pb, autojunk=False)
+        for i, j, n in sm.get_matching_blocks():
+            if n > 0:
+                blocks.append((i0 + i, j0 + j, n))
+        return
+    count_a, count_b = collections.Counter(pa), collections.Counter(pb)
+    unique_b = {x: j for j, x in enumerate(pb) if count_b[x] == 1 and not x.isspace()}
+    anchors = _anchors([(i, unique_b[x]) for i, x in enumerate(pa) if count_a[x] == 1 and x in unique_b])
+    if len(anchors) == 0:  # Not aligned on this level
+        return
+    pi, pj = 0, 0
+    for i, j in anchors:
+        _matches(pa[pi:i], pb[pj:j], i0 + pi, j0 + pj, blocks)
+        blocks.append((i0 + i, j0 + j, 1))
+        pi, pj = i + 1, j + 1
+    _matches(pa[pi:], pb[pj:], i0 + pi, j0 + pj, blocks)
+
+
+def _align(a: str, b: str, a0: int, b0: int, level: int, runs: List[Tuple[int, int, int]]) -> None:
+    """
+    Align two strings, adding the (b start, a start, length) runs of their
+    common text, in order. The strings are compared by lines, then the changed
+    blocks by tokens, and the small changed blocks by chars.
+
+    :param a: Input string
+    :param b: Output string
+    :param a0: Offset of the input string
+    :param b0: Offset of the output string
+    :param level: Level of the pieces compared
+    :param runs: Runs
+    """
+    p = _prefix(a, b)
+    if p > 0:
+        runs.append((b0, a0, p))
+    q = _suffix(a[p:], b[p:])
+    mid_a, mid_b = a[p:len(a) - q], b[p:len(b) - q]
+    if mid_a != '' and mid_b != '' and level < len(_SPLITTERS) and \
+            (level < len(_SPLITTERS) - 1 or len(mid_a) * len(mid_b) <= _MAX_CHARS):
+        pa, pb = _SPLITTERS[level](mid_a), _SPLITTERS[level](mid_b)
+        oa, ob = [0], [0]  # Offset of each piece
+        for x in pa:
+            oa.append(oa[-1] + len(x))
+        for x in pb:
+            ob.append(ob[-1] + len(x))
+        blocks: List[Tuple[int, int, int]] = []
+        _matches(pa, pb, 0, 0, blocks)
+        pi, pj = 0, 0
+        for i, j, n in blocks + [(len(pa), len(pb), 0)]:
+            if i > pi and j > pj:  # Changed block
+                _align(mid_a[oa[pi]:oa[i]], mid_b[ob[pj]:ob[j]], a0 + p + oa[pi], b0 + p + ob[pj], level + 1, runs)
+            if n > 0:
+                runs.append((b0 + p + ob[j], a0 + p + oa[i], ob[j + n] - ob[j]))
+            pi, pj = i + n, j + n
+    if q > 0:
+        runs.append((b0 + len(b) - q, a0 + len(a) - q, q))
+
+
+class SourceMap(object):
+    """
+    Map from the positions of an output to the positions of its source. It is
+    stored as run-length ``(out_start, in_start, length)`` triples, sorted, where
+    each run is a text copied from the source to the output; thus, a lookup is a
+    binary search.
+
+    The positions within the text not copied from the source (like the number of
+    a cite) are mapped to the end of the previous run.
+    """
+
+    _in_start: 'array.array'
+    _length: 'array.array'
+    _line_starts: Optional['array.array']
+    _out_start: 'array.array'
+    output_size: int
+    source: str
+
+    def __init__(self, runs: Iterable[Tuple[int, int, int]], source: str = '', output_size: int = 0) -> None:
+        """
+        Constructor.
+
+        :param runs: Sorted ``(out_start, in_start, length)`` runs
+        :param source: Source string
+        :param output_size: Chars of the output
+        """
+        self._in_start = array.array('q')
+        self._length = array.array('q')
+        self._line_starts = None
+        self._out_start = array.array('q')
+        for o, i, n in runs:
+            if n <= 0:
+                continue
+            # Merge the contiguous runs
+            if len(self._length) > 0 and self._out_start[-1] + self._length[-1] == o and \
+                    self._in_start[-1] + self._length[-1] == i:
+                self._length[-1] += n
+                continue
+            self._out_start.append(o)
+            self._in_start.append(i)
+            self._length.append(n)
+        self.output_size = output_size
+        self.source = source
+
+    def __len__(self) -> int:
+        return len(self._length)
+
+    def __iter__(self) -> Iterator[Tuple[int, int, int]]:
+        return zip(self._out_start, self._in_start, self._length)
+
+    @staticmethod
+    def identity(s: str) -> 'SourceMap':
+        """
+        Return the map of a string not changed.
+
+        :param s: String
+        :return: Map
+        """
+        return SourceMap([(0, 0, len(s))], s, len(s))
+
+    @staticmethod
+    def from_diff(source: str, output: str) -> 'SourceMap':
+        """
+        Return the map of an output to its source, from their differences.
+
+        :param source: Source string
+        :param output: Output string
+        :return: Map
+        """
+        if source is output or source == output:
+            return SourceMap.identity(source)
+        runs: List[Tuple[int, int, int]] = []
+        _align(source, output, 0, 0, 0, runs)
+        return SourceMap(runs, source, len(output))
+
+    def then(self, other: 'SourceMap') -> 'SourceMap':
+        """
+        Compose with the map of a later stage, which source is this output.
+
+        :param other: Map of the later stage
+        :return: Map from the output of the later stage to this source
+        """
+        runs: List[Tuple[int, int, int]] = []
+        n = len(self._length)
+        k = 0
+        for o2, i1, length in other:
+            while k < n and self._out_start[k] + self._length[k] <= i1:
+                k += 1
+            j = k
+            while j < n and self._out_start[j] < i1 + length:
+                lo = max(i1, self._out_start[j])
+                hi = min(i1 + length, self._out_start[j] + self._length[j])
+                if hi > lo:
+                    runs.append((o2 + lo - i1, self._in_start[j] + lo - self._out_start[j], hi - lo))
+                j += 1
+        return SourceMap(runs, self.source, other.output_size)
+
+    def to_source(self, pos: int) -> int:
+        """
+        Return the source position of an output position.
+
+        :param pos: Output position
+        :return: Source position
+        """
+        k = bisect.bisect_right(self._out_start, pos) - 1
+        if k < 0:
+            return 0
+        return self._in_start[k] + min(pos - self._out_start[k], self._length[k])
+
+    def to_source_range(self, start: int, end: int) -> Tuple[int, int]:
+        """
+        Return the source range of an output range.
+
+        :param start: Output start position
+        :param end: Output end position (exclusive)
+        :return: Source range
+        """
+        a = self.to_source(start)
+        if end <= start:
+            return a, a
+        return a, max(a, self.to_source(end - 1) + 1)
+
+    def position(self, pos: int) -> Tuple[int, int]:
+        """
+        Return the source line and column (from 0) of an output position.
+
+        :param pos: Output position
+        :return: Line, column
+        """
+        if self._line_starts is None:
+            self._line_starts = array.array('q', [0] + [m.end() for m in re.finditer('\n', self.source)])
+        i = self.to_source(pos)
+        line = bisect.bisect_right(self._line_starts, i) - 1
+        return line, i - self._line_starts[line]
+
+
+class SourceMapper(Collector):
+    """
+    Profiler collector, which composes the map of each pipeline run stage by
+    stage, from the differences of the input and output of each stage. The
+    changes made by the pipeline between its stages are also mapped, thus, the
+    map is complete even if the result is read from a cache.
+    """
+
+    _local: 'threading.local'
+    source_map: Optional['SourceMap']
+
+    def __init__(self) -> None:
+        """
+        Constructor.
+        """
+        self._local = threading.local()
+        self.source_map = None
+
+    def on_start(self, event: 'StageEvent') -> None:
+        if event.kind == 'pipeline':
+            self._local.map = None
+
+    def on_result(self, event: 'StageEvent', s: str, out: str) -> None:
+        m: Optional['SourceMap'] = getattr(self._local, 'map', None)
+        if event.kind == 'stage' and event.pipeline == '':  # Stage called alone
+            self.source_map = SourceMap.from_diff(s, out)
+        elif event.kind == 'stage':
+            if m is None:
+                m = SourceMap.identity(s)
+            elif s is not self._local.last:
+                m = m.then(SourceMap.from_diff(self._local.last, s))
+            self._local.map = m.then(SourceMap.from_diff(s, out))
+            self._local.last = out
+        else:
+            if m is None:
+                m = SourceMap.from_diff(s, out)
+            else:
+                if m.source is not s:
+                    m = SourceMap.from_diff(s, m.source).then(m)
+                if self._local.last is not out:
+                    m = m.then(SourceMap.from_diff(self._local.last, out))
+            self.source_map = m
+            self._local.map = None
+
+
+def detex(s: str, pipeline: Optional['pip.PipelineType'] = None, lang: str = 'en', **kwargs) -> Tuple[str, 'SourceMap']:
+    """
+    Apply a pipeline, and return the map of its output to the latex code.
+
+    :param s: Latex code
+    :param pipeline: Pipeline, if ``None`` use ``strict``
+    :param lang: Language tag of the code
+    :param kwargs: Pipeline arguments
+    :return: Output, map
+    """
+    mapper = SourceMapper()
+    out = (pipeline or pip.strict)(s, lang, profiler=Profiler(mapper), **kwargs)
+    return out, mapper.source_map
@@ -0,0 +1,211 @@
+"""
+PyDetex
+https://github.com/ppizarror/PyDetex
+
+STATS
+Fast statistics of the latex code. These are computed with the tex scanners, as
+texcount does, without applying the pipelines.
+"""
+
+__all__ = [
+    'count',
+    'SectionStats',
+    'total'
+]
+
+import bisect
+import re
+
+from pydetex.utils import find_tex_command_char, find_tex_commands, TEX_EQUATION_CHARS
+from typing import Dict, List, Tuple, Union
+
+# Commands which start a section, with their level
+_SECTION_COMMANDS: Dict[str, int] = {
+    '\\part': 0,
+    '\\chapter': 1,
+    '\\section': 2,
+    '\\subsection': 3,
+    '\\subsubsection': 4,
+    '\\paragraph': 5,
+    '\\subparagraph': 6
+}
+
+# Commands whose arguments are not counted as text
+_IGNORED_ARGS_COMMANDS = (
+    '\\addbibresource', '\\autoref', '\\begin', '\\bibliography', '\\bibliographystyle',
+    '\\cref', '\\Cref', '\\def', '\\documentclass', '\\end', '\\eqref', '\\hspace',
+    '\\include', '\\includegraphics', '\\input', '\\label', '\\newcommand',
+    '\\newenvironment', '\\pageref', '\\ref', '\\renewcommand', '\\setlength',
+    '\\url', '\\usepackage', '\\vspace'
+)
+
+_RE_COMMAND = re.compile(r'\\[a-zA-Z@]+\*?')
+_RE_COMMAND_DEFINITION = re.compile(r'\\(?:(?:re)?newcommand\*?|def|let)\s*{?\s*$')
+_RE_COMMENT = re.compile(r'(?<!\\)%[^\n]*')
+_RE_INLINE_MATH = re.compile(r'(?<!\\)\$[^$]*\$')
+_RE_WORD = re.compile(r'\w+')
+
+
+class SectionStats(object):
+    """
+    Counts of a section of the document.
+    """
+
+    caption_words: int
+    captions: int
+    cites: int
+    header_words: int
+    level: int
+    math_display: int
+    math_inline: int
+    title: str
+    words: int
+
+    def __init__(self, title: str = '', level: int = -1) -> None:
+        """
+        Constructor.
+
+        :param title: Section title, empty if the text is before any section
+        :param level: Section level, -1 if the text is before any section
+        """
+        self.caption_words = 0
+        self.captions = 0
+        self.cites = 0
+        self.header_words = 0
+        self.level = level
+        self.math_display = 0
+        self.math_inline = 0
+        self.title = title
+        self.words = 0
+
+    def __repr__(self) -> str:
+        return f'SectionStats({self.title!r}, words={self.words})'
+
+    def as_dict(self) -> Dict[str, Union[str, int]]:
+        """
+        Return the stats as a dict.
+
+        :return: Stats dict
+        """
+        return {
+            'title': self.title,
+            'level': self.level,
+            'words': self.words,
+            'header_words': self.header_words,
+            'captions': self.captions,
+            'caption_words': self.caption_words,
+            'math_inline': self.math_inline,
+            'math_display': self.math_display,
+            'cites': self.cites
+        }
+
+
+def _count_words(s: str) -> int:
+    """
+    Count the words of a text, ignoring the command names and the inline math.
+
+    :param s: Latex string code
+    :return: Number of words
+    """
+    s = _RE_INLINE_MATH.sub(' ', s)
+    s = _RE_COMMAND.sub(' ', s)
+    return len(_RE_WORD.findall(s))
+
+
+def count(s: str) -> List['SectionStats']:
+    """
+    Count the words of the text, headers and captions, the math spans, and the
+    cites of each section of the document. Comments and the preamble are not
+    counted. The first element stores the counts before the first section.
+
+    Only a few linear scans of the code are done, thus, it is much faster than
+    applying a pipeline and counting the words of the output.
+
+    :param s: Latex string code
+    :return: Stats of each section
+    """
+    s = '\n'.join(s.splitlines())  # Removes \r\n
+    s = _RE_COMMENT.sub('', s)
+    i, j = s.find('\\begin{document}'), s.rfind('\\end{document}')
+    if -1 < i < j:
+        s = s[i + 16:j]
+
+    sections: List['SectionStats'] = [SectionStats()]
+    starts: List[int] = [-1]  # Start position of each section
+    excluded: List[Tuple[int, int]] = []  # Regions not counted as text
+
+    def _section(k: int) -> 'SectionStats':
+        """
+        Return the section that contains the position.
+
+        :param k: Position
+        :return: Section
+        """
+        return sections[bisect.bisect_right(starts, k) - 1]
+
+    # Find the commands. Each command can have several arguments, which are
+    # grouped as they are returned in order; the last one is the main argument
+    chain = []
+    for cmd in find_tex_commands(s):
+        chain.append(cmd)
+        if cmd[4]:  # Command continues
+            continue
+        a, b = chain[0][0], chain[0][1]
+        c, d = chain[-1][2], chain[-1][3]
+        name = s[a:b + 1].strip()
+        chain.clear()
+        if _RE_COMMAND_DEFINITION.search(s, max(0, a - 20), a):  # Redefined command
+            continue
+        elif name.rstrip('*') in _SECTION_COMMANDS:
+            sections.append(SectionStats(s[c:d + 1].strip(), _SECTION_COMMANDS[name.rstrip('*')]))
+            sections[-1].header_words = _count_words(s[c:d + 1])
+            starts.append(a)
+        elif name.rstrip('*') == '\\caption':
+            sec = _section(a)
+            sec.captions += 1
+            sec.caption_words += _count_words(s[c:d + 1])
+        elif 'cite' in name:
+            _section(a).cites += len([k for k in s[c:d + 1].split(',') if k.strip() != ''])
+        elif name not in _IGNORED_ARGS_COMMANDS:  # The arguments are text
+            continue
+        excluded.append((a, d + 2))
+
+    # Find the equations
+    for a, _, _, d in find_tex_command_char(s, TEX_EQUATION_CHARS):
+        sec = _section(a)
+        if s[a] == '$' and s[a + 1] != '$':
+            sec.math_inline += 1
+        elif s[a:a + 2] == '\\(':
+            sec.math_inline += 1
+        else:
+            sec.math_display += 1
+        excluded.append((a, d + 1))
+
+    # Count the text words, between the excluded regions
+    excluded.sort()
+    k = 0
+    for a, b in excluded + [(len(s), len(s))]:
+        if a > k:
+            _section(k).words += _count_words(s[k:a])
+        k = max(k, b)
+
+    return sections
+
+
+def total(sections: List['SectionStats']) -> 'SectionStats':
+    """
+    Sum the stats of several sections.
+
+    :param sections: Sections stats
+    :return: Total stats
+    """
+    t = SectionStats()
+    for sec in sections:
+        t.caption_words += sec.caption_words
+        t.captions += sec.captions
+        t.cites += sec.cites
+        t.header_words += sec.header_words
+        t.math_display += sec.math_display
+        t.math_inline += sec.math_inline
+        t.words += sec.words
+    return t
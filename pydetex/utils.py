@@ -13,7 +13,10 @@ __all__ = [
     'apply_tag_tex_commands_no_argv',
     'Button',
     'check_repeated_words',
+    'check_time_budget',
     'complete_langs_dict',
+    'CorpusIndex',
+    'diff_lines',
     'detect_language',
     'find_tex_command_char',
     'find_tex_commands',
@@ -24,35 +27,53 @@ __all__ = [
     'get_language_name',
     'get_local_path',
     'get_number_of_day',
+    'get_stem_cache_stats',
     'get_tex_commands_args',
     'get_word_from_cursor',
     'IS_OSX',
     'LangTexTextTags',
+    'LatencyCounter',
+    'load_stem_cache',
     'make_stemmer',
     'open_file',
     'ProgressBar',
     'RESOURCES_PATH',
+    'save_stem_cache',
+    'split_spans_lines',
     'split_tags',
+    'stem_word',
     'syntax_highlight',
+    'tags_to_spans',
     'TEX_COMMAND_CHARS',
     'TEX_EQUATION_CHARS',
     'tex_to_unicode',
+    'TexMmapScanner',
+    'TimeBudget',
     'tokenize',
     'validate_float',
     'validate_int'
 ]
 
+import bisect
+import collections
+import contextlib
 import datetime
+import difflib
 import os
 import platform
+import re
+import signal
 import sys
+import threading
 import time
 
 from pathlib import Path
-from typing import List, Tuple, Dict
+from typing import List, Tuple, Dict, Any, Iterator, Optional
 
-from pydetex._fonts import FONT_TAGS as _FONT_TAGS
+from pydetex._fonts import FONT_TAGS as _FONT_TAGS, TAGS_FONT as _TAGS_FONT
+from pydetex._utils_index import *
 from pydetex._utils_lang import *
+from pydetex._utils_mmap import *
 from pydetex._utils_tex import *
 
 # Resources path
@@ -68,6 +89,30 @@ if IS_OSX:
 else:
     from tkinter import Button
 
+# Compiled split regex for each tag list
+_SPLIT_TAGS_REGEX: Dict[Tuple[str, ...], 're.Pattern'] = {}
+
+# Innermost time budget of each thread
+_TIME_BUDGET = threading.local()
+
+# Max product of the lines compared with difflib by diff_lines, if greater, the
+# lines are aligned on their unique lines, which bounds the time
+_DIFF_MAX_EXACT = 1 << 14
+
+
+def _get_split_tags_regex(tags: List[str]) -> 're.Pattern':
+    """
+    Return the compiled regex that splits a string by the given tags.
+
+    :param tags: Tag list
+    :return: Compiled regex
+    """
+    key = tuple(tags)
+    if key not in _SPLIT_TAGS_REGEX.keys():
+        alt = sorted(set(tags), key=len, reverse=True)  # Longest tags first
+        _SPLIT_TAGS_REGEX[key] = re.compile('(' + '|'.join(re.escape(t) for t in alt) + ')')
+    return _SPLIT_TAGS_REGEX[key]
+
 
 def split_tags(s: str, tags: List[str]) -> List[Tuple[str, str]]:
     """
@@ -79,47 +124,211 @@ def split_tags(s: str, tags: List[str]) -> List[Tuple[str, str]]:
     Output:
     [('TAG1', 'newline'), ('TAG', 'this is), ('TAG1', 'very epic') ... ]
 
+    The string is scanned once using a compiled alternation of all the tags. The
+    text before the first tag is tagged with the first tag of the list.
+
     :param s: String
     :param tags: Tag list
     :return: Split tags
     """
     assert len(tags) > 0
-    tagged_lines: List[Tuple[str, str]] = []
-    r = 0
-    for tag in tags:
-        if r == 0:  # First occurence
-            new = s.split(tag)
-            for j in new:
-                if j == '':
-                    continue
-                tagged_lines.append((tag, j))
-        else:
-            new_tagged_lines: List[Tuple[str, str]] = []
-            for j in range(len(tagged_lines)):
-                if tag in tagged_lines[j][1]:  # If tag exists
-                    new = tagged_lines[j][1].split(tag)
-                    new_tagged_lines.append((tagged_lines[j][0], new[0]))
-                    for w in range(len(new) - 1):
-                        new_tagged_lines.append((tag, new[w + 1]))
-                else:
-                    new_tagged_lines.append(tagged_lines[j])
-            tagged_lines = new_tagged_lines
-
-        r += 1
-
-    # Merge consecutive tags
+    tag0 = tags[0]
+
+    # Split returns [lead, tag1, text1, tag2, text2, ...]
+    pieces = _get_split_tags_regex(tags).split(s)
+    total = len(pieces)
     merged_tags: List[Tuple[str, str]] = []
-    r = 0
-    for tagged in tagged_lines:
-        if len(merged_tags) == 0 or tagged[0] != merged_tags[r - 1][0]:
-            merged_tags.append(tagged)
-            r += 1
+
+    def _push(tag: str, text: str) -> None:
+        """
+        Append a run, merging consecutive tags.
+
+        :param tag: Tag
+        :param text: Text
+        """
+        if len(merged_tags) > 0 and merged_tags[-1][0] == tag:
+            merged_tags[-1] = (tag, merged_tags[-1][1] + text)
         else:
-            merged_tags[r - 1] = (tagged[0], merged_tags[r - 1][1] + tagged[1])
+            merged_tags.append((tag, text))
+
+    # Empty runs of the first tag are discarded only if the following tag is also
+    # the first one (or the string ends), other empty runs are kept
+    if pieces[0] != '' or (total > 1 and pieces[1] != tag0):
+        _push(tag0, pieces[0])
+    for i in range(1, total, 2):
+        tag, text = pieces[i], pieces[i + 1]
+        if text == '' and tag == tag0 and (i + 2 >= total or pieces[i + 2] == tag0):
+            continue
+        _push(tag, text)
 
     return merged_tags
 
 
+def tags_to_spans(s: str) -> Tuple[str, List[Tuple[int, int, str]]]:
+    """
+    Remove the font tags from a string, and return the plain text with the style
+    spans ``(start, end, style)``, where ``style`` is the font name (see
+    ``_fonts.FONT_PROPERTIES``). The text not covered by any span has the
+    normal style.
+
+    Example:
+
+    .. code-block:: none
+
+        Input: ⇱PYDETEX_FONT:BOLD⇲This⇱PYDETEX_FONT:NORMAL⇲ is epic
+        Output: ('This is epic', [(0, 4, 'bold')])
+
+    :param s: String with font tags
+    :return: Plain text, style spans
+    """
+    pieces = _get_split_tags_regex(list(_FONT_TAGS.values())).split(s)
+    text: List[str] = [pieces[0]]
+    spans: List[Tuple[int, int, str]] = []
+    pos = len(pieces[0])
+    for i in range(1, len(pieces), 2):
+        style, chunk = _TAGS_FONT[pieces[i]], pieces[i + 1]
+        if chunk == '':
+            continue
+        if style != 'normal':
+            if len(spans) > 0 and spans[-1][1] == pos and spans[-1][2] == style:
+                spans[-1] = (spans[-1][0], pos + len(chunk), style)  # Merge
+            else:
+                spans.append((pos, pos + len(chunk), style))
+        text.append(chunk)
+        pos += len(chunk)
+    return ''.join(text), spans
+
+
+def split_spans_lines(
+    text: str,
+    spans: List[Tuple[int, int, str]]
+) -> List[Tuple[str, Tuple[Tuple[int, int, str], ...]]]:
+    """
+    Split a styled text (see ``tags_to_spans``) by lines. Each line stores its
+    spans, with positions relative to the start of the line.
+
+    Example:
+
+    .. code-block:: none
+
+        Input: ('ab\\ncd', [(1, 4, 'bold')])
+        Output: [('ab', ((1, 2, 'bold'),)), ('cd', ((0, 1, 'bold'),))]
+
+    :param text: Plain text
+    :param spans: Style spans
+    :return: Lines list ``[(line, spans), ...]``
+    """
+    lines: List[Tuple[str, Tuple[Tuple[int, int, str], ...]]] = []
+    k = 0  # Moves through spans
+    pos = 0  # Start of the line
+    for line in text.split('\n'):
+        end = pos + len(line)
+        line_spans: List[Tuple[int, int, str]] = []
+        while k < len(spans) and spans[k][0] <= end:
+            a, b, style = spans[k]
+            if a < end and b > pos:
+                line_spans.append((max(a, pos) - pos, min(b, end) - pos, style))
+            if b > end + 1:  # Span continues on the next line
+                break
+            k += 1
+        lines.append((line, tuple(line_spans)))
+        pos = end + 1
+    return lines
+
+
+def diff_lines(old: List[Any], new: List[Any]) -> List[Tuple[int, int, int, int]]:
+    """
+    Compute the line-level difference between two lists of lines. Returns the
+    changed ranges ``(i1, i2, j1, j2)``, meaning that the lines ``old[i1:i2]``
+    must be replaced by ``new[j1:j2]``. Ranges are sorted.
+
+    The common first and last lines are skipped. Small blocks are compared with
+    ``difflib``; within large ones, the lines unique in both are used as anchors
+    (patience diff), and the gaps between these are compared again, thus, the
+    time is near linear. If most lines of a block changed, the whole block is
+    replaced.
+
+    :param old: Old lines
+    :param new: New lines
+    :return: Changed ranges
+    """
+    changed: List[Tuple[int, int, int, int]] = []
+    _diff_lines(old, new, 0, 0, changed)
+    return changed
+
+
+def _anchors(pairs: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """
+    Return the longest subsequence of (i, j) pairs, sorted by i, which j also
+    increases.
+
+    :param pairs: Pairs sorted by i
+    :return: Pairs
+    """
+    tails: List[int] = []  # Last j of each subsequence length
+    tails_k: List[int] = []  # Index of the pair of each tail
+    prev = [-1] * len(pairs)
+    for k, (_, j) in enumerate(pairs):
+        t = bisect.bisect_left(tails, j)
+        if t > 0:
+            prev[k] = tails_k[t - 1]
+        if t == len(tails):
+            tails.append(j)
+            tails_k.append(k)
+        else:
+            tails[t] = j
+            tails_k[t] = k
+    out = []
+    k = tails_k[-1] if len(tails_k) > 0 else -1
+    while k != -1:
+        out.append(pairs[k])
+        k = prev[k]
+    return out[::-1]
+
+
+def _diff_lines(old: List[Any], new: List[Any], i0: int, j0: int, changed: List[Tuple[int, int, int, int]]) -> None:
+    """
+    Add the changed ranges of two lists of lines, in order (see ``diff_lines``).
+
+    :param old: Old lines
+    :param new: New lines
+    :param i0: Offset of the old lines
+    :param j0: Offset of the new lines
+    :param changed: Changed ranges
+    """
+    n = 0
+    while n < len(old) and n < len(new) and old[n] == new[n]:
+        n += 1
+    m = 0
+    while m < len(old) - n and m < len(new) - n and old[len(old) - m - 1] == new[len(new) - m - 1]:
+        m += 1
+    old, new, i0, j0 = old[n:len(old) - m], new[n:len(new) - m], i0 + n, j0 + n
+    if len(old) == 0 and len(new) == 0:
+        return
+    if len(old) * len(new) <= _DIFF_MAX_EXACT:
+        matcher = difflib.SequenceMatcher(None, old, new, autojunk=False)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag != 'equal':
+                changed.append((i0 + i1, i0 + i2, j0 + j1, j0 + j2))
+        return
+    count_old, count_new = collections.Counter(old), collections.Counter(new)
+    unique_new = {x: j for j, x in enumerate(new) if count_new[x] == 1}
+    anchors = _anchors([(i, unique_new[x]) for i, x in enumerate(old) if count_old[x] == 1 and x in unique_new])
+    if len(anchors) == 0:  # Not aligned on this level
+        changed.append((i0, i0 + len(old), j0, j0 + len(new)))
+        return
+    block: List[Tuple[int, int, int, int]] = []
+    pi, pj = 0, 0
+    for i, j in anchors:
+        _diff_lines(old[pi:i], new[pj:j], i0 + pi, j0 + pj, block)
+        pi, pj = i + 1, j + 1
+    _diff_lines(old[pi:], new[pj:], i0 + pi, j0 + pj, block)
+    if 2 * sum(j2 - j1 for _, _, j1, j2 in block) > len(new):  # Most lines changed
+        changed.append((i0, i0 + len(old), j0, j0 + len(new)))
+    else:
+        changed.extend(block)
+
+
 def button_text(s: str) -> str:
     """
     Generates the button text.
@@ -320,7 +529,7 @@ class ProgressBar(object):
         self._print_progress_bar(self._current, self._steps, status)
         dt = time.time() - self._last_step
         self._last_step = time.time()
-        self._step_times[status] = dt
+        self._step_times[status] = self._step_times.get(status, 0) + dt  # Steps may share the status
         self._current += 1
         if self._current == self._steps + 1:
             print('')
@@ -343,3 +552,179 @@ class ProgressBar(object):
         self._t0 = time.time()
         self._last_step = time.time()
         self._step_times.clear()
+
+
+class LatencyCounter(object):
+    """
+    Counts events and measures their latency.
+    """
+
+    _events: Dict[str, List[float]]  # Event: [calls, total time, max time]
+
+    def __init__(self) -> None:
+        """
+        Constructor.
+        """
+        self._events = {}
+
+    def add(self, event: str, dt: float) -> None:
+        """
+        Add an event call.
+
+        :param event: Event name
+        :param dt: Event latency in seconds
+        """
+        if event not in self._events:
+            self._events[event] = [0, 0, 0]
+        e = self._events[event]
+        e[0] += 1
+        e[1] += dt
+        e[2] = max(e[2], dt)
+
+    @contextlib.contextmanager
+    def measure(self, event: str) -> Iterator[None]:
+        """
+        Measure the latency of the code within the context.
+
+        :param event: Event name
+        """
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(event, time.perf_counter() - t0)
+
+    def stats(self, event: str) -> Tuple[int, float, float]:
+        """
+        Return the event stats.
+
+        :param event: Event name
+        :return: Calls, mean and max latency in seconds
+        """
+        if event not in self._events:
+            return 0, 0, 0
+        calls, total, max_ = self._events[event]
+        return int(calls), total / calls, max_
+
+    def detail_times(self) -> None:
+        """
+        Print the latency of each event.
+        """
+        for k in sorted(self._events.keys()):
+            calls, mean, max_ = self.stats(k)
+            print(f'{calls}\t{1000 * mean:.3f}ms\t{1000 * max_:.3f}ms\t{k}')
+
+    def reset(self) -> None:
+        """
+        Reset the events.
+        """
+        self._events.clear()
+
+
+class TimeBudget(object):
+    """
+    Limits the time of the code within the context, raising ``TimeoutError`` if
+    exceeded. In the main thread, on the platforms with ``SIGALRM``, a timer
+    interrupts the code at any point; in other threads, the parsers check the
+    budget within their loops (see ``check_time_budget``). Budgets can be nested,
+    the earliest deadline is used.
+
+    A budget can also be cancelled from another thread, thus, the parsers running
+    within it are aborted at their next check.
+    """
+
+    _cancelled: bool
+    _prev: Optional['TimeBudget']
+    _prev_handler: Any
+    _prev_timer: Tuple[float, float]
+    _restored: bool
+    _t0: float
+    _timer: bool
+    deadline: float
+    seconds: float
+
+    def __init__(self, seconds: float = float('inf')) -> None:
+        """
+        Constructor.
+
+        :param seconds: Max seconds. If infinite, the budget is only exceeded if cancelled
+        """
+        assert seconds > 0
+        self.seconds = seconds
+        self.deadline = 0
+        self._cancelled = False
+        self._prev = None
+        self._prev_handler = None
+        self._prev_timer = (0, 0)
+        self._restored = False
+        self._t0 = 0
+        self._timer = False
+
+    def __enter__(self) -> 'TimeBudget':
+        self._restored = False
+        self._prev = getattr(_TIME_BUDGET, 'budget', None)
+        self._t0 = time.monotonic()
+        self.deadline = self._t0 + self.seconds
+        if self._prev is not None:
+            self.deadline = min(self.deadline, self._prev.deadline)
+        _TIME_BUDGET.budget = self
+        self._timer = hasattr(signal, 'setitimer') and threading.current_thread() is threading.main_thread() and \
+            self.deadline != float('inf')
+        if self._timer:
+            self._prev_handler = signal.signal(signal.SIGALRM, self._alarm)
+            self._prev_timer = signal.setitimer(signal.ITIMER_REAL, max(self.deadline - time.monotonic(), 1e-6))
+        return self
+
+    def __exit__(self, *args) -> None:
+        self._restore()
+
+    def _restore(self) -> None:
+        """
+        Restore the previous budget, timer and handler. Called on exit, and by the
+        timer handler, as the alarm can interrupt the code at the start of the exit.
+        """
+        if self._restored:
+            return
+        self._restored = True
+        if self._timer:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, self._prev_handler)
+            if self._prev_timer[0] > 0:  # Restore the outer timer
+                elapsed = time.monotonic() - self._t0
+                signal.setitimer(signal.ITIMER_REAL, max(self._prev_timer[0] - elapsed, 1e-6), self._prev_timer[1])
+        _TIME_BUDGET.budget = self._prev
+
+    def _alarm(self, *args) -> None:
+        """
+        Timer handler.
+        """
+        if self._restored:  # Delivered after the exit
+            return
+        self._restore()
+        raise TimeoutError(f'time budget of {self.seconds} seconds exceeded')
+
+    def cancel(self) -> None:
+        """
+        Cancel the budget, it is exceeded from now on.
+        """
+        self._cancelled = True
+
+    def exceeded(self) -> bool:
+        """
+        Return true if the budget, or an outer one, is exceeded or cancelled.
+
+        :return: Exceeded
+        """
+        if self._cancelled or time.monotonic() > self.deadline:
+            return True
+        return self._prev is not None and self._prev.exceeded()
+
+
+def check_time_budget() -> None:
+    """
+    Raise ``TimeoutError`` if the time budget of the current thread is exceeded,
+    or cancelled.
+    """
+    budget: Optional['TimeBudget'] = getattr(_TIME_BUDGET, 'budget', None)
+    if budget is not None and budget.exceeded():
+        raise TimeoutError('time budget exceeded')
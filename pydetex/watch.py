@@ -0,0 +1,325 @@
+"""
+PyDetex
+https://github.com/ppizarror/PyDetex
+
+WATCH
+Watches a latex project, and applies a pipeline to the documents affected by
+each change.
+"""
+
+__all__ = ['ProjectWatcher']
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+import pydetex.pipelines as pip
+from pydetex.project import ProjectResolver
+from typing import Any, Callable, Dict, List, Optional, Set
+
+# inotify flags, from <sys/inotify.h>
+_IN_CLOEXEC = 0o2000000
+_IN_NONBLOCK = 0o4000
+_IN_WATCH_MASK = 0x8 | 0x40 | 0x80 | 0x100 | 0x200  # Close write, moved from/to, create, delete
+
+
+class _Inotify(object):
+    """
+    Minimal inotify wrapper, used to wake up the watcher when a folder changes.
+    Only available on Linux.
+    """
+
+    _fd: int
+    _libc: 'ctypes.CDLL'
+    _watched: Set[str]
+
+    def __init__(self) -> None:
+        """
+        Constructor. Raises ``OSError`` if inotify is not available.
+        """
+        if not sys.platform.startswith('linux'):
+            raise OSError('inotify is only available on Linux')
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._fd = self._libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._watched = set()
+
+    def watch(self, folder: str) -> None:
+        """
+        Watch a folder, if not watched.
+
+        :param folder: Folder
+        """
+        if folder in self._watched:
+            return
+        if self._libc.inotify_add_watch(self._fd, os.fsencode(folder), _IN_WATCH_MASK) >= 0:
+            self._watched.add(folder)
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Wait for an event of the watched folders.
+
+        :param timeout: Max seconds to wait
+        :return: True if there were events
+        """
+        if len(select.select([self._fd], [], [], timeout)[0]) == 0:
+            return False
+        try:
+            data = os.read(self._fd, 65536)
+        except BlockingIOError:
+            return False
+        k = 0
+        while k + 16 <= len(data):  # Forget the removed watches
+            _, mask, _, n = struct.unpack_from('iIII', data, k)
+            if mask & 0x8000:  # IN_IGNORED
+                self._watched.clear()  # Added again in the next scan
+            k += 16 + n
+        return True
+
+    def close(self) -> None:
+        """
+        Close the inotify instance.
+        """
+        os.close(self._fd)
+
+
+class ProjectWatcher(object):
+    """
+    Watches the ``.tex`` files of a latex project folder, and applies a pipeline
+    to the main documents (the files with ``\\documentclass``) affected by each
+    change, that is, the changed documents and the ones including the changed
+    files through the include graph (see ``project.ProjectResolver``). The
+    includes not found are dependencies as well, thus, the documents are
+    processed again once the files are created.
+
+    Changes are found comparing the modification times of the files. On Linux,
+    inotify is used to wake up as soon as a folder changes; otherwise, the folder
+    is polled. After a change, the watcher waits until the files are quiet for
+    the debounce time, thus, many saves in a row trigger a single run. The
+    included files are cached by the resolver, so each run only loads the
+    modified files again. The documents which cannot be processed are reported
+    to stderr, and processed again on their next change.
+    """
+
+    _deps: Dict[str, Set[str]]  # Main document: files included, recursively
+    _inotify: Optional['_Inotify']
+    _kwargs: Dict[str, Any]
+    _missing: Dict[str, Set[str]]  # Main document: file names of the includes not found
+    _mtimes: Dict[str, int]
+    debounce: float
+    interval: float
+    lang: str
+    on_update: Callable[[str, str], None]
+    pipeline: 'pip.PipelineType'
+    resolver: 'ProjectResolver'
+    root: str
+
+    def __init__(
+        self,
+        root: str,
+        on_update: Callable[[str, str], None],
+        pipeline: Optional['pip.PipelineType'] = None,
+        lang: str = 'en',
+        interval: float = 0.5,
+        debounce: float = 0.25,
+        use_inotify: bool = True,
+        **kwargs
+    ) -> None:
+        """
+        Constructor. The kwargs are given to the pipeline.
+
+        :param root: Project folder
+        :param on_update: Function called with the main document (relative to the root) and the pipeline output
+        :param pipeline: Pipeline to apply, if ``None`` use ``strict``
+        :param lang: Language tag of the code
+        :param interval: Seconds between each poll. If inotify is used, max seconds between each check
+        :param debounce: Seconds without changes before applying the pipeline
+        :param use_inotify: Use inotify if available
+        """
+        assert interval > 0 and debounce >= 0
+        self.debounce = debounce
+        self.interval = interval
+        self.lang = lang
+        self.on_update = on_update
+        self.pipeline = pipeline if pipeline is not None else pip.strict
+        self.resolver = ProjectResolver(root)
+        self.root = self.resolver.root
+        self._deps = {}
+        self._inotify = None
+        self._kwargs = kwargs
+        self._missing = {}
+        self._mtimes = {}
+        if use_inotify:
+            try:
+                self._inotify = _Inotify()
+            except (OSError, AttributeError):
+                self._inotify = None
+
+    @property
+    def inotify(self) -> bool:
+        """
+        :return: True if inotify is used
+        """
+        return self._inotify is not None
+
+    def close(self) -> None:
+        """
+        Close the watcher.
+        """
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+    def _scan(self) -> Dict[str, int]:
+        """
+        Return the modification time of the tex files of the project.
+
+        :return: Dict of file (relative to the root): mtime
+        """
+        mtimes = {}
+        for path, dirs, files in os.walk(self.root):
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            if self._inotify is not None:
+                self._inotify.watch(path)
+            for f in files:
+                if f.endswith('.tex'):
+                    p = os.path.join(path, f)
+                    try:
+                        mtimes[os.path.relpath(p, self.root).replace(os.sep, '/')] = os.stat(p).st_mtime_ns
+                    except FileNotFoundError:
+                        pass
+        return mtimes
+
+    def _changes(self) -> Set[str]:
+        """
+        Scan the project, and return the files changed since the last scan.
+
+        :return: Changed, created or removed files
+        """
+        mtimes = self._scan()
+        changed = {f for f in mtimes.keys() if self._mtimes.get(f) != mtimes[f]}
+        changed.update(f for f in self._mtimes.keys() if f not in mtimes)
+        self._mtimes = mtimes
+        return changed
+
+    def mains(self) -> List[str]:
+        """
+        Return the main documents of the project.
+
+        :return: Main documents, relative to the root
+        """
+        mains = []
+        for f in sorted(self._mtimes.keys()):
+            try:
+                if '\\documentclass' in self.resolver.load(os.path.join(self.root, f)):
+                    mains.append(f)
+            except (OSError, UnicodeDecodeError):
+                pass
+        return mains
+
+    def affected(self, changed: Set[str]) -> List[str]:
+        """
+        Return the main documents affected by the changed files.
+
+        :param changed: Changed files, relative to the root
+        :return: Main documents, relative to the root
+        """
+        names = {os.path.basename(f) for f in changed}
+        return [m for m in self.mains() if m in changed or len(self._deps.get(m, set()) & changed) > 0 or
+                len(self._missing.get(m, set()) & names) > 0]
+
+    def _apply(self, main: str) -> bool:
+        """
+        Apply the pipeline to a main document, and store its included files, and
+        the ones not found. If the document cannot be processed, the error is
+        reported to stderr, and the watcher continues.
+
+        :param main: Main document, relative to the root
+        :return: True if processed
+        """
+        self.resolver.main = main
+        try:
+            out = self.pipeline(self.resolver.load(os.path.join(self.root, main)), self.lang,
+                                resolver=self.resolver, **self._kwargs)
+        except Exception as e:
+            print(f'Cannot process {main}: {e}', file=sys.stderr)
+            return False
+        graph = self.resolver.graph()
+        deps: Set[str] = set()
+        pending = [main]
+        while len(pending) > 0:  # Files included recursively
+            for f in graph.get(pending.pop(), []):
+                if f not in deps:
+                    deps.add(f)
+                    pending.append(f)
+        self._deps[main] = deps
+        missing: Set[str] = set()
+        for msg, name in self.resolver.errors():
+            if msg == 'not found':  # Found by its file name in any folder, once created
+                name = os.path.basename(name.strip().replace('\\', '/'))
+                missing.update((name, name + '.tex'))
+        self._missing[main] = missing
+        try:
+            self.on_update(main, out)
+        except OSError as e:
+            print(f'Cannot write {main}: {e}', file=sys.stderr)
+            return False
+        return True
+
+    def _wait(self, timeout: float) -> None:
+        """
+        Wait for the next check.
+
+        :param timeout: Seconds
+        """
+        if self._inotify is not None:
+            self._inotify.wait(timeout)
+        else:
+            time.sleep(timeout)
+
+    def build(self) -> List[str]:
+        """
+        Apply the pipeline to all the main documents.
+
+        :return: Main documents processed
+        """
+        self.resolver.refresh()
+        self._mtimes = self._scan()
+        return [m for m in self.mains() if self._apply(m)]
+
+    def check(self) -> List[str]:
+        """
+        Check for changes, and apply the pipeline to the affected main documents.
+        If there are changes, it waits until the files are quiet for the debounce
+        time, coalescing all the changes.
+
+        :return: Main documents processed
+        """
+        changed = self._changes()
+        if len(changed) == 0:
+            return []
+        while True:  # Debounce
+            time.sleep(self.debounce)
+            new = self._changes()
+            if len(new) == 0:
+                break
+            changed.update(new)
+        self.resolver.refresh()
+        return [m for m in self.affected(changed) if self._apply(m)]
+
+    def run(self, stop: Optional['threading.Event'] = None) -> None:
+        """
+        Build the project, then watch it until stopped.
+
+        :param stop: Event which stops the watcher. If None, watch forever
+        """
+        self.build()
+        while stop is None or not stop.is_set():
+            self._wait(self.interval)
+            self.check()
@@ -58,6 +58,7 @@ setup(
     entry_points={
         'console_scripts': [
             'pydetex = pydetex.gui:main',
+            'pydetex-cli = pydetex.cli:main',
         ],
         'gui_scripts': [
             'pydetex = pydetex.gui:main',
@@ -0,0 +1,128 @@
+"""
+PyDetex
+https://github.com/ppizarror/PyDetex
+
+TEST AIO
+Test the asyncio API.
+"""
+
+from test._base import BaseTest
+
+import asyncio
+import os
+import tempfile
+import time
+
+import pydetex.aio as aio
+import pydetex.pipelines as pip
+
+_CODE = 'This is \\textbf{a} code \\cite{a} with $x$'
+_SLOW_CODE = ' '.join(f'\\cite{{k{i}}}' for i in range(20000))
+
+
+class AioTest(BaseTest):
+
+    def test_detex(self) -> None:
+        """
+        Test the detex functions.
+        """
+
+        async def _test() -> None:
+            """
+            Run the test.
+            """
+            self.assertEqual(await aio.detex(_CODE), pip.strict(_CODE))
+            self.assertEqual(await aio.detex(_CODE, pip.simple, compress_cite=False),
+                             pip.simple(_CODE, compress_cite=False))
+            with self.assertRaises(TimeoutError):
+                await aio.detex(_SLOW_CODE, time_budget=0.01)
+
+            # The loop is not blocked
+            ticks = []
+
+            async def _tick() -> None:
+                """
+                Count the ticks of the loop.
+                """
+                while True:
+                    ticks.append(0)
+                    await asyncio.sleep(0.01)
+
+            ticker = asyncio.ensure_future(_tick())
+            await aio.detex(_SLOW_CODE[0:len(_SLOW_CODE) // 4], pip.simple)
+            ticker.cancel()
+            self.assertGreater(len(ticks), 5)
+
+            # Files, the inputs are resolved from the file folder
+            with tempfile.TemporaryDirectory() as d:
+                with open(os.path.join(d, 'main.tex'), 'w', encoding='utf-8') as f:
+                    f.write('Main \\input{chapter}')
+                with open(os.path.join(d, 'chapter.tex'), 'w', encoding='utf-8') as f:
+                    f.write('\\textit{chapter}')
+                self.assertEqual(await aio.detex_file(os.path.join(d, 'main.tex'), pip.simple), 'Main chapter')
+
+        asyncio.run(_test())
+
+    def test_many(self) -> None:
+        """
+        Test many codes, the concurrency and the cancellation.
+        """
+
+        async def _test() -> None:
+            """
+            Run the test.
+            """
+            async with aio.AsyncDetex(workers=2) as runner:
+                docs = [f'Code \\textbf{{{i}}}' for i in range(10)]
+                out = [x async for x in runner.detex_many(docs, pip.simple, concurrency=3)]
+                self.assertEqual(sorted(out), [(i, f'Code {i}') for i in range(10)])
+
+                # The slow code is yielded the last one
+                out = [i async for i, _ in runner.detex_many([_SLOW_CODE[0:50000], 'a', 'b'], concurrency=2)]
+                self.assertEqual(out[-1], 0)
+
+                # Errors
+                docs = ['a', None, 'b']
+                out = [x async for x in runner.detex_many(docs, pip.simple, concurrency=1, return_exceptions=True)]
+                self.assertEqual(out[0], (0, 'a'))
+                self.assertIsInstance(out[1][1], Exception)
+                with self.assertRaises(Exception):
+                    async for _ in runner.detex_many(docs, pip.simple, concurrency=1):
+                        pass
+
+                # Cancel a running pipeline, the worker is released
+                for _ in range(2):
+                    task = asyncio.ensure_future(runner.detex(_SLOW_CODE))
+                    await asyncio.sleep(0.2)
+                    task.cancel()
+                    with self.assertRaises(asyncio.CancelledError):
+                        await task
+                t0 = time.time()
+                self.assertEqual(await runner.detex('a'), 'a')
+                self.assertLess(time.time() - t0, 1.5)
+
+                # Stop the iteration, the pending codes are cancelled
+                gen = runner.detex_many([_SLOW_CODE, 'a', _SLOW_CODE], concurrency=2)
+                self.assertEqual(await gen.__anext__(), (1, 'a'))
+                t0 = time.time()
+                await gen.aclose()
+                self.assertEqual(await runner.detex('b'), 'b')
+                self.assertLess(time.time() - t0, 1.5)
+
+        asyncio.run(_test())
+
+    def test_processes(self) -> None:
+        """
+        Test a pool of processes.
+        """
+
+        async def _test() -> None:
+            """
+            Run the test.
+            """
+            async with aio.AsyncDetex(workers=2, processes=True) as runner:
+                self.assertTrue(runner.processes)
+                out = dict([x async for x in runner.detex_many([_CODE, 'b'], pip.simple)])
+                self.assertEqual(out, {0: pip.simple(_CODE), 1: 'b'})
+
+        asyncio.run(_test())
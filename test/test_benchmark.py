@@ -0,0 +1,112 @@
+"""
+PyDetex
+https://github.com/ppizarror/PyDetex
+
+TEST BENCHMARK
+Test the benchmark suite.
+"""
+
+from test._base import BaseTest
+
+import contextlib
+import io
+import json
+import os
+import tempfile
+
+import pydetex.benchmark as bm
+import pydetex.cli as cli
+import pydetex.pipelines as pip
+
+
+class BenchmarkTest(BaseTest):
+
+    def test_generate(self) -> None:
+        """
+        Test the synthetic documents.
+        """
+        s = bm.generate(20000, seed=3)
+        self.assertEqual(s, bm.generate(20000, seed=3))
+        self.assertNotEqual(s, bm.generate(20000, seed=4))
+        self.assertGreaterEqual(len(s), 20000)
+        self.assertLess(len(s), 25000)
+        for token in ('\\cite{', '\\ref{', '\\begin{itemize}', '\\begin{equation}', '\\def\\', '$', '%'):
+            self.assertIn(token, s)
+        self.assertTrue(s.startswith('\\documentclass') and s.endswith('\\end{document}\n'))
+        self.assertNotEqual(pip.fast(s), '')
+        self.assertEqual(bm._parse_size('1.5k'), 1500)
+        self.assertEqual(bm._parse_size('2MB'), 2000000)
+        self.assertRaises(ValueError, lambda: bm._parse_size('big'))
+
+    def test_run(self) -> None:
+        """
+        Test the run and the comparison.
+        """
+        targets = bm.get_targets(r'parsers\.remove_comments|utils\.find_tex_environments|pipelines\.fast')
+        self.assertEqual(sorted(targets.keys()), ['parsers.remove_comments', 'pipelines.fast',
+                                                  'utils.find_tex_environments'])
+        self.assertIn('pipelines.stream', bm.get_targets())
+        inputs = bm.get_inputs(['2k', '4k'], os.path.join(os.path.dirname(__file__), 'data'))
+        self.assertIn('fixture:example_simple_cite.txt', inputs)
+        self.assertNotIn('fixture:example_simple_cite_output.txt', inputs)
+        r = bm.run(targets, inputs, min_time=0)
+        self.assertEqual(set(r['times'].keys()), set(targets.keys()))
+        self.assertGreater(r['times']['pipelines.fast']['synthetic:4k'], 0)
+        self.assertEqual(r['sizes']['synthetic:2k'], len(inputs['synthetic:2k']))
+
+        # Larger inputs are skipped when exceeding the budget
+        r = bm.run(targets, {'a': 'x' * 10, 'b': 'x' * 10 ** 9}, budget=1e-3)
+        self.assertIsNotNone(r['times']['pipelines.fast']['a'])
+        self.assertIsNone(r['times']['pipelines.fast']['b'])
+
+        # Compare
+        base = {'times': {'f': {'a': 0.01, 'b': 0.01, 'c': 1e-5, 'd': None}}}
+        new = {'times': {'f': {'a': 0.011, 'b': 0.02, 'c': 1e-4, 'd': 0.1}, 'g': {'a': 1}}}
+        rows = bm.compare(base, new, threshold=0.25)
+        self.assertEqual([(x['input'], x['regression']) for x in rows], [('a', False), ('b', True), ('c', False)])
+
+    def test_cli(self) -> None:
+        """
+        Test the bench command.
+        """
+        with tempfile.TemporaryDirectory() as d:
+            history = os.path.join(d, 'history.json')
+            out = io.StringIO()
+            argv = ['bench', '--sizes', '1k', '--targets', 'pipelines.fast', '--fixtures', '',
+                    '--history', history, '-q']
+            with contextlib.redirect_stderr(out):
+                self.assertEqual(cli.main(argv), 0)
+            self.assertEqual(len(bm.load_history(history)), 1)
+            self.assertEqual(list(bm.load_history(history)[0]['times']['pipelines.fast'].keys()), ['synthetic:1k'])
+
+            def _slowdown() -> None:
+                """
+                Make the last run of the history 50 times faster, thus, the next run is a regression.
+                """
+                runs = bm.load_history(history)
+                runs[-1]['times'] = {t: {k: v and v / 50 for k, v in x.items()} for t, x in runs[-1]['times'].items()}
+                with open(history, 'w', encoding='utf-8') as fo:
+                    json.dump(runs, fo)
+
+            argv = ['bench', '--sizes', '50k', '--targets', 'pipelines.fast', '--fixtures', '',
+                    '--history', history, '-q']
+            with contextlib.redirect_stderr(out):
+                self.assertEqual(cli.main(argv), 0)
+            _slowdown()
+            out = io.StringIO()
+            with contextlib.redirect_stderr(out):
+                self.assertEqual(cli.main(argv + ['--threshold', '1000']), 0)
+            self.assertIn('0 regressions', out.getvalue())
+            _slowdown()
+            out = io.StringIO()
+            with contextlib.redirect_stderr(out):
+                self.assertEqual(cli.main(argv + ['--threshold', '10']), 1)
+            self.assertIn('1 regressions', out.getvalue())
+            self.assertEqual(len(bm.load_history(history)), 4)
+            with open(os.path.join(d, 'base.json'), 'w', encoding='utf-8') as f:
+                json.dump({'times': {'pipelines.fast': {'synthetic:50k': 1e-9}}}, f)
+            argv = ['bench', '--sizes', '50k', '--targets', 'pipelines.fast', '--fixtures', '',
+                    '--compare', os.path.join(d, 'base.json'), '-q']
+            with contextlib.redirect_stderr(out):
+                self.assertEqual(cli.main(argv), 1)
+            self.assertIn('Regression pipelines.fast', out.getvalue())
@@ -0,0 +1,106 @@
+"""
+PyDetex
+https://github.com/ppizarror/PyDetex
+
+TEST CACHE
+Test the results cache.
+"""
+
+from test._base import BaseTest
+
+import contextlib
+import io
+import os
+import tempfile
+
+import pydetex.cli as cli
+import pydetex.parsers as par
+import pydetex.pipelines as pip
+from pydetex.cache import ResultCache
+from pydetex.profiling import Profiler
+
+
+class CacheTest(BaseTest):
+
+    def test_cache(self) -> None:
+        """
+        Test the results cache.
+        """
+        f = os.path.join(tempfile.mkdtemp(), 'test.cache')
+        cache = ResultCache(f)
+        s = par._load_file_search('data/example_simple_cite.txt')
+        out = pip.strict(s)
+        self.assertEqual(pip.strict(s, cache=cache), out)
+        self.assertEqual(pip.strict(s, 'en', True, cache=cache), out)  # Progress does not change the key
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+        # The arguments and the font format are part of the key
+        self.assertEqual(pip.strict(s, compress_cite=False, cache=cache), pip.strict(s, compress_cite=False))
+        self.assertEqual(pip.styled(s, cache=cache), pip.styled(s))
+        self.assertEqual(pip.simple(s, cache=cache), pip.simple(s))
+        self.assertEqual(cache.stats()['misses'], 4)
+
+        # Includes and state arguments are not cached
+        self.assertEqual(pip.simple('\\include{missing} a', cache=cache), pip.simple('\\include{missing} a'))
+        self.assertEqual(pip.simple('a \\cite{a}', cites={}, cache=cache), 'a [1]')
+        self.assertEqual(cache.stats()['bypass'], 2)
+
+        # Shared by other instances
+        cache2 = ResultCache(f)
+        self.assertEqual(pip.strict(s, cache=cache2), out)
+        self.assertEqual(cache2.stats()['hits'], 1)
+        self.assertEqual(cache2.stats()['total_hits'], 2)
+        self.assertEqual(cache2.stats()['entries'], 4)
+        cache2.close()
+
+        # Eviction of the least recently used
+        cache.max_size = 3 * len(out)
+        cache.put('a', 'x' * len(out))
+        cache.put('b', 'x' * len(out))
+        self.assertGreater(cache.stats()['evicted'], 0)
+        self.assertLessEqual(cache.stats()['size'], cache.max_size)
+        self.assertEqual(cache.get('b'), 'x' * len(out))
+        cache.put('b', 'x')  # Replaced
+
+        # The total size is kept by the database
+        total = cache._conn.execute("SELECT value FROM totals WHERE name = 'size'").fetchone()[0]
+        self.assertEqual(total, cache.stats()['size'])
+        self.assertEqual(ResultCache(f)._conn.execute("SELECT value FROM totals").fetchone()[0], total)
+
+        # The hits are written in batches
+        atime = cache._conn.execute("SELECT atime FROM results WHERE key = 'b'").fetchone()[0]
+        hits = cache.stats()['total_hits']
+        self.assertEqual(cache.get('b'), 'x')
+        self.assertEqual(cache._conn.execute("SELECT atime FROM results WHERE key = 'b'").fetchone()[0], atime)
+        cache.flush()
+        self.assertGreater(cache._conn.execute("SELECT atime FROM results WHERE key = 'b'").fetchone()[0], atime)
+        self.assertEqual(cache.stats()['total_hits'], hits + 1)
+        cache.clear()
+        self.assertEqual(cache.stats()['entries'], 0)
+        self.assertEqual(cache._conn.execute("SELECT value FROM totals").fetchone()[0], 0)
+
+        # The arguments whose representation has their address are not part of the key
+        self.assertRaises(ValueError, lambda: ResultCache.key(s, 'strict', 'en', {'a': object()}))
+        self.assertEqual(pip.strict(s, cache=cache, other=object()), out)
+        self.assertEqual(cache.stats()['bypass'], 3)
+        pip.strict(s, cache=cache, time_budget=30, profiler=Profiler())
+        self.assertEqual(pip.strict(s, cache=cache, time_budget=60, profiler=Profiler()), out)
+        self.assertEqual(cache.stats()['hits'], 4)
+        cache.clear()
+        cache.close()
+
+        # Command line
+        tex = os.path.join(os.path.dirname(f), 'a.tex')
+        with open(tex, 'w', encoding='utf-8') as fo:
+            fo.write('Text \\cite{a}')
+        for _ in range(2):
+            out = io.StringIO()
+            with contextlib.redirect_stdout(out), contextlib.redirect_stderr(io.StringIO()):
+                self.assertEqual(cli.main(['detex', tex, '--cache', f]), 0)
+            self.assertEqual(out.getvalue(), 'Text [1]\n')
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            self.assertEqual(cli.main(['cache', f]), 0)
+        self.assertIn('"hits": 0', out.getvalue())
+        self.assertIn('"total_hits": 1', out.getvalue())
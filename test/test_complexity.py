@@ -0,0 +1,197 @@
+"""
+PyDetex
+https://github.com/ppizarror/PyDetex
+
+TEST COMPLEXITY
+Test the growth of the parsers time, the adversarial inputs, and the time budget.
+"""
+
+from test._base import BaseTest
+
+import contextlib
+import io
+import os
+import random
+import signal
+import tempfile
+import threading
+import time
+
+import pydetex.benchmark as bm
+import pydetex.cli as cli
+import pydetex.parsers as par
+import pydetex.pipelines as pip
+import pydetex.utils as ut
+
+# Max ratio between the times of an input and one four times smaller. Linear is
+# 4, quadratic is 16
+_MAX_GROWTH = 8
+
+
+def _time(f, s: str) -> float:
+    """
+    Return the min time of several calls.
+
+    :param f: Function
+    :param s: Input
+    :return: Seconds
+    """
+    times = []
+    while len(times) < 3 or len(times) < 20 and sum(times) < 0.05:
+        t = time.perf_counter()
+        f(s)
+        times.append(time.perf_counter() - t)
+    return min(times)
+
+
+class ComplexityTest(BaseTest):
+
+    def test_growth(self) -> None:
+        """
+        Test the time of each stage grows near linearly.
+        """
+        small, large = bm.generate(8000, seed=1), bm.generate(32000, seed=1)
+        growth = {}
+        for name, f in bm.get_targets().items():
+            t_small = _time(f, small)
+            if t_small < 1e-4:  # Too fast to measure
+                continue
+            growth[name] = _time(f, large) / t_small
+        slow = {k: round(v, 2) for k, v in growth.items() if v > _MAX_GROWTH}
+        for name in list(slow.keys()):  # Measure again, the machine may be busy
+            f = bm.get_targets()[name]
+            if min(_time(f, large) / _time(f, small) for _ in range(3)) <= _MAX_GROWTH:
+                del slow[name]
+        self.assertEqual(slow, {})
+        self.assertIn('parsers.process_cite', growth)
+        self.assertIn('pipelines.strict', growth)
+
+    def test_adversarial(self) -> None:
+        """
+        Test adversarial inputs, the parsers must finish without errors.
+        """
+        # Deep nesting
+        self.assertEqual(pip.simple('\\textbf{' * 2000 + 'x' + '}' * 2000), 'x')
+        self.assertEqual(pip.strict('\\textbf{' * 500 + 'x' + '}' * 500), 'x')
+        self.assertEqual(pip.strict('\\emph{\\textit{' * 400 + 'y' + '}}' * 400), 'y')
+        s = '\\begin{itemize}\\item a ' * 30 + '\\end{itemize}' * 30
+        self.assertEqual(pip.strict(s).count('a'), 30)
+
+        # Unbalanced braces
+        for s in ('a \\cite{b', 'a \\citeauthor{b', 'a \\ref{b', 'a \\label{b', 'a \\textbf{b', '\\textbf{a}}{',
+                  '\\textbf{\\textbf{a}', 'a } b {', '\\begin{itemize}\\item {a\\end{itemize}'):
+            for pipeline in (pip.simple, pip.strict, pip.fast):
+                pipeline(s, time_budget=10)
+        self.assertEqual(par.process_cite('\\cite{a} and \\cite{b'), '⇱OPEN_CITE⇲1⇱CLOSE_CITE⇲ and \\cite{b')
+        self.assertEqual(par.remove_tag('\\textbf{a \\textbf{b}', 'textbf'), '\\textbf{a b')
+        self.assertEqual(par.process_labels('a\\label{b}c\\label{d'), 'ac\\label{d')
+
+        # Tags formed when removing others
+        self.assertEqual(par.remove_tag('\\\\textbf{textbf{x}}', 'textbf'), 'x')
+        self.assertEqual(par.process_labels('\\\\label{a}label{b}c'), 'c')
+
+        # Thousands of cites and references
+        s = ' '.join(f'\\cite{{k{i}}} \\ref{{r{i % 100}}}\\label{{l{i}}}' for i in range(3000))
+        out = pip.simple(s, time_budget=30).split(' ')
+        self.assertEqual(out[0:4], ['[1]', '1', '[2]', '2'])
+        self.assertEqual(out[-2:], ['[3000]', '100'])
+
+        # Random code, made of pieces of latex
+        pieces = ['\\label{a}', '\\label{', '\\textbf{', '}', '{', 'x ', '\\cite{k', '\\ref{r}', '\\cite{a,b}', '\\\\',
+                  '\\begin{itemize}', '\\end{itemize}', '\\item ', '\\begin{enumerate}', '\\end{enumerate}', '\n',
+                  '\\begin{figure}', '\\end{figure}', '\\citeauthor{a,b}', '\\eqref{e}', '$', '$$', '\\[', '\\]', '%',
+                  '\\def\\a{b}', '\\a', '\\emph{', '\\section{', '\\caption{', '[', ']', '\\frac{', '^', '_', '&',
+                  '\\begin{tabular}{cc}', '\\end{tabular}', '\\begin{document}', '\\end{document}']
+        rnd = random.Random(0)
+        for _ in range(150):
+            s = ''.join(rnd.choice(pieces) for _ in range(rnd.randint(1, 30)))
+            for pipeline in (pip.simple, pip.strict):
+                pipeline(s, time_budget=10)
+
+    def test_time_budget(self) -> None:
+        """
+        Test the time budget.
+        """
+        handler = signal.getsignal(signal.SIGALRM) if hasattr(signal, 'SIGALRM') else None
+
+        def _loop() -> None:
+            """
+            Loop until aborted.
+            """
+            while True:
+                ut.check_time_budget()
+
+        with self.assertRaises(TimeoutError):
+            with ut.TimeBudget(0.01):
+                _loop()
+        with ut.TimeBudget(10):
+            with self.assertRaises(TimeoutError):
+                with ut.TimeBudget(0.01):
+                    _loop()
+            ut.check_time_budget()  # The outer budget is restored
+        ut.check_time_budget()
+        if handler is not None:
+            self.assertEqual(signal.getsignal(signal.SIGALRM), handler)
+
+        # Pipelines
+        s = ' '.join(f'\\cite{{k{i}}}' for i in range(2000))
+        self.assertEqual(pip.simple(s, time_budget=30), pip.simple(s))
+        self.assertRaises(TimeoutError, lambda: pip.strict(s, time_budget=1e-3))
+
+        # Within a thread, the parsers check the budget
+        errors = []
+
+        def _run() -> None:
+            """
+            Run the pipeline.
+            """
+            try:
+                pip.simple(s, time_budget=1e-4)
+            except TimeoutError as e:
+                errors.append(e)
+
+        th = threading.Thread(target=_run)
+        th.start()
+        th.join()
+        self.assertEqual(len(errors), 1)
+
+        # The heaviest stages check the budget, and abort within a small margin
+        code = 'a \\textbf{b} \\alpha \\Delta $x+y$ \\def\\c{d} \\c'
+        budget = ut.TimeBudget()
+        budget.cancel()
+        with budget:
+            for stage in (lambda: par.simple_replace(code), lambda: par.remove_commands_param(code, 'en'),
+                          lambda: par.remove_commands_param_noargv(code), lambda: par.remove_equations(code),
+                          lambda: par.process_def(code, replace=True), lambda: par.unicode_chars_equations(code),
+                          lambda: par.process_chars_equations(code, 'en', False)):
+                self.assertRaises(TimeoutError, stage)
+        doc = bm.generate(300000)
+        elapsed = []
+
+        def _run_doc() -> None:
+            """
+            Run the pipeline on a large document.
+            """
+            t0 = time.monotonic()
+            try:
+                pip.strict(doc, time_budget=0.5)
+            except TimeoutError as e:
+                errors.append(e)
+            elapsed.append(time.monotonic() - t0)
+
+        th = threading.Thread(target=_run_doc)
+        th.start()
+        th.join()
+        self.assertEqual(len(errors), 2)
+        self.assertLess(elapsed[0], 1)
+
+        # Command line
+        with tempfile.TemporaryDirectory() as d:
+            f = os.path.join(d, 'main.tex')
+            with open(f, 'w', encoding='utf-8') as fo:
+                fo.write(s)
+            err = io.StringIO()
+            with contextlib.redirect_stderr(err), contextlib.redirect_stdout(io.StringIO()):
+                self.assertEqual(cli.main(['detex', f, '--time-budget', '0.001']), 1)
+                self.assertEqual(cli.main(['detex', f, '--time-budget', '30']), 0)
+            self.assertIn('time budget', err.getvalue())
@@ -0,0 +1,144 @@
+"""
+PyDetex
+https://github.com/ppizarror/PyDetex
+
+TEST LSP
+Test the language server.
+"""
+
+from test._base import BaseTest
+
+import io
+import json
+
+import pydetex.pipelines as pip
+from pydetex.lsp import LanguageServer, TextDocument
+from typing import Any, Dict, List
+
+_URI = 'file:///main.tex'
+_CODE = """\\documentclass{article}
+\\begin{document}
+The model is a \\textbf{model}.
+
+Another paragraph about \\emph{cats} \\cite{a}.
+
+Final paragraph \\cite{b}.
+\\end{document}
+"""
+
+
+def _frame(message: Dict[str, Any]) -> bytes:
+    """
+    Frame a message.
+
+    :param message: Message
+    :return: Framed message
+    """
+    body = json.dumps(message).encode('utf-8')
+    return b'Content-Length: ' + str(len(body)).encode('ascii') + b'\r\n\r\n' + body
+
+
+def _read_all(data: bytes) -> List[Dict[str, Any]]:
+    """
+    Read all the framed messages.
+
+    :param data: Framed messages
+    :return: Messages
+    """
+    stream = io.BytesIO(data)
+    messages = []
+    while True:
+        message = LanguageServer.read_message(stream)
+        if message is None:
+            return messages
+        messages.append(message)
+
+
+class LspTest(BaseTest):
+
+    def test_document(self) -> None:
+        """
+        Test the document positions and changes.
+        """
+        doc = TextDocument(_URI, 'ab\n\U0001F600cd\nef')
+        self.assertEqual(doc.offset({'line': 1, 'character': 2}), 4)
+        self.assertEqual(doc.position(4), {'line': 1, 'character': 2})
+        self.assertEqual(doc.position(8), {'line': 2, 'character': 1})
+        self.assertEqual(doc.offset({'line': 0, 'character': 10}), 2)
+        self.assertEqual(doc.offset({'line': 5, 'character': 0}), len(doc.text))
+        doc.apply_change({'range': {'start': {'line': 1, 'character': 2}, 'end': {'line': 2, 'character': 0}},
+                          'text': 'X'})
+        self.assertEqual(doc.text, 'ab\n\U0001F600Xef')
+        doc.apply_change({'text': 'new'})
+        self.assertEqual(doc.text, 'new')
+        self.assertEqual(doc.position(3), {'line': 0, 'character': 3})
+
+    def test_server(self) -> None:
+        """
+        Test the server session.
+        """
+        change = {'range': {'start': {'line': 4, 'character': 0}, 'end': {'line': 4, 'character': 7}},
+                  'text': 'One'}
+        stdin = io.BytesIO(b''.join(_frame(m) for m in [
+            {'jsonrpc': '2.0', 'id': 0, 'method': 'pydetex/plainText',
+             'params': {'textDocument': {'uri': _URI}}},
+            {'jsonrpc': '2.0', 'id': 1, 'method': 'initialize',
+             'params': {'initializationOptions': {'pipeline': 'strict', 'window': 10}}},
+            {'jsonrpc': '2.0', 'method': 'initialized', 'params': {}},
+            {'jsonrpc': '2.0', 'method': 'textDocument/didOpen',
+             'params': {'textDocument': {'uri': _URI, 'text': _CODE, 'version': 1}}},
+            {'jsonrpc': '2.0', 'method': 'textDocument/didChange',
+             'params': {'textDocument': {'uri': _URI, 'version': 2}, 'contentChanges': [change]}},
+            {'jsonrpc': '2.0', 'id': 2, 'method': 'pydetex/plainText',
+             'params': {'textDocument': {'uri': _URI}}},
+            {'jsonrpc': '2.0', 'id': 3, 'method': 'pydetex/other', 'params': {}},
+            {'jsonrpc': '2.0', 'id': 4, 'method': 'pydetex/plainText',
+             'params': {'textDocument': {'uri': 'file:///other.tex'}}},
+            {'jsonrpc': '2.0', 'method': 'textDocument/didClose', 'params': {'textDocument': {'uri': _URI}}},
+            {'jsonrpc': '2.0', 'id': 5, 'method': 'shutdown'},
+            {'jsonrpc': '2.0', 'method': 'exit'},
+            {'jsonrpc': '2.0', 'id': 6, 'method': 'shutdown'}
+        ]))
+        stdout = io.BytesIO()
+        server = LanguageServer()
+        server.run(stdin, stdout)
+        out = _read_all(stdout.getvalue())
+
+        self.assertEqual(out[0]['error']['code'], -32002)
+        self.assertEqual(out[1]['result']['capabilities']['textDocumentSync'], {'openClose': True, 'change': 2})
+        self.assertEqual(server.repetition['window'], 10)
+
+        # The repeated word is located in the source
+        self.assertEqual(out[2]['method'], 'textDocument/publishDiagnostics')
+        diagnostics = out[2]['params']['diagnostics']
+        self.assertEqual(len(diagnostics), 1)
+        self.assertEqual(diagnostics[0]['range'], {'start': {'line': 2, 'character': 23},
+                                                   'end': {'line': 2, 'character': 28}})
+        self.assertEqual(diagnostics[0]['message'], 'Repeated word "model", 3 words before')
+
+        # Only the edited paragraph is processed again
+        self.assertEqual(out[3]['params']['version'], 2)
+        self.assertEqual(len(out[3]['params']['diagnostics']), 1)
+        self.assertEqual(server.stats, {'processed': 4, 'reused': 5})
+        text = pip.strict(_CODE.replace('Another', 'One'))
+        self.assertEqual(out[4]['result'], {'text': text, 'words': 13, 'version': 2})
+
+        # Errors
+        self.assertEqual(out[5]['error']['code'], -32601)
+        self.assertEqual(out[6]['error']['code'], -32602)
+
+        # The diagnostics are cleared on close, and the messages after exit are ignored
+        self.assertEqual(out[7]['params'], {'uri': _URI, 'diagnostics': []})
+        self.assertEqual(out[8], {'jsonrpc': '2.0', 'id': 5, 'result': None})
+        self.assertEqual(len(out), 9)
+        self.assertFalse(server.running)
+
+        # The preamble is dropped after leading comments
+        server = LanguageServer()
+        code = '% main file\n' + _CODE.replace('cats}', 'cats}\n\\begin{itemize}\n\\item one\n\\end{itemize}\nTail')
+        server.handle({'jsonrpc': '2.0', 'id': 0, 'method': 'initialize', 'params': {}})
+        server.documents[_URI] = TextDocument(_URI, code)
+        text = pip.strict(code)
+        self.assertIn('Tail', text)
+        self.assertEqual(server.handle({'jsonrpc': '2.0', 'id': 1, 'method': 'pydetex/plainText',
+                                        'params': {'textDocument': {'uri': _URI}}})['result']['text'], text)
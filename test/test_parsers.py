@@ -20,6 +20,17 @@ class ParserTest(BaseTest):
         """
         self.assertNotEqual(pydetex.version.vernum, '')
 
+    def test_set_font_format(self) -> None:
+        """
+        Test parsers font format.
+        """
+        par.set_font_format(True)
+        self.assertEqual(par.FONT_FORMAT_SETTINGS['cite'], '⇱PYDETEX_FONT:LINK⇲')
+        self.assertEqual(par.process_ref('\\ref{a}'), '⇱PYDETEX_FONT:LINK⇲1⇱PYDETEX_FONT:NORMAL⇲')
+        par.set_font_format(False)
+        self.assertEqual(par.FONT_FORMAT_SETTINGS['cite'], '')
+        self.assertEqual(par.process_ref('\\ref{a}'), '1')
+
     def test_process_labels(self) -> None:
         """
         Removes labels.
@@ -484,6 +495,10 @@ class ParserTest(BaseTest):
             '1. a\n        \n1. a\n        \n1. b\n        \n1. a\n        \n1. '
             'b\n   •  c\n2. d\n        \\begin{nice}\n        \\end{nice}')
 
+        # The lists after an unbalanced brace are found once the others are processed
+        s = '\\begin{itemize}\\item a\\end{itemize}{\\begin{itemize}\\item b\\end{itemize}'
+        self.assertEqual(par.replace_pydetex_tags(par.process_items(s, lang='en')).strip(), '-  a{\n-  b')
+
     def test_remove_environments(self) -> None:
         """
         Remove environment test.
@@ -7,9 +7,19 @@ Test the pipelines.
 """
 
 from test._base import BaseTest
+import pydetex.cli as cli
 import pydetex.pipelines as pip
 import pydetex.parsers as par
+import concurrent.futures
+import contextlib
+import difflib
+import io
+import multiprocessing
 import os
+import random
+import re
+import tempfile
+import time
 
 
 class ParserTest(BaseTest):
@@ -136,3 +146,175 @@ class ParserTest(BaseTest):
         self.assertEqual(
             pip.strict_eqn('My value is: $0.4375\ \\frac{\\text{tonf}}{{\\text{m}}^2}$. Nice!'),
             'My value is: 0.4375 (tonf)/(m²). Nice!')
+
+    def test_fast(self) -> None:
+        """
+        Test fast pipeline.
+        """
+        s = 'Table \\ref{tab:review-rulebased} details the reviewed rule-based ' \
+            'methods within floor plan recognition, such as (1) \\textit{Graphics separation}, ' \
+            '(2) \\textbf{\\textit{Pattern}   recognition}\\footnote{See \\cite[p. 2]{a}.} % comment\n' \
+            'with $x^2$ and 10\\% of \\alpha~values.\\label{sec:a}'
+        self.assertEqual(
+            pip.fast(s, show_progress=True),
+            'Table details the reviewed rule-based methods within floor plan recognition, such as '
+            '(1) Graphics separation, (2) Pattern recognitionSee .\nwith and 10% of α values.')
+
+        # Removes the preamble, environments and display equations
+        s = '\\documentclass{article}\\usepackage{x}\\begin{document}\\section{Intro}\n\n\n' \
+            'Text\\begin{equation}y=2\\end{equation}\\begin{verbatim}code\\end{verbatim}.\\end{document}'
+        self.assertEqual(pip.fast(s), 'Intro\n\nText .')
+        self.assertEqual(pip.fast(''), '')
+
+        # The output words are similar to strict
+        s = par._load_file_search('data/example_simple_itemize.txt')
+        w_fast, w_strict = re.findall(r'\w+', pip.fast(s)), re.findall(r'\w+', pip.strict(s))
+        self.assertGreater(difflib.SequenceMatcher(None, w_fast, w_strict, autojunk=False).ratio(), 0.95)
+
+    def test_stream(self) -> None:
+        """
+        Test stream pipeline.
+        """
+        # The output is the same as processing the whole code
+        for f in ('data/example_placeholder.txt', 'data/example_simple_cite.txt',
+                  'data/example_tables_strict.txt'):
+            s = par._load_file_search(f)
+            for chunk_size in (1, 100):
+                self.assertEqual(''.join(pip.stream(io.StringIO(s), chunk_size=chunk_size)), pip.strict(s))
+
+        # Numbers and definitions are kept between chunks, and the chunks are not
+        # cut within environments, equations or braces
+        s = '\\documentclass{article}\n\\begin{document}\n\\def\\a{x}Cite \\cite{a}\n\nAlso ' \
+            '\\cite{b} \\cite{a} \\a\n\n$$\n\nx+y\n\n$$\n\n\\textbf{a\n\nb}\n\\end{document}\nText'
+        chunks = list(pip.stream(s.splitlines(True), pipeline=pip.simple, chunk_size=1, replace_defs=True))
+        self.assertEqual(chunks, ['Cite [1]', '\n\nAlso [2] [1] x', '\n\nx+y', '\n\na\n\nb'])
+        self.assertEqual(list(pip.stream([''])), [])
+
+        # The preamble is dropped after leading comments, and the document
+        # environment is removed even if there is no preamble
+        for s in ('% !TEX program = pdflatex\n\\documentclass{article}\n\\usepackage{x}\n\\begin{document}\n'
+                  'First paragraph.\n\n\\begin{itemize}\n\\item one\n\\end{itemize}\nLast paragraph.\n\\end{document}',
+                  '\\begin{document}\nFirst \\textbf{a}.\n\n\\begin{itemize}\n\\item one\n\\end{itemize}\n'
+                  'Tail words.\n\\end{document}\n',
+                  '% main file\n% \\begin{document}\n\\documentclass{article}\n\\begin{document}\nA.\n'
+                  '% \\end{document}\n\\begin{itemize}\n\\item one\n\\end{itemize}\nB.\n\\end{document}\nafter'):
+            for chunk_size in (1, 65536):
+                self.assertEqual(''.join(pip.stream(s.splitlines(True), chunk_size=chunk_size)), pip.strict(s))
+        self.assertEqual(''.join(pip.stream(s.splitlines(True))), 'A.\n\n- one\nB.')
+
+        # Read from a file
+        f = os.path.join(os.path.dirname(__file__), 'data/example_simple_cite.txt')
+        self.assertEqual(''.join(pip.stream(f)), pip.strict(par._load_file_search('data/example_simple_cite.txt')))
+        self.assertEqual(''.join(pip.stream(f, use_mmap=True)), ''.join(pip.stream(f)))
+
+        # The nested removed environments are skipped, and their cites and references numbered
+        s = '\\begin{tabular}{c}\\cite{a} \\ref{x}\\end{tabular}\nSee \\cite{b} and \\cite{a}, \\ref{y} \\ref{x}.\n\n' \
+            '\\begin{tabular}{c}\n\\begin{tabular}{c} x \\end{tabular} & Leaked cell & b \\\\\n\\end{tabular}\nEnd.\n'
+        f = os.path.join(tempfile.gettempdir(), 'pydetex_test_stream_mmap.tex')
+        with open(f, 'w', encoding='utf-8') as fo:
+            fo.write(s)
+        for pipeline in (pip.simple, pip.strict):
+            self.assertEqual(''.join(pip.stream(f, pipeline=pipeline, use_mmap=True)), pipeline(s))
+        self.assertEqual(''.join(pip.stream(f, use_mmap=True)), 'See [2] and [1], 2 1.\n\nEnd.')
+        os.remove(f)
+
+    def test_parallel(self) -> None:
+        """
+        Test parallel pipeline.
+        """
+        executor = concurrent.futures.ProcessPoolExecutor(2, mp_context=multiprocessing.get_context('spawn'))
+
+        # The output is the same as processing the whole code
+        for f in ('data/example_placeholder.txt', 'data/example_simple_cite.txt', 'data/example_tables_strict.txt',
+                  'data/example_simple_itemize.txt', 'data/example_complex_envs.txt'):
+            s = par._load_file_search(f)
+            for pipeline in (pip.simple, pip.strict, pip.strict_eqn):
+                for segment_size in (1, 500):
+                    self.assertEqual(pip.parallel(s, pipeline=pipeline, segment_size=segment_size, executor=executor),
+                                     pipeline(s))
+
+        # Definitions, cites and equations numbered between segments
+        s = '\\documentclass{article}\n\\begin{document}\n\\def\\a{x}\\def\\b{$pq$}Cite \\cite{a} $x+y$\n\n' \
+            'Also \\citet{b} \\cite{a} \\a $zw$\n\n$$\n\nx+y\n\n$$\n\n\\textbf{a\n\nb} $u+v$\n\\end{document}\nText'
+        for pipeline in (pip.simple, pip.strict):
+            self.assertEqual(pip.parallel(s, pipeline=pipeline, segment_size=1, executor=executor, replace_defs=True),
+                             pipeline(s, replace_defs=True))
+        cites, eqn_number = {}, [0]
+        out = pip.parallel(s, segment_size=1, executor=executor, cites=cites, eqn_number=eqn_number)
+        self.assertEqual(out, pip.strict(s))
+        self.assertEqual(cites, {'a': 1, 'b': 2})
+        self.assertEqual(eqn_number, [3])
+
+        # The definitions are replaced by their last value, as the serial pipeline does
+        s = '\\def\\mode{draft}We are in \\mode mode.\n\nText \\cite{a}.\n\n\\def\\mode{final}Now \\mode.\n'
+        self.assertEqual(pip.parallel(s, segment_size=1, executor=executor, replace_defs=True),
+                         'We are in final mode.\n\nText [1].\n\nNow final.')
+        example_files = ['data/example_complex_template.txt']
+        if 'GITHUB' in os.environ:  # If not test complex
+            example_files.clear()
+        for f in example_files:
+            s = par._load_file_search(f)
+            self.assertEqual(pip.parallel(s, segment_size=1000, executor=executor, replace_defs=True),
+                             pip.strict(s, replace_defs=True))
+
+        # Random documents, the text is the same, only the blank lines between the segments may differ
+        pieces = ['Text here.', '\\begin{figure}\\caption{Cap}\\end{figure}', '\\section{Intro}Ref', '\\label{f}',
+                  '\\textbf{bold} word', '$x+y$', '\\cite{a}', 'See \\ref{f}', '\\\\', ', comma', '\\newline',
+                  '\\begin{enumerate}\\item a\\item b\\end{enumerate}', '\\footnote{note}', '\\item x',
+                  '\\begin{equation}x=1\\label{e}\\end{equation}', '\\paragraph{Par}', '%comment', '.',
+                  '\\begin{table}\\begin{tabular}{c}a\\end{tabular}\\end{table}', '\\href{http://x}{link}']
+        rnd = random.Random(0)
+        for _ in range(60):
+            s = ''.join(' '.join(rnd.choice(pieces) for _ in range(rnd.randint(1, 3))) +
+                        rnd.choice(['\n\n', '\n\n\n', '\n', ' \n\n']) for _ in range(rnd.randint(2, 10)))
+            for pipeline in (pip.simple, pip.strict):
+                self.assertEqual(re.sub(r'\n\s*\n\s*', '\n\n', pip.parallel(s, pipeline=pipeline, segment_size=1,
+                                                                           executor=executor)),
+                                 re.sub(r'\n\s*\n\s*', '\n\n', pipeline(s)))
+        s = '\\begin{figure}\\caption{Cap}\\end{figure}\n\n\\emph{em} \\\\ \\label{f}\n\n\\section{Intro}Ref'
+        self.assertEqual(pip.parallel(s, pipeline=pip.simple, segment_size=1, executor=executor), pip.simple(s))
+
+        # The time budget limits the whole call
+        s = '\n\n'.join(['Text \\textbf{bold} $x^2$ \\cite{a} ' * 50] * 200)
+        t0 = time.monotonic()
+        with self.assertRaises(TimeoutError):
+            pip.parallel(s, segment_size=1000, executor=executor, time_budget=0.2)
+        self.assertLess(time.monotonic() - t0, 1)
+        executor.shutdown()
+
+        # Processed serially
+        self.assertEqual(pip.parallel(s, pipeline=pip.fast), pip.fast(s))
+        self.assertEqual(pip.parallel('Only one \\textbf{segment}', executor=executor), 'Only one segment')
+        self.assertEqual(pip.parallel(''), '')
+
+        # The command line rejects the options not applied in parallel
+        for option in ('--stream', '--cache', '--profile=summary'):
+            with self.assertRaises(SystemExit), contextlib.redirect_stderr(io.StringIO()):
+                cli.main(['detex', 'main.tex', '--parallel', option])
+
+    def test_styled(self) -> None:
+        """
+        Test styled pipeline output.
+        """
+        s = 'This is \\textbf{bold}, see \\cite{a} and \\ref{b}'
+        self.assertEqual(pip.styled(s), ('This is bold, see [1] and 1',
+                                         [(8, 12, 'bold'), (18, 21, 'link'), (26, 27, 'link')]))
+        self.assertEqual(pip.styled(s)[0], pip.strict(s))
+        self.assertEqual(pip.styled(s, pipeline=pip.simple), ('This is bold, see [1] and 1',
+                                                              [(18, 21, 'link'), (26, 27, 'link')]))
+        self.assertEqual(pip.styled(''), ('', []))
+
+        # The font format is restored
+        self.assertEqual(par.FONT_FORMAT_SETTINGS['bold'], '')
+
+        # The font format of the other threads is not modified
+        s = '\n\n'.join([s] * 50)
+        plain, styled = pip.strict(s), pip.styled(s)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [executor.submit(pip.styled if i % 2 == 0 else pip.strict, s) for i in range(40)]
+            for i in range(len(futures)):
+                self.assertEqual(futures[i].result(), styled if i % 2 == 0 else plain)
+        with par.font_format_context(True):
+            self.assertEqual(par.get_font_format()['bold'], '⇱PYDETEX_FONT:BOLD⇲')
+            self.assertEqual(par.FONT_FORMAT_SETTINGS['bold'], '')
+        self.assertEqual(par.get_font_format()['bold'], '')
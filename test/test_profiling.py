@@ -0,0 +1,157 @@
+"""
+PyDetex
+https://github.com/ppizarror/PyDetex
+
+TEST PROFILING
+Test the profiler and its collectors.
+"""
+
+from test._base import BaseTest
+
+import contextlib
+import io
+import json
+import os
+import pstats
+import sys
+import tempfile
+import threading
+import tracemalloc
+
+import pydetex.cli as cli
+import pydetex.parsers as par
+import pydetex.pipelines as pip
+import pydetex.profiling as prof
+
+_CODE = 'This is \\textbf{a} code \\cite{a} % comment\n\\begin{itemize}\\item b\\end{itemize} with $x$'
+
+
+class ProfilingTest(BaseTest):
+
+    def test_events(self) -> None:
+        """
+        Test the events of the stages.
+        """
+        summary = prof.SummaryCollector()
+        events = []
+
+        class _Collector(prof.Collector):
+
+            def on_event(self, event: 'prof.StageEvent') -> None:
+                events.append(event)
+
+        p = prof.Profiler(summary, _Collector())
+        out = pip.strict(_CODE, profiler=p)
+        self.assertEqual(out, pip.strict(_CODE))
+        self.assertEqual(events[-1].kind, 'pipeline')
+        self.assertEqual(events[-1].name, 'strict')
+        self.assertEqual(events[-1].input_size, len(_CODE))
+        self.assertEqual(events[-1].output_size, len(out))
+        self.assertEqual([e.index for e in events[:-1]], list(range(1, len(events))))  # Pipeline started first
+        stages = [e for e in events if e.kind == 'stage']
+        self.assertEqual({e.pipeline for e in stages}, {'strict'})  # simple is measured as part of strict
+        self.assertEqual([e.name for e in stages].count('remove_comments'), 3)  # Not overwritten
+        for e in stages:
+            self.assertGreaterEqual(e.wall_time, 0)
+            self.assertIsNone(e.memory_peak)
+            self.assertEqual(e.error, '')
+        self.assertNotIn('remove_tag', [e.name for e in stages])
+
+        # Summary
+        rows = {r['name']: r for r in summary.rows()}
+        self.assertEqual(rows['remove_comments']['calls'], 3)
+        self.assertEqual(rows['strict']['kind'], 'pipeline')
+        self.assertIn('remove_comments', summary.table())
+        self.assertIn('[strict]', str(summary))
+
+        # Context, the parsers called alone
+        events.clear()
+        with p:
+            par.remove_common_tags('\\textbf{a}')
+            pip.fast(_CODE)
+        self.assertEqual([(e.name, e.pipeline) for e in events][0], ('remove_common_tags', ''))
+        self.assertEqual(events[-1].name, 'fast')
+
+        # Disabled
+        events.clear()
+        pip.simple(_CODE)
+        self.assertEqual(events, [])
+
+        # Errors are reported
+        with p:
+            self.assertRaises(TypeError, lambda: par.remove_tag('\\textbf{a}', None))
+        self.assertEqual(events[-1].error, 'TypeError')
+
+        # Threads do not share the enabled profiler
+        with p:
+            th = threading.Thread(target=lambda: pip.simple(_CODE))
+            th.start()
+            th.join()
+        self.assertEqual(len(events), 1)
+
+    def test_collectors(self) -> None:
+        """
+        Test the jsonl and cprofile collectors, and the memory peak.
+        """
+        with tempfile.TemporaryDirectory() as d:
+            cprofile = prof.CProfileCollector(os.path.join(d, 'stats'))
+            p = prof.Profiler(prof.JsonLinesCollector(os.path.join(d, 'events.jsonl')), cprofile, memory=True)
+            pip.simple(_CODE, profiler=p)
+            list(pip.stream(io.StringIO(_CODE + '\n\n' + _CODE), pipeline=pip.fast, chunk_size=10, profiler=p))
+            p.close()
+            with open(os.path.join(d, 'events.jsonl'), encoding='utf-8') as f:
+                events = [json.loads(line) for line in f]
+            self.assertEqual([e['name'] for e in events if e['kind'] == 'pipeline'], ['simple', 'fast', 'fast'])
+            self.assertEqual(len(cprofile.files), len([e for e in events if e['kind'] == 'stage']))
+            self.assertIn('_simple_remove_comments.prof', cprofile.files[1])
+            pstats.Stats(cprofile.files[0])
+            if sys.version_info >= (3, 9):
+                self.assertGreater(events[-1]['memory_peak'], 0)
+
+    def test_memory(self) -> None:
+        """
+        Test the memory accounting.
+        """
+        if sys.version_info < (3, 9):
+            self.assertFalse(prof.Profiler(memory=True).memory)
+            return
+        memory = prof.MemoryCollector()
+        p = prof.Profiler(memory, memory=True)
+        s = _CODE * 200
+        pip.simple(s, profiler=p)
+        self.assertFalse(tracemalloc.is_tracing())  # Stopped by the profiler
+        self.assertEqual(memory.records[-1]['name'], 'simple')
+        self.assertEqual([r['name'] for r in memory.records].count('remove_comments'), 2)
+        rows = {r['name']: r for r in memory.rows()}
+        self.assertEqual(memory.rows()[0]['kind'], 'pipeline')
+        self.assertGreaterEqual(rows['simple']['memory_peak'], rows['remove_comments']['memory_peak'])
+        self.assertGreater(rows['remove_comments']['memory_peak'], len(s))
+        self.assertGreater(rows['remove_comments']['peak_per_char'], 1)
+        sites = memory.sites('remove_comments')
+        self.assertGreater(len(sites), 0)
+        self.assertTrue(any('parsers.py' in x[0] for x in sites))
+        self.assertEqual(sorted(sites, key=lambda x: -x[1]), sites)
+        self.assertIn('remove_comments', memory.report())
+        self.assertIn('parsers.py', str(memory))
+
+        # Not enabled within the profiler
+        memory = prof.MemoryCollector()
+        pip.simple(s, profiler=prof.Profiler(memory))
+        self.assertEqual(memory.records, [])
+
+    def test_cli(self) -> None:
+        """
+        Test the profile options.
+        """
+        with tempfile.TemporaryDirectory() as d:
+            f = os.path.join(d, 'main.tex')
+            with open(f, 'w', encoding='utf-8') as fo:
+                fo.write(_CODE)
+            err = io.StringIO()
+            with contextlib.redirect_stderr(err), contextlib.redirect_stdout(io.StringIO()):
+                self.assertEqual(cli.main(['detex', f, '--profile', 'summary', '--profile', 'jsonl',
+                                           '--profile-output', d]), 0)
+                self.assertEqual(cli.main(['detex', f, '--stream', '--profile', 'summary']), 0)
+                self.assertEqual(cli.main(['detex', f, '--profile', 'memory']), 0)
+            self.assertEqual(err.getvalue().count('[strict]'), 2 + (sys.version_info >= (3, 9)))
+            self.assertTrue(os.path.isfile(os.path.join(d, 'events.jsonl')))
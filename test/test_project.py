@@ -0,0 +1,89 @@
+"""
+PyDetex
+https://github.com/ppizarror/PyDetex
+
+TEST PROJECT
+Test the resolution of the project files.
+"""
+
+from test._base import BaseTest
+
+import os
+import shutil
+import tempfile
+import time
+
+import pydetex.pipelines as pip
+from pydetex.project import ProjectResolver
+
+
+class ProjectTest(BaseTest):
+
+    def test_resolver(self) -> None:
+        """
+        Test the project resolver.
+        """
+        root = tempfile.mkdtemp()
+        files = {
+            'main.tex': '\\begin{document}\nMain \\cite{a} % \\input{comment}\n\\include{chapters/one}\n'
+                        '\\import{chapters/}{two}\n\\input{missing}\n\\subfile{chapters/sub}\n\\end{document}',
+            'chapters/one.tex': 'One \\cite{b}\n\\input{chapters/figs/fig}',
+            'chapters/two.tex': 'Two \\subimport{figs/}{fig2.tex}\n\\input{main}',
+            'chapters/sub.tex': '\\documentclass[../main]{subfiles}\n\\begin{document}\nSub \\input{figs/fig}\n\\end{document}',
+            'chapters/figs/fig.tex': 'Figure',
+            'chapters/figs/fig2.tex': 'Figure two'
+        }
+        for f in files.keys():
+            os.makedirs(os.path.dirname(os.path.join(root, f)), exist_ok=True)
+            with open(os.path.join(root, f), 'w', encoding='utf-8') as fo:
+                fo.write(files[f])
+
+        r = ProjectResolver(root)
+        self.assertEqual(r.find('chapters/one'), os.path.join(root, 'chapters', 'one.tex'))
+        self.assertEqual(r.find('fig', 'chapters/figs'), os.path.join(root, 'chapters', 'figs', 'fig.tex'))
+        self.assertEqual(r.find('fig2.tex'), os.path.join(root, 'chapters', 'figs', 'fig2.tex'))  # By name
+        self.assertIsNone(r.find('missing'))
+
+        # Resolve, the cyclic include and the missing file are kept
+        s = r.resolve_file('main.tex')
+        self.assertEqual(s, '\\begin{document}\nMain \\cite{a} One \\cite{b}\nFigure\nTwo Figure two\n'
+                            '\\input{main}\n\\input{missing}\n\nSub Figure\n\n\\end{document}')
+        self.assertEqual(r.errors(), [('cyclic include', 'main.tex'), ('not found', 'missing')])
+        self.assertEqual(r.graph()['chapters/two.tex'], ['chapters/figs/fig2.tex', 'main.tex'])
+        self.assertEqual(r.cache_stats()['misses'], 6)  # Each file is read once
+        self.assertEqual(r.cache_stats()['files'], 6)
+
+        # Without the prefetch threads, the output is the same
+        r1 = ProjectResolver(root, workers=1)
+        self.assertEqual(r1.resolve_file('main.tex'), s)
+        self.assertEqual(r1.cache_stats(), {'hits': 1, 'misses': 6, 'files': 6})
+        r1 = ProjectResolver(root)
+        self.assertEqual(r1.prefetch(r1.load(os.path.join(root, 'main.tex'))), 6)  # Includes main.tex, cyclic
+        self.assertEqual(r1.cache_stats(), {'hits': 1, 'misses': 6, 'files': 6})
+
+        # The files are only loaded again if modified
+        self.assertEqual(r.resolve_file('main.tex'), s)
+        self.assertEqual(r.cache_stats()['misses'], 6)
+        f = os.path.join(root, 'chapters', 'figs', 'fig.tex')
+        with open(f, 'w', encoding='utf-8') as fo:
+            fo.write('New figure')
+        os.utime(f, ns=(time.time_ns() + 10 ** 9, time.time_ns() + 10 ** 9))
+        self.assertIn('New figure', r.resolve_file('main.tex'))
+        self.assertEqual(r.cache_stats()['misses'], 7)
+
+        # Use within pipelines
+        r.main = 'main.tex'
+        self.assertEqual(pip.strict(files['main.tex'], resolver=r),
+                         'Main [1] One [2]\nNew figure\nTwo Figure two\n\nSub New figure')
+
+        # The deeper folders are not indexed, but their files are found by their path
+        r1 = ProjectResolver(root, max_depth=1)
+        self.assertIn('chapters/one.tex', r1._files)
+        self.assertNotIn('chapters/figs/fig.tex', r1._files)
+        self.assertEqual(r1.find('fig', 'chapters/figs'), os.path.join(root, 'chapters', 'figs', 'fig.tex'))
+        self.assertIsNone(r1.find('fig2.tex'))
+        self.assertEqual(r1.resolve_file('main.tex'), r.resolve_file('main.tex'))
+        self.assertEqual(ProjectResolver(root, max_depth=0)._files, {'main.tex': os.path.join(root, 'main.tex')})
+        r1 = ProjectResolver.from_file(os.path.join(root, 'main.tex'))
+        self.assertEqual((r1.root, r1.main, r1.max_depth), (root, 'main.tex', 2))
+        shutil.rmtree(root)
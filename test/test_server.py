@@ -0,0 +1,169 @@
+"""
+PyDetex
+https://github.com/ppizarror/PyDetex
+
+TEST SERVER
+Test the local service.
+"""
+
+from test._base import BaseTest
+
+import http.client
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+
+import pydetex.pipelines as pip
+from pydetex.server import DetexServer
+from typing import Any, Dict, Optional, Tuple
+
+_CODE = 'This is \\textbf{a} code \\cite{a} \\input{chapter} with $x$'
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    """
+    HTTP connection through a Unix socket.
+    """
+
+    def __init__(self, path: str) -> None:
+        super().__init__('localhost')
+        self._path = path
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self._path)
+
+
+def _request(server: 'DetexServer', method: str, path: str, body: Any = None) -> Tuple[int, Dict[str, Any]]:
+    """
+    Send a request to the server.
+
+    :param server: Server
+    :param method: HTTP method
+    :param path: Path
+    :param body: JSON body
+    :return: Status, response data
+    """
+    if isinstance(server.address, str):
+        conn = _UnixHTTPConnection(server.address)
+    else:
+        conn = http.client.HTTPConnection(*server.address, timeout=30)
+    data: Optional[str] = None
+    if body is not None:
+        data = body if isinstance(body, str) else json.dumps(body)
+    conn.request(method, path, body=data)
+    r = conn.getresponse()
+    out = json.loads(r.read())
+    conn.close()
+    return r.status, out
+
+
+class ServerTest(BaseTest):
+
+    def test_requests(self) -> None:
+        """
+        Test the requests.
+        """
+        with DetexServer(port=0, workers=2, max_pending=4, timeout=5) as server:
+            self.assertNotEqual(server.address[1], 0)
+            self.assertEqual(_request(server, 'GET', '/health'), (200, {'status': 'ok'}))
+            self.assertEqual(_request(server, 'POST', '/detex', {'text': _CODE}), (200, {'text': pip.strict(_CODE)}))
+            self.assertEqual(_request(server, 'POST', '/detex', {'text': _CODE, 'pipeline': 'simple',
+                                                                 'compress_cite': False})[1]['text'],
+                             pip.simple(_CODE, compress_cite=False))
+
+            # Batch, the options are shared unless overridden
+            status, data = _request(server, 'POST', '/detex', {
+                'documents': [{'text': _CODE}, {'text': _CODE, 'pipeline': 'strict'}], 'pipeline': 'fast'})
+            self.assertEqual(status, 200)
+            self.assertEqual(data['results'], [{'text': pip.fast(_CODE)}, {'text': pip.strict(_CODE)}])
+            self.assertEqual(_request(server, 'POST', '/detex', {'documents': []}), (200, {'results': []}))
+
+            # Errors
+            self.assertEqual(_request(server, 'POST', '/detex', '{')[0], 400)
+            self.assertEqual(_request(server, 'POST', '/detex', {'text': 1})[0], 400)
+            self.assertEqual(_request(server, 'POST', '/detex', {'text': 'a', 'pipeline': 'none'})[0], 400)
+            self.assertEqual(_request(server, 'POST', '/detex', {'text': 'a', 'replace_defs': 'yes'})[0], 400)
+            self.assertEqual(_request(server, 'POST', '/detex', {'text': 'a', 'timeout': -1})[0], 400)
+            self.assertEqual(_request(server, 'POST', '/detex', {'documents': [{'text': 'a'}] * 5})[0], 413)
+            self.assertEqual(_request(server, 'POST', '/other', {'text': 'a'})[0], 404)
+            self.assertEqual(_request(server, 'GET', '/other')[0], 404)
+
+            # Timeout, within a batch the other documents are processed
+            slow = ' '.join(f'\\cite{{k{i}}}' for i in range(20000))
+            self.assertEqual(_request(server, 'POST', '/detex', {'text': slow, 'timeout': 0.01}),
+                             (504, {'error': 'time budget exceeded'}))
+            status, data = _request(server, 'POST', '/detex', {'documents': [{'text': slow}, {'text': 'a'}],
+                                                               'timeout': 0.01})
+            self.assertEqual(data['results'], [{'error': 'time budget exceeded'}, {'text': 'a'}])
+
+            # Stats
+            status, stats = _request(server, 'GET', '/stats')
+            self.assertEqual(stats['workers'], 2)
+            self.assertEqual(stats['pending'], 0)
+            self.assertEqual(stats['requests'], 6)
+            self.assertEqual(stats['documents'], 7)
+            self.assertEqual(stats['timeouts'], 2)
+            self.assertGreater(stats['latency']['max'], 0)
+            self.assertLessEqual(stats['latency']['p50'], stats['latency']['p99'])
+
+    def test_backpressure(self) -> None:
+        """
+        Test the requests are rejected if there are too many pending documents.
+        """
+        with tempfile.TemporaryDirectory() as d:
+            with DetexServer(socket_path=os.path.join(d, 'detex.sock'), workers=1, max_pending=1) as server:
+                slow = ' '.join(f'\\cite{{k{i}}}' for i in range(20000))
+                results = []
+                th = threading.Thread(target=lambda: results.append(_request(server, 'POST', '/detex',
+                                                                                {'text': slow})))
+                th.start()
+                while server.stats()['pending'] == 0:
+                    time.sleep(0.01)
+                self.assertEqual(_request(server, 'POST', '/detex', {'text': 'a'})[0], 503)
+                self.assertEqual(_request(server, 'GET', '/stats')[1]['queue_depth'], 0)
+                th.join()
+                self.assertEqual(results[0][0], 200)
+                self.assertEqual(_request(server, 'POST', '/detex', {'text': 'a'}), (200, {'text': 'a'}))
+                self.assertEqual(server.stats()['rejected'], 1)
+            self.assertFalse(os.path.exists(os.path.join(d, 'detex.sock')))
+
+    def test_timeouts(self) -> None:
+        """
+        Test the documents are timed from their start, and keep their slots until done.
+        """
+        with DetexServer(port=0, workers=1, timeout=3) as server:
+            # The queued documents are not failed for waiting
+            code = ' '.join(f'\\cite{{k{i}}}' for i in range(15000))
+            status, data = _request(server, 'POST', '/detex', {'documents': [{'text': code}] * 5})
+            self.assertEqual(data['results'], [{'text': pip.strict(code)}] * 5)
+
+            # The documents which exceed the timeout hold their slots until done
+            slow = ' '.join(f'\\cite{{k{i}}}' for i in range(40000))
+            results = []
+            th = threading.Thread(target=lambda: results.append(_request(server, 'POST', '/detex', {
+                'documents': [{'text': slow}] * 3, 'timeout': 1})))
+            th.start()
+            while server.stats()['pending'] == 0:
+                time.sleep(0.01)
+            self.assertGreater(server.stats()['queue_depth'], 0)
+            th.join()
+            self.assertEqual(results[0][1]['results'], [{'error': 'time budget exceeded'}] * 3)
+            self.assertEqual(server.stats()['pending'], 0)
+            t0 = time.monotonic()
+            self.assertEqual(_request(server, 'POST', '/detex', {'text': 'hello \\textbf{x}'}),
+                             (200, {'text': 'hello x'}))
+            self.assertLess(time.monotonic() - t0, 0.5)  # The worker is not busy
+
+            # A worker which does not answer within the timeout is killed and started again
+            worker = server._workers[0]
+            pid = worker._process.pid
+            with self.assertRaises(TimeoutError):
+                worker.run((slow, 'strict', 'en', {}, 30), 0.1)
+            self.assertNotEqual(worker._process.pid, pid)
+            self.assertEqual(server.stats()['restarts'], 1)
+            self.assertEqual(_request(server, 'POST', '/detex', {'text': 'hello \\textbf{x}'}),
+                             (200, {'text': 'hello x'}))
@@ -0,0 +1,110 @@
+"""
+PyDetex
+https://github.com/ppizarror/PyDetex
+
+TEST SOURCEMAP
+Test the map of the output positions to the source.
+"""
+
+from test._base import BaseTest
+
+import os
+import tempfile
+
+import pydetex.parsers as par
+import pydetex.pipelines as pip
+import pydetex.profiling as prof
+import pydetex.sourcemap as sm
+from pydetex.cache import ResultCache
+from pydetex.sourcemap import SourceMap, SourceMapper
+from pydetex.utils import open_file
+
+_CODE = """\\documentclass{article}
+\\begin{document}
+\\section{Intro}
+The \\textbf{model} is good \\cite{a}, % comment
+see \\ref{eq}.
+
+\\begin{equation}
+x = 1 \\label{eq}
+\\end{equation}
+The \\emph{final} word.
+\\end{document}
+"""
+
+
+class SourceMapTest(BaseTest):
+
+    def _assert_runs(self, s: str, out: str, source_map: 'SourceMap') -> None:
+        """
+        Assert each run of the map is a text copied from the source.
+
+        :param s: Source
+        :param out: Output
+        :param source_map: Map
+        """
+        self.assertEqual(source_map.source, s)
+        self.assertEqual(source_map.output_size, len(out))
+        last = (-1, -1)
+        for o, i, n in source_map:
+            self.assertEqual(out[o:o + n], s[i:i + n])
+            self.assertGreater(o, last[0])
+            self.assertGreater(i, last[1])
+            last = (o, i)
+
+    def test_map(self) -> None:
+        """
+        Test the map lookups and composition.
+        """
+        m = SourceMap.from_diff('a \\textbf{word} b', 'a word b')
+        self.assertEqual(list(m), [(0, 0, 2), (2, 10, 4), (6, 15, 2)])
+        self.assertEqual(m.to_source(2), 10)
+        self.assertEqual(m.to_source_range(2, 6), (10, 14))
+        self.assertEqual(m.to_source(100), 17)
+        self.assertEqual(m.position(7), (0, 16))
+
+        # The text not copied is mapped to the end of the previous run
+        m = SourceMap.from_diff('x \\cite{a} y', 'x [1] y')
+        self.assertEqual(m.to_source(3), 2)
+        self.assertEqual(m.to_source(6), 11)
+
+        # Composition
+        m1 = SourceMap.from_diff('a\n\\textbf{b} c', 'a\nb c')
+        m2 = SourceMap.from_diff('a\nb c', 'b c!')
+        m = m1.then(m2)
+        self.assertEqual(list(m), [(0, 10, 1), (1, 12, 2)])
+        self.assertEqual(m.position(2), (1, 11))
+        self.assertEqual(len(SourceMap.identity('abc')), 1)
+        self.assertEqual(len(SourceMap.from_diff('abc', '')), 0)
+
+    def test_pipelines(self) -> None:
+        """
+        Test the maps of the pipelines.
+        """
+        for pipeline in (pip.simple, pip.strict, pip.fast):
+            out, m = sm.detex(_CODE, pipeline)
+            self.assertEqual(out, pipeline(_CODE))
+            self._assert_runs(_CODE, out, m)
+            i = out.index('model')
+            self.assertEqual(_CODE[slice(*m.to_source_range(i, i + 5))], 'model')
+            self.assertEqual(m.position(out.index('final')), (9, 10))
+        for f in ('example_simple_cite.txt', 'example_tables_strict.txt', 'example_simple_itemize.txt'):
+            s = open_file(os.path.join('test', 'data', f))
+            out, m = sm.detex(s)
+            self._assert_runs(s, out, m)
+            self.assertGreater(sum(n for _, _, n in m), 0.9 * len(out))
+
+        # The result read from the cache is mapped from the differences
+        with tempfile.TemporaryDirectory() as d:
+            cache = ResultCache(os.path.join(d, 'cache.db'))
+            out, m = sm.detex(_CODE, cache=cache)
+            out_cached, m_cached = sm.detex(_CODE, cache=cache)
+            self.assertEqual(out, out_cached)
+            self._assert_runs(_CODE, out, m_cached)
+            cache.close()
+
+        # Stages called alone
+        mapper = SourceMapper()
+        with prof.Profiler(mapper):
+            out = par.remove_tag('a \\textbf{b} c', 'textbf')
+        self._assert_runs('a \\textbf{b} c', out, mapper.source_map)
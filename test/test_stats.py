@@ -0,0 +1,82 @@
+"""
+PyDetex
+https://github.com/ppizarror/PyDetex
+
+TEST STATS
+Test the stats and the command line interface.
+"""
+
+from test._base import BaseTest
+
+import contextlib
+import io
+import json
+import os
+import tempfile
+
+import pydetex.cli as cli
+import pydetex.stats as st
+
+
+class StatsTest(BaseTest):
+
+    def test_count(self) -> None:
+        """
+        Test the stats count.
+        """
+        s = 'preamble \\begin{document}Intro text with $x$ math % comment\n' \
+            '\\section{First section}\nSome words \\textbf{bold} here \\cite{a, b}.\n' \
+            '\\begin{equation}y=2\\end{equation}\n' \
+            '\\begin{figure}[h]\\includegraphics{fig.png}\\caption{A nice figure}\\label{fig:a}\\end{figure}\n' \
+            '\\subsection*{Second}Final \\(z\\) words \\ref{fig:a}.\\end{document}'
+        sections = st.count(s)
+        self.assertEqual(len(sections), 3)
+        intro, first, second = sections
+        self.assertEqual((intro.title, intro.level, intro.words, intro.math_inline), ('', -1, 4, 1))
+        self.assertEqual((first.title, first.level, first.header_words), ('First section', 2, 2))
+        self.assertEqual((first.words, first.cites, first.math_display), (4, 2, 1))
+        self.assertEqual((first.captions, first.caption_words), (1, 3))
+        self.assertEqual((second.title, second.level, second.words, second.math_inline), ('Second', 3, 2, 1))
+        t = st.total(sections)
+        self.assertEqual((t.words, t.header_words, t.math_inline, t.cites), (10, 3, 2, 2))
+        self.assertEqual(t.as_dict()['caption_words'], 3)
+
+        # Redefined sections are not counted
+        self.assertEqual(len(st.count('\\renewcommand{\\section}{\\textbf{X}}')), 1)
+        self.assertEqual(len(st.count('')), 1)
+
+    def test_cli(self) -> None:
+        """
+        Test the command line interface.
+        """
+        f = os.path.join(tempfile.gettempdir(), 'pydetex_test_cli.tex')
+        with open(f, 'w', encoding='utf-8') as o:
+            o.write('\\section{Title}This is \\textit{nice}')
+
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            self.assertEqual(cli.main(['stats', f, '--json', '--sections']), 0)
+        data = json.loads(out.getvalue())
+        self.assertEqual(data[f]['total']['words'], 3)
+        self.assertEqual(data[f]['sections'][1]['title'], 'Title')
+
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            self.assertEqual(cli.main(['stats', f, '-s']), 0)
+        self.assertIn('Title', out.getvalue())
+
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            self.assertEqual(cli.main(['detex', f, '-p', 'simple']), 0)
+        self.assertIn('This is nice', out.getvalue())
+
+        # Write to a folder
+        folder = os.path.join(tempfile.gettempdir(), 'pydetex_test_cli')
+        self.assertEqual(cli.main(['detex', f, '-o', folder]), 0)
+        self.assertTrue(os.path.isfile(os.path.join(folder, 'pydetex_test_cli.txt')))
+
+        # Missing files
+        with contextlib.redirect_stderr(io.StringIO()):
+            self.assertEqual(cli.main(['stats', f + '.missing']), 1)
+            self.assertEqual(cli.main(['detex', f + '.missing']), 1)
+        os.remove(f)
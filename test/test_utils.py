@@ -8,8 +8,14 @@ Test utils.
 
 from test._base import BaseTest
 
+import os
+import tempfile
+import threading
+import time
+
 import pydetex.utils as ut
 from pydetex import version as ver
+from pydetex._fonts import FONT_TAGS
 from typing import Tuple, List
 
 
@@ -93,6 +99,13 @@ class UtilsTest(BaseTest):
         t = 'this review was made by several other ¿<repeated:6>reviewers</repeated>! but also this <repeated:4>review</repeated>.'
         self.assertEqual(ut.check_repeated_words(s, 'en', 3, 15, True, True), t)
 
+        # Window limits, the distance is taken from the last repetition
+        s = 'house tree tree lake house house'
+        t = 'house tree <repeated:1>tree</repeated> lake house <repeated:1>house</repeated>'
+        self.assertEqual(ut.check_repeated_words(s, 'en', 3, 3, True, True), t)
+        t = 'house tree <repeated:1>tree</repeated> lake <repeated:4>house</repeated> <repeated:1>house</repeated>'
+        self.assertEqual(ut.check_repeated_words(s, 'en', 3, 4, True, True), t)
+
     def test_get_diff_startend_word(self) -> None:
         """
         Test word diff.
@@ -127,6 +140,54 @@ class UtilsTest(BaseTest):
                          [('<A>', 'This is a complex'), ('<B>', 'example'), ('<A>', 'but however we should focus on'),
                           ('<C>', 'these'), ('<B>', 'ideas'), ('<A>', 'and'), ('<B>', 'core concepts'), ('<A>', 'yes')])
 
+    def test_tags_to_spans(self) -> None:
+        """
+        Test font tags to style spans.
+        """
+        ft = FONT_TAGS
+        self.assertEqual(ut.tags_to_spans('nice'), ('nice', []))
+        self.assertEqual(ut.tags_to_spans(''), ('', []))
+        s = f'{ft["bold"]}This{ft["normal"]} is {ft["italic"]}very{ft["italic"]} epic{ft["normal"]}!'
+        self.assertEqual(ut.tags_to_spans(s), ('This is very epic!', [(0, 4, 'bold'), (8, 17, 'italic')]))
+        s = f'A{ft["link"]}{ft["bold"]}B{ft["link"]}C{ft["normal"]}'
+        self.assertEqual(ut.tags_to_spans(s), ('ABC', [(1, 2, 'bold'), (2, 3, 'link')]))
+
+    def test_split_spans_lines(self) -> None:
+        """
+        Test styled text split by lines.
+        """
+        self.assertEqual(ut.split_spans_lines('', []), [('', ())])
+        self.assertEqual(ut.split_spans_lines('ab\ncd', [(1, 4, 'bold')]),
+                         [('ab', ((1, 2, 'bold'),)), ('cd', ((0, 1, 'bold'),))])
+        self.assertEqual(ut.split_spans_lines('ab\n\ncd\n', [(0, 2, 'bold'), (2, 3, 'link'), (4, 5, 'a'), (5, 6, 'b')]),
+                         [('ab', ((0, 2, 'bold'),)), ('', ()), ('cd', ((0, 1, 'a'), (1, 2, 'b'))), ('', ())])
+
+    def test_diff_lines(self) -> None:
+        """
+        Test line diff.
+        """
+        self.assertEqual(ut.diff_lines(['a', 'b'], ['a', 'b']), [])
+        self.assertEqual(ut.diff_lines(['a', 'b', 'c'], ['a', 'x', 'c']), [(1, 2, 1, 2)])
+        self.assertEqual(ut.diff_lines(['a'], ['a', 'b']), [(1, 1, 1, 2)])
+
+        # A single paragraph change on a long document only rewrites such paragraph
+        text, spans = ut.tags_to_spans(FONT_TAGS['bold'].join(f'Paragraph {i}\n' for i in range(2000)))
+        old = ut.split_spans_lines(text, spans)
+        new = old.copy()
+        new[1000] = ('Paragraph changed', new[1000][1])
+        self.assertEqual(ut.diff_lines(old, new), [(1000, 1001, 1000, 1001)])
+
+        # Large outputs, with repeated blank lines, are compared in near linear time
+        old = [x for i in range(10000) for x in (f'Old paragraph {i}', '')]
+        new = [x for i in range(10000) for x in (f'New paragraph {i}', '')]
+        t = time.time()
+        self.assertEqual(ut.diff_lines(old, new), [(0, 19999, 0, 19999)])  # Full rewrite
+        new = old.copy()
+        new[15000] = 'Changed'
+        new[5000:5001] = ['Changed', '', 'Added']
+        self.assertEqual(ut.diff_lines(old, new), [(5000, 5001, 5000, 5003), (15000, 15001, 15002, 15003)])
+        self.assertLess(time.time() - t, 1)
+
     def test_validate(self) -> None:
         """
         Test validate.
@@ -720,6 +781,184 @@ class UtilsTest(BaseTest):
         pb.reset()
         self.assertEqual(pb._current, 0)
 
+    def test_corpus_index(self) -> None:
+        """
+        Tests the corpus index.
+        """
+        self.assertRaises(ValueError, lambda: ut.CorpusIndex('unk'))
+        idx = ut.CorpusIndex('en', min_chars=3)
+        ch1 = 'this review was made by several other ¿reviewers! but also this review.'
+        ch2 = 'The authors proposed a model which consider many semantic things, but overall the proposal is not good'
+        idx.add('ch1', ch1)
+        idx.add('ch2', ch2)
+        self.assertEqual(len(idx), 2)
+        self.assertIn('ch1', idx)
+        self.assertEqual(idx.documents(), ['ch1', 'ch2'])
+
+        # Frequencies and positions
+        self.assertEqual(idx.frequency('reviews', 'ch1'), 3)
+        self.assertEqual(idx.frequency('reviews', 'ch2'), 0)
+        self.assertEqual(idx.frequency('proposal'), 2)
+        self.assertEqual(idx.frequency('this'), 0)  # Stopword
+        self.assertEqual(idx.positions('review', 'ch1'), [1, 7, 11])
+
+        # Repetitions are the same as the marked ones
+        self.assertEqual(idx.repeated('ch1', 15), [('review', 1, 7), ('review', 7, 11)])
+        self.assertEqual(idx.repeated('ch1', 5), [('review', 7, 11)])
+        self.assertEqual(idx.repeated('ch2', 15), [('propos', 2, 13)])
+        self.assertIn('<repeated:11>proposal', ut.check_repeated_words(ch2, 'en', 3, 15, True, True))
+        overused = idx.overused('ch1')
+        self.assertEqual(len(overused), 1)
+        self.assertEqual(overused[0][0:2], ('review', 3))
+        self.assertGreater(overused[0][2], 1)  # Only used in this chapter
+        self.assertEqual(idx.overused('ch2', min_count=1)[0][0:2], ('propos', 2))
+
+        # Update a document
+        idx.add('ch2', ch1)
+        self.assertEqual(idx.frequency('proposal'), 0)
+        self.assertEqual(idx.frequency('review'), 6)
+        self.assertAlmostEqual(idx.overused('ch2')[0][2], 1)
+        self.assertTrue(idx.remove('ch2'))
+        self.assertFalse(idx.remove('ch2'))
+        self.assertEqual(idx.frequency('review'), 3)
+
+        # The terms without documents, and their filtered words, are removed
+        # noinspection PyProtectedMember
+        self.assertNotIn('propos', idx._term_id)
+        # noinspection PyProtectedMember
+        self.assertNotIn('proposal', idx._filtered)
+        sizes = []
+        for i in range(20):
+            idx.add('ch2', f'{ch2} word{chr(97 + i)}s')
+            idx.add('ch3', f'other{i} ' + ch1)
+            idx.remove('ch3')
+            # noinspection PyProtectedMember
+            sizes.append(len(idx._terms))
+        self.assertEqual(sizes, [sizes[0]] * 20)
+        # noinspection PyProtectedMember
+        self.assertEqual(set(idx._filtered.keys()), set(f'{ch1} {ch2} wordts'.split()))
+        self.assertEqual(idx.frequency('wordts'), 1)
+        self.assertEqual(idx.frequency('wordss'), 0)
+        self.assertEqual(idx.positions('proposal', 'ch2'), [2, 13])
+        self.assertEqual(idx.repeated('ch2', 15), [('propos', 2, 13)])
+        self.assertEqual(idx.frequency('review'), 3)
+
+    def test_stem_cache(self) -> None:
+        """
+        Tests the stemmers and the stem cache.
+        """
+        self.assertIs(ut.make_stemmer('en'), ut.make_stemmer('en'))
+        self.assertIsNone(ut.make_stemmer('unk'))
+        self.assertEqual(ut.stem_word('word', 'unk'), 'word')
+        stats = ut.get_stem_cache_stats()
+        self.assertEqual(ut.stem_word('reviewers', 'en'), 'review')
+        self.assertEqual(ut.stem_word('reviewers', 'en'), 'review')
+        new_stats = ut.get_stem_cache_stats()
+        self.assertGreaterEqual(new_stats['hits'], stats['hits'] + 1)
+        self.assertLessEqual(new_stats['misses'], stats['misses'] + 1)
+
+        # Save and load
+        f = os.path.join(tempfile.gettempdir(), 'pydetex_test.stem')
+        self.assertTrue(ut.save_stem_cache(f))
+        # noinspection PyProtectedMember
+        from pydetex._utils_lang import _STEM_CACHE
+        _STEM_CACHE['en'].pop('reviewers')
+        self.assertTrue(ut.load_stem_cache(f))
+        self.assertEqual(_STEM_CACHE['en']['reviewers'], 'review')
+        os.remove(f)
+        self.assertFalse(ut.load_stem_cache(f))
+
+        # Shared by many threads, evicting the words
+        # noinspection PyProtectedMember
+        import pydetex._utils_lang as lang_utils
+        size, lang_utils._STEM_CACHE_SIZE = lang_utils._STEM_CACHE_SIZE, 50
+        errors = []
+
+        def _stem(i: int) -> None:
+            """
+            Stem many words.
+            """
+            try:
+                for j in range(3000):
+                    ut.stem_word(f'words{(i * 7 + j) % 120}', 'en')
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=_stem, args=(i,)) for i in range(8)]
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+        lang_utils._STEM_CACHE_SIZE = size
+        self.assertEqual(errors, [])
+        self.assertLessEqual(len(_STEM_CACHE['en']), 50)
+
+    def test_latency_counter(self) -> None:
+        """
+        Tests the latency counter.
+        """
+        lc = ut.LatencyCounter()
+        self.assertEqual(lc.stats('key'), (0, 0, 0))
+        lc.add('key', 0.002)
+        lc.add('key', 0.004)
+        calls, mean, max_ = lc.stats('key')
+        self.assertEqual(calls, 2)
+        self.assertAlmostEqual(mean, 0.003)
+        self.assertAlmostEqual(max_, 0.004)
+        with lc.measure('cursor'):
+            pass
+        self.assertEqual(lc.stats('cursor')[0], 1)
+        try:
+            with lc.measure('cursor'):
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual(lc.stats('cursor')[0], 2)
+        lc.detail_times()
+        lc.reset()
+        self.assertEqual(lc.stats('key'), (0, 0, 0))
+
+    def test_mmap_scanner(self) -> None:
+        """
+        Tests the byte level scanner.
+        """
+        s = '\\documentclass{article}\n\\begin{document}\nText é $x$ 10\\% % comment\n' \
+            '\\begin{verbatim}\n$ % \\end{itemize}\n\\end{verbatim}\n\\input{a} \\import{dir/}{b}\n' \
+            '\\begin{itemize}\\item \\[y\\]\\end{itemize}\\\\% end\n\\end{document}\nafter'
+        f = os.path.join(tempfile.gettempdir(), 'pydetex_test_mmap.tex')
+        with open(f, 'w', encoding='utf-8') as fo:
+            fo.write(s)
+        b = s.encode('utf-8')
+        with ut.TexMmapScanner(f, ['verbatim']) as sc:
+            self.assertEqual(len(sc), len(b))
+            self.assertEqual([b[i:j] for i, j in sc.comments()], [b'% comment', b'% end'])
+            self.assertEqual([b[i:j] for i, j in sc.math()], [b'$x$', b'\\[y\\]'])
+            self.assertEqual([(e[0], b[e[1]:e[2]].endswith(b'\\end{' + e[0].encode() + b'}')) for e in sc.environments()],
+                             [('document', True), ('verbatim', True), ('itemize', True)])
+            self.assertEqual([(i[0], i[3]) for i in sc.inputs()], [('input', 'a'), ('import', 'dir/b')])
+            self.assertEqual(''.join(sc.text(piece_size=8)),
+                             '\nText é $x$ 10\\% %\n\n\\input{a} \\import{dir/}{b}\n'
+                             '\\begin{itemize}\\item \\[y\\]\\end{itemize}\\\\%\n')
+        os.remove(f)
+
+        # Nested environments of the same name, and the numbered commands within these
+        s = 'See \\cite{b}.\n\\begin{tabular}{c}\n\\begin{tabular}{c} x \\end{tabular} & cell \\cite{a} \\\\\n' \
+            '\\end{tabular}\nEnd \\ref{c}.'
+        with open(f, 'w', encoding='utf-8') as fo:
+            fo.write(s)
+        with ut.TexMmapScanner(f, ['tabular']) as sc:
+            self.assertEqual(len(sc.environments()), 1)
+            self.assertEqual(sc.numbered(), [(14, '\\begin{tabular}\\cite{a}\\end{tabular}')])
+            self.assertEqual(''.join(sc.text()), 'See \\cite{b}.\n\\begin{tabular}\\cite{a}\\end{tabular}\nEnd \\ref{c}.')
+        os.remove(f)
+
+        # Empty file
+        with open(f, 'w', encoding='utf-8') as fo:
+            fo.write('')
+        with ut.TexMmapScanner(f) as sc:
+            self.assertEqual(list(sc.text()), [])
+        os.remove(f)
+
     def test_version(self) -> None:
         """
         Test version.
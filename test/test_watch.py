@@ -0,0 +1,131 @@
+"""
+PyDetex
+https://github.com/ppizarror/PyDetex
+
+TEST WATCH
+Test the project watcher.
+"""
+
+from test._base import BaseTest
+
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import time
+
+import pydetex.cli as cli
+import pydetex.pipelines as pip
+from pydetex.utils import open_file
+from pydetex.watch import ProjectWatcher
+
+
+class WatchTest(BaseTest):
+
+    def test_watcher(self) -> None:
+        """
+        Test the project watcher.
+        """
+        root = tempfile.mkdtemp()
+        files = {
+            'main.tex': '\\documentclass{article}\\begin{document}Main \\input{chapters/one}\\end{document}',
+            'other.tex': '\\documentclass{article}\\begin{document}Other\\end{document}',
+            'chapters/one.tex': 'One \\input{chapters/fig}',
+            'chapters/fig.tex': 'Figure',
+            'unused.tex': 'Unused'
+        }
+
+        def _write(f: str, s: str) -> None:
+            """
+            Write a file, with a new modification time.
+            """
+            os.makedirs(os.path.dirname(os.path.join(root, f)), exist_ok=True)
+            with open(os.path.join(root, f), 'w', encoding='utf-8') as fo:
+                fo.write(s)
+            t = time.time_ns() + len(updates) * 10 ** 9
+            os.utime(os.path.join(root, f), ns=(t, t))
+
+        updates = []
+        for f in files.keys():
+            _write(f, files[f])
+        w = ProjectWatcher(root, lambda m, out: updates.append((m, out)), pip.simple, debounce=0, use_inotify=False)
+        self.assertFalse(w.inotify)
+        self.assertEqual(w.build(), ['main.tex', 'other.tex'])
+        self.assertEqual(updates, [('main.tex', 'Main One Figure'), ('other.tex', 'Other')])
+        self.assertEqual(w.check(), [])
+
+        # Only the documents which include the changed files are processed
+        _write('chapters/fig.tex', 'New figure')
+        self.assertEqual(w.affected({'chapters/fig.tex'}), ['main.tex'])
+        self.assertEqual(w.check(), ['main.tex'])
+        self.assertEqual(updates[-1], ('main.tex', 'Main One New figure'))
+        _write('unused.tex', 'Still unused')
+        self.assertEqual(w.check(), [])
+
+        # New documents
+        _write('new.tex', '\\documentclass{article}\\begin{document}New \\input{chapters/fig}\\end{document}')
+        self.assertEqual(w.check(), ['new.tex'])
+        _write('chapters/fig.tex', 'Last figure')
+        self.assertEqual(w.check(), ['main.tex', 'new.tex'])
+
+        # The includes not found are processed once created
+        _write('late.tex', '\\documentclass{article}\\begin{document}Late \\input{chapters/later}\\end{document}')
+        self.assertEqual(w.check(), ['late.tex'])
+        self.assertEqual(updates[-1], ('late.tex', 'Late \\input{chapters/later}'))
+        _write('chapters/later.tex', 'Later')
+        self.assertEqual(w.check(), ['late.tex'])
+        self.assertEqual(updates[-1], ('late.tex', 'Late Later'))
+        os.remove(os.path.join(root, 'late.tex'))
+        os.remove(os.path.join(root, 'chapters/later.tex'))
+        self.assertEqual(w.check(), [])
+        w.close()
+
+        # The documents which cannot be processed are reported, and the watcher continues
+        def _pipeline(code: str, lang: str, **kwargs) -> str:
+            """
+            Pipeline which fails on some documents.
+            """
+            if 'Broken' in code:
+                raise ValueError('broken document')
+            if 'Crash' in code:
+                raise KeyError('crash')
+            return pip.simple(code, lang, **kwargs)
+
+        _write('other.tex', '\\documentclass{article}\\begin{document}Broken\\end{document}')
+        w = ProjectWatcher(root, lambda m, out: updates.append((m, out)), _pipeline, debounce=0, use_inotify=False)
+        err = io.StringIO()
+        with contextlib.redirect_stderr(err):
+            _write('new.tex', '\\documentclass{article}\\begin{document}Crash \\input{chapters/fig}\\end{document}')
+            self.assertEqual(w.build(), ['main.tex'])
+            _write('other.tex', '\\documentclass{article}\\begin{document}Fixed\\end{document}')
+            self.assertEqual(w.check(), ['other.tex'])
+            _write('new.tex', '\\documentclass{article}\\begin{document}New \\input{chapters/fig}\\end{document}')
+            self.assertEqual(w.check(), ['new.tex'])
+        self.assertEqual(err.getvalue(), "Cannot process new.tex: 'crash'\nCannot process other.tex: broken document\n")
+        self.assertEqual(updates[-2:], [('other.tex', 'Fixed'), ('new.tex', 'New Last figure')])
+        w.close()
+
+        # The outputs of the documents within subfolders are kept apart
+        out = tempfile.mkdtemp()
+        _write('a/main.tex', '\\documentclass{article}\\begin{document}A\\end{document}')
+        _write('b/main.tex', '\\documentclass{article}\\begin{document}B\\end{document}')
+        args = argparse.Namespace(output=out)
+        for m, text in (('a/main.tex', 'A'), ('b/main.tex', 'B')):
+            with open(cli._output_file(m, args, relative=True), 'w', encoding='utf-8') as o:
+                o.write(text)
+        self.assertEqual(open_file(os.path.join(out, 'a', 'main.txt')), 'A')
+        self.assertEqual(open_file(os.path.join(out, 'b', 'main.txt')), 'B')
+        shutil.rmtree(out)
+
+        # Inotify wakes up on changes
+        w = ProjectWatcher(root, lambda m, out: updates.append((m, out)))
+        if w.inotify:
+            w.build()
+            self.assertFalse(w._inotify.wait(0))
+            _write('chapters/fig.tex', 'Figure')
+            self.assertTrue(w._inotify.wait(1))
+            self.assertEqual(w.check(), ['main.tex', 'new.tex'])
+        w.close()
+        shutil.rmtree(root)